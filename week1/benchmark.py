@@ -0,0 +1,472 @@
+import argparse
+import importlib
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import types
+from collections import Counter
+
+import numpy as np
+
+from . import blend
+from . import scanner
+from . import searchindex
+from . import similarity
+from . import transforms
+from . import utils
+
+# Maya free benchmarks of the library code paths, run with:
+#   python -m pose_library.week1.benchmark scan --files 10000
+#   python -m pose_library.week1.benchmark search --poses 100000
+#   python -m pose_library.week1.benchmark parallel --latency 0.002 --workers 16
+#   python -m pose_library.week1.benchmark similarity --poses 50000 --controls 100
+#   python -m pose_library.week1.benchmark blend --controls 5000
+#   python -m pose_library.week1.benchmark keys --controls 600
+
+
+def timeCall(func, repeat=5):
+    """Best wall clock time of several calls, the first call also warms the os caches"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def makeSyntheticDirectory(directory, fileCount, thumbnailRatio=0.5):
+    """
+    Fill a directory with small json poses and thumbnails
+    Args:
+        directory (str): Directory to fill, created if needed
+        fileCount (int): Total number of files, poses plus thumbnails
+        thumbnailRatio (float): Fraction of the poses that get a thumbnail
+    Returns:
+        int: Number of pose files written
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    poseCount = int(round(fileCount / (1.0 + thumbnailRatio)))
+    thumbnailCount = fileCount - poseCount
+    poseBytes = json.dumps({"ctrl_{}".format(index): [0.0] * 16 for index in range(8)}).encode("utf-8")
+    for index in range(poseCount):
+        poseName = "pose_{:06d}".format(index)
+        with open(os.path.join(directory, poseName + ".pose"), "wb") as fp:
+            fp.write(poseBytes)
+        if index < thumbnailCount:
+            with open(os.path.join(directory, poseName + ".png"), "wb") as fp:
+                fp.write(b"\x89PNG")
+    return poseCount
+
+
+def legacyScan(charDirectory):
+    """The scan updatePoseView did before scanner.py, listdir then per pose stat and image probes"""
+    posesDataDict = {}
+    for poseFile in utils.getValidPoseFiles(os.listdir(charDirectory)):
+        poseFileInfo = utils.getPoseFileInformation(os.path.join(charDirectory, poseFile))
+        posesDataDict[poseFileInfo["poseName"]] = poseFileInfo
+    return posesDataDict
+
+
+def benchmarkScan(fileCount=10000, repeat=5, directory=None):
+    """
+    Compare the legacy scan with scanner.scanPoseFileInformation on a synthetic directory
+    Returns:
+        dict: Timings in seconds and the speedup
+    """
+    tempDirectory = None
+    if directory is None:
+        tempDirectory = tempfile.mkdtemp(prefix="poselibrary_scan_")
+        directory = tempDirectory
+    try:
+        poseCount = makeSyntheticDirectory(directory, fileCount)
+        legacyTime, legacyResult = timeCall(lambda: legacyScan(directory), repeat)
+        scanTime, scanResult = timeCall(lambda: scanner.scanPoseFileInformation(directory), repeat)
+        if legacyResult != scanResult:
+            raise AssertionError("The scanners disagree on {}".format(directory))
+    finally:
+        if tempDirectory:
+            shutil.rmtree(tempDirectory)
+    report = {"files": fileCount, "poses": poseCount, "legacy": legacyTime, "scandir": scanTime,
+              "speedup": legacyTime / scanTime if scanTime else float("inf")}
+    print("scan {files} files ({poses} poses): legacy {legacy:.4f}s, scandir {scandir:.4f}s, "
+          "{speedup:.1f}x faster".format(**report))
+    return report
+
+
+def makeSearchDocuments(poseCount, characterCount=200, seed=0):
+    """Synthetic library of camelCase pose names built from a small vocabulary, many shared words"""
+    words = ["left", "right", "arm", "leg", "hand", "fist", "open", "point", "smile", "angry", "walk", "run",
+             "jump", "idle", "sit", "crouch", "wave", "grab", "look", "reach"]
+    generator = random.Random(seed)
+    documents = []
+    characters = []
+    for index in range(characterCount):
+        character = "character{:03d}".format(index)
+        category = "category{}".format(index % 8)
+        characters.append((character, category))
+        documents.append(searchindex.SearchDocument(searchindex.CHARACTER_KIND, character, character, category, ()))
+    for index in range(poseCount):
+        poseName = "{}{}_{}{:02d}".format(generator.choice(words), generator.choice(words).capitalize(),
+                                          generator.choice(words), index % 100)
+        character, category = characters[index % characterCount]
+        tags = (generator.choice(["Body", "Hand", "Face"]), "ns{}".format(index % 7))
+        documents.append(searchindex.SearchDocument(searchindex.POSE_KIND, poseName, character, category, tags))
+    return documents
+
+
+def benchmarkSearch(poseCount=100000, queries=None):
+    """
+    Build a search index over synthetic poses and time every keystroke of a few typed queries
+    Returns:
+        dict: Build time and the median / worst keystroke latency in seconds
+    """
+    queries = queries or ["leftArm", "hand face", "character01", "rm_wa", "body ns3"]
+    documents = makeSearchDocuments(poseCount)
+    start = time.perf_counter()
+    index = searchindex.SearchIndex(documents)
+    buildTime = time.perf_counter() - start
+    latencies = []
+    for query in queries:
+        for length in range(1, len(query) + 1):
+            start = time.perf_counter()
+            index.search(query[:length])
+            latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    report = {"poses": poseCount, "build": buildTime, "keystrokes": len(latencies),
+              "median": latencies[len(latencies) // 2], "worst": latencies[-1]}
+    print("search {poses} poses: build {build:.2f}s, {keystrokes} keystrokes, median {median:.5f}s, "
+          "worst {worst:.5f}s".format(**report))
+    return report
+
+
+def makeSimilarityPoses(poseCount, controlCount, seed=0):
+    """Random poses of one rig, yielded in batches of {poseName: pose data}"""
+    generator = np.random.default_rng(seed)
+    batchSize = 1000
+    for start in range(0, poseCount, batchSize):
+        count = min(batchSize, poseCount - start) * controlCount
+        quaternions = transforms.normalizeQuaternions(generator.normal(size=(count, 4)))
+        matrices = transforms.composeMatrices(generator.normal(size=(count, 3)) * 10.0, quaternions, np.ones((count, 3)))
+        matrices = matrices.reshape(-1, controlCount, 16)
+        yield {"pose_{:06d}".format(start + index): {"ctrl_{}".format(control): matrix.tolist()
+                                                    for control, matrix in enumerate(poseMatrices)}
+               for index, poseMatrices in enumerate(matrices)}
+
+
+def benchmarkSimilarity(poseCount=50000, controlCount=100, queries=20, k=10):
+    """
+    Build a similarity index over random poses and time top k queries
+    Returns:
+        dict: Build time and the median / worst query latency in seconds
+    """
+    index = similarity.PoseSimilarityIndex()
+    buildTime = 0.0
+    for poses in makeSimilarityPoses(poseCount, controlCount):
+        start = time.perf_counter()
+        index.addPoses(poses)
+        buildTime += time.perf_counter() - start
+    queryPoses = next(makeSimilarityPoses(queries, controlCount, seed=1))
+    latencies = []
+    for poseData in queryPoses.values():
+        start = time.perf_counter()
+        index.query(poseData, k)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    report = {"poses": poseCount, "controls": controlCount, "build": buildTime, "k": k,
+              "median": latencies[len(latencies) // 2], "worst": latencies[-1]}
+    print("similarity {poses} poses of {controls} controls: build {build:.2f}s, top {k} query median "
+          "{median:.4f}s, worst {worst:.4f}s".format(**report))
+    return report
+
+
+def makeBlendMatrices(controlCount, seed=0):
+    """Random scaled matrices of two poses, (N, 4, 4) each"""
+    generator = np.random.default_rng(seed)
+    poses = []
+    for _ in range(2):
+        quaternions = transforms.normalizeQuaternions(generator.normal(size=(controlCount, 4)))
+        scales = generator.uniform(0.5, 2.0, size=(controlCount, 3))
+        poses.append(transforms.composeMatrices(generator.normal(size=(controlCount, 3)) * 10.0, quaternions, scales))
+    return poses
+
+
+def benchmarkBlend(controlCount=5000, repeat=20):
+    """
+    Time the batch blend of two poses, once with the decomposition and per slider tick without it, and a
+    weighted blend of four poses
+    Returns:
+        dict: Best timings in seconds and the 60 Hz frame budget
+    """
+    srcMatrices, dstMatrices = makeBlendMatrices(controlCount)
+    fullTime, _ = timeCall(lambda: blend.blendMatrices(srcMatrices, dstMatrices, 0.5), repeat)
+    blender = blend.PoseBlender(srcMatrices, dstMatrices)
+    tickTime, matrices = timeCall(lambda: blender.blend(0.5), repeat)
+    if not np.allclose(blender.blend(0.0), srcMatrices) or not np.allclose(blender.blend(1.0), dstMatrices):
+        raise AssertionError("The blend does not reach its end poses")
+    # four poses in the corners of a blend space, the dragged point moves along the diagonal
+    corners = [(0.0, 0.0), (1.0, 0.0), (0.0, 1.0), (1.0, 1.0)]
+    multiBlender = blend.MultiPoseBlender([srcMatrices, dstMatrices] + makeBlendMatrices(controlCount, seed=1))
+    points = iter(np.linspace(0.05, 0.95, repeat * 2))
+    multiTime, _ = timeCall(lambda: multiBlender.blend(blend.getBlendSpaceWeights((next(points),) * 2, corners)), repeat)
+    report = {"controls": controlCount, "full": fullTime, "tick": tickTime, "multi": multiTime, "frame": 1.0 / 60.0}
+    print("blend {controls} controls: decompose and blend {full:.4f}s, blend per tick {tick:.4f}s, "
+          "4 pose blend space tick {multi:.4f}s, 60 Hz frame {frame:.4f}s".format(**report))
+    return report
+
+
+UNDOABLE_COMMANDS = ("xform", "setKeyframe")
+
+
+class CountingMayaCommands(object):
+    """
+    Stand in for maya.cmds over a rig of transforms: counts every command, spins for a fixed cost per
+    command to model the command overhead of Maya, and counts the keys set
+    """
+    def __init__(self, controls, attributes, commandCost=0.0):
+        self.controls = list(controls)
+        self.nodes = set(self.controls)
+        self.attributes = list(attributes)
+        self.commandCost = commandCost
+        self.calls = Counter()
+        self.keys = 0
+        self.openChunks = 0
+        self.undoSteps = 0
+
+    def command(self, name):
+        self.calls[name] += 1
+        if self.commandCost:
+            end = time.perf_counter() + self.commandCost
+            while time.perf_counter() < end:
+                pass
+        # every edit outside an undo chunk is its own undo step, queries are not recorded
+        if not self.openChunks and name in UNDOABLE_COMMANDS:
+            self.undoSteps += 1
+
+    def ls(self, *args, **kwargs):
+        self.command("ls")
+        if kwargs.get("selection"):
+            return self.controls[:1]
+        return [node for node in args if node in self.nodes]
+
+    def xform(self, *args, **kwargs):
+        self.command("xform")
+
+    def listAttr(self, node, **kwargs):
+        self.command("listAttr")
+        return list(self.attributes)
+
+    def setKeyframe(self, targets, attribute=None, **kwargs):
+        self.command("setKeyframe")
+        targets = [targets] if isinstance(targets, str) else targets
+        self.keys += len(targets) * (1 if attribute else len(self.attributes))
+
+    def undoInfo(self, openChunk=False, closeChunk=False, **kwargs):
+        self.command("undoInfo")
+        if openChunk:
+            if not self.openChunks:
+                self.undoSteps += 1
+            self.openChunks += 1
+        if closeChunk:
+            self.openChunks -= 1
+
+    def warning(self, message):
+        self.command("warning")
+
+    def refresh(self, **kwargs):
+        self.command("refresh")
+
+
+def importLib():
+    """Import lib, with empty maya modules when Maya is not available, the benchmarks replace lib.mc"""
+    try:
+        importlib.import_module("maya.cmds")
+    except ImportError:
+        modules = {name: types.ModuleType(name) for name in ("maya", "maya.cmds", "maya.api", "maya.api.OpenMaya")}
+        modules["maya"].cmds = modules["maya.cmds"]
+        modules["maya"].api = modules["maya.api"]
+        modules["maya.api"].OpenMaya = modules["maya.api.OpenMaya"]
+        for name, module in modules.items():
+            sys.modules.setdefault(name, module)
+    from . import lib
+    return lib
+
+
+def legacyApplyPose(mc, poseData):
+    """
+    applyPose before lib.keyControls and its undo chunk: an ls and an xform per control, then a listAttr per
+    control and a setKeyframe per attribute, each command its own undo step
+    """
+    mc.ls(selection=True)
+    for control, matrix in poseData.items():
+        if not mc.ls(control):
+            continue
+        mc.xform(control, matrix=matrix, objectSpace=True)
+        keyableAttrs = mc.listAttr(control, keyable=True) or []
+        for attr in keyableAttrs:
+            mc.setKeyframe(control, attribute=attr)
+
+
+class XformApplyEngine(object):
+    """Stand in for poseapply.PoseApplyEngine, poses every control with one ls and one xform"""
+    def __init__(self, mc):
+        self.mc = mc
+
+    def apply(self, poseItems, namespace=None, selectedControls=None, excludeRootAndMainControls=False):
+        posedControls = []
+        for control, matrix in poseItems:
+            if self.mc.ls(control):
+                self.mc.xform(control, matrix=matrix, objectSpace=True)
+                posedControls.append(control)
+        return posedControls
+
+
+def benchmarkKeys(controlCount=600, attributeCount=10, commandCost=2e-5):
+    """
+    Apply and key a pose on a counting Maya stand in, with the legacy applyPose and with lib.applyPose
+    Returns:
+        dict: Command counts, undo steps and timings of both paths
+    """
+    lib = importLib()
+    controls = ["ctrl_{}".format(index) for index in range(controlCount)]
+    attributes = ["translateX", "translateY", "translateZ", "rotateX", "rotateY", "rotateZ", "scaleX", "scaleY",
+                  "scaleZ", "visibility"][:attributeCount]
+    poseData = {control: np.identity(4).ravel().tolist() for control in controls}
+    originalCommands = getattr(lib, "mc", None)
+    originalGetApplyEngine = lib.poseapply.getApplyEngine
+    report = {"controls": controlCount, "attributes": attributeCount}
+    try:
+        for label in ("legacy", "bulk"):
+            mc = CountingMayaCommands(controls, attributes, commandCost)
+            lib.mc = mc
+            lib.poseapply.getApplyEngine = lambda: XformApplyEngine(mc)
+            start = time.perf_counter()
+            if label == "legacy":
+                legacyApplyPose(mc, poseData)
+            else:
+                lib.applyPose(poseData, keyPosedControls=True)
+            report[label] = time.perf_counter() - start
+            report[label + "Commands"] = sum(mc.calls.values())
+            report[label + "Keys"] = mc.keys
+            report[label + "UndoSteps"] = mc.undoSteps
+    finally:
+        lib.mc = originalCommands
+        lib.poseapply.getApplyEngine = originalGetApplyEngine
+    if report["legacyKeys"] != report["bulkKeys"]:
+        raise AssertionError("The keying paths set a different number of keys")
+    print("key {controls} controls x {attributes} attributes: legacy {legacyCommands} commands {legacy:.3f}s, "
+          "bulk {bulkCommands} commands {bulk:.3f}s, {bulkKeys} keys, "
+          "undo steps legacy {legacyUndoSteps}, bulk {bulkUndoSteps}".format(**report))
+    return report
+
+
+class LatencyFileSystem(scanner.LocalFileSystem):
+    """Local files with a fixed delay added to every call, a stand in for a network share"""
+    def __init__(self, latency):
+        self.latency = latency
+
+    def listdir(self, path):
+        time.sleep(self.latency)
+        return super(LatencyFileSystem, self).listdir(path)
+
+    def stat(self, path):
+        time.sleep(self.latency)
+        return super(LatencyFileSystem, self).stat(path)
+
+    def readPoseMetadata(self, path):
+        time.sleep(self.latency)
+        return super(LatencyFileSystem, self).readPoseMetadata(path)
+
+
+def makeSyntheticLibrary(directory, categoryCount=2, characterCount=5, poseCount=100):
+    """Fill a library root with categories of characters, returns the character directories"""
+    charDirectories = []
+    for categoryIndex in range(categoryCount):
+        for characterIndex in range(characterCount):
+            charDirectory = os.path.join(directory, "category{}".format(categoryIndex),
+                                         "character{}".format(characterIndex))
+            makeSyntheticDirectory(charDirectory, int(poseCount * 1.5))
+            charDirectories.append(charDirectory)
+    return charDirectories
+
+
+def benchmarkParallelScan(latency=0.002, workers=16, categoryCount=2, characterCount=5, poseCount=100):
+    """
+    Scan a synthetic library with one thread and with a pool, every file system call delayed by latency
+    Returns:
+        dict: Timings in seconds and the speedup
+    """
+    directory = tempfile.mkdtemp(prefix="poselibrary_parallel_")
+    try:
+        makeSyntheticLibrary(directory, categoryCount, characterCount, poseCount)
+        fileSystem = LatencyFileSystem(latency)
+
+        def scan(scanWorkers):
+            parallelScanner = scanner.ParallelScanner(scanWorkers, fileSystem=fileSystem)
+            charDirectories = parallelScanner.getCharacterDirectories(directory)
+            records = parallelScanner.scanPoseDirectories(charDirectories)
+            headers = parallelScanner.readPoseMetadata(
+                [record["fullPath"] for charDirectory in sorted(records) for record in records[charDirectory]])
+            return records, headers
+
+        sequentialTime, sequentialResult = timeCall(lambda: scan(1), 1)
+        parallelTime, parallelResult = timeCall(lambda: scan(workers), 1)
+        if sequentialResult != parallelResult:
+            raise AssertionError("The parallel scan disagrees with the sequential scan")
+    finally:
+        shutil.rmtree(directory)
+    report = {"poses": categoryCount * characterCount * poseCount, "latency": latency * 1000.0, "workers": workers,
+              "sequential": sequentialTime, "parallel": parallelTime,
+              "speedup": sequentialTime / parallelTime if parallelTime else float("inf")}
+    print("parallel scan {poses} poses at {latency:.1f}ms per call: 1 thread {sequential:.2f}s, "
+          "{workers} threads {parallel:.2f}s, {speedup:.1f}x faster".format(**report))
+    return report
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Pose library benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark")
+    scanParser = subparsers.add_parser("scan", help="Directory scanner, legacy against scandir")
+    scanParser.add_argument("--files", type=int, default=10000, help="Number of synthetic files")
+    scanParser.add_argument("--repeat", type=int, default=5, help="Best of this many runs")
+    scanParser.add_argument("--directory", help="Scratch directory, e.g. on a network share, defaults to a temp directory")
+    searchParser = subparsers.add_parser("search", help="Library search index, build time and keystroke latency")
+    searchParser.add_argument("--poses", type=int, default=100000, help="Number of synthetic poses")
+    parallelParser = subparsers.add_parser("parallel", help="Thread pool library scan with injected latency")
+    parallelParser.add_argument("--latency", type=float, default=0.002, help="Seconds added to every file system call")
+    parallelParser.add_argument("--workers", type=int, default=16, help="Threads of the parallel scan")
+    parallelParser.add_argument("--poses", type=int, default=100, help="Poses per character, 10 characters")
+    similarityParser = subparsers.add_parser("similarity", help="Pose similarity index, top k query latency")
+    similarityParser.add_argument("--poses", type=int, default=50000, help="Number of synthetic poses")
+    similarityParser.add_argument("--controls", type=int, default=100, help="Controls per pose")
+    blendParser = subparsers.add_parser("blend", help="Batch pose blend of random matrices")
+    blendParser.add_argument("--controls", type=int, default=5000, help="Number of controls")
+    keysParser = subparsers.add_parser("keys", help="Keyframing of applyPose on a counting Maya stand in")
+    keysParser.add_argument("--controls", type=int, default=600, help="Number of controls")
+    keysParser.add_argument("--attributes", type=int, default=10, help="Keyable attributes per control")
+    options = parser.parse_args(args)
+
+    if options.benchmark == "scan":
+        benchmarkScan(options.files, options.repeat, options.directory)
+    elif options.benchmark == "search":
+        benchmarkSearch(options.poses)
+    elif options.benchmark == "parallel":
+        benchmarkParallelScan(options.latency, options.workers, poseCount=options.poses)
+    elif options.benchmark == "similarity":
+        benchmarkSimilarity(options.poses, options.controls)
+    elif options.benchmark == "blend":
+        benchmarkBlend(options.controls)
+    elif options.benchmark == "keys":
+        benchmarkKeys(options.controls, options.attributes)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
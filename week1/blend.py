@@ -0,0 +1,206 @@
+import numpy as np
+
+from . import transforms
+
+# Batch pose blending in pure numpy, the Maya free core of lib.poseBlend.
+# Source and destination matrices are stacked into (N, 4, 4) arrays and decomposed once, every blend
+# factor then costs a lerp of the translations and scales, a slerp of the quaternions and a recompose,
+# each a single vectorised pass over all the controls.
+
+# above this angle cosine the quaternions are lerped and normalised, slerp divides by sin(angle)
+SLERP_LINEAR_THRESHOLD = 0.9995
+EQUIVALENT_TOLERANCE = 1e-5
+
+
+def slerpQuaternions(a, b, factor):
+    """
+    Spherical interpolation of quaternion pairs along the shortest arc, like om.MQuaternion.slerp
+    Args:
+        a (np.ndarray): (N, 4) quaternions (x, y, z, w) at factor 0
+        b (np.ndarray): (N, 4) quaternions at factor 1
+        factor (float or np.ndarray): Blend factor, or (N,) factors
+    Returns:
+        np.ndarray: (N, 4) unit quaternions
+    """
+    factor = np.asarray(factor, dtype=np.float64).reshape(-1, 1)
+    dot = np.sum(a * b, axis=1, keepdims=True)
+    # q and -q are the same rotation, flip b to take the short way
+    b = np.where(dot < 0.0, -b, b)
+    dot = np.abs(dot)
+    angle = np.arccos(np.clip(dot, -1.0, 1.0))
+    sinAngle = np.sin(angle)
+    linear = dot > SLERP_LINEAR_THRESHOLD
+    safeSin = np.where(linear, 1.0, sinAngle)
+    weightA = np.where(linear, 1.0 - factor, np.sin((1.0 - factor) * angle) / safeSin)
+    weightB = np.where(linear, factor, np.sin(factor * angle) / safeSin)
+    return transforms.normalizeQuaternions(weightA * a + weightB * b)
+
+
+def blendMatrices(srcMatrices, dstMatrices, factor):
+    """
+    Blend two stacks of matrices: translation and scale are lerped, rotation is slerped
+    Args:
+        srcMatrices (np.ndarray): (N, 16) or (N, 4, 4) matrices at factor 0
+        dstMatrices (np.ndarray): (N, 16) or (N, 4, 4) matrices at factor 1
+        factor (float): Blend factor, clamped to [0, 1]
+    Returns:
+        np.ndarray: (N, 4, 4) blended matrices
+    """
+    return PoseBlender(srcMatrices, dstMatrices).blend(factor)
+
+
+class PoseBlender(object):
+    """
+    Decomposed source and destination matrices of a blend. The slider of the UI blends the same pair of
+    poses at many factors, so the decomposition is done once here and blend only interpolates
+    """
+    def __init__(self, srcMatrices, dstMatrices):
+        srcMatrices = transforms.asMatrixStack(srcMatrices)
+        dstMatrices = transforms.asMatrixStack(dstMatrices)
+        if srcMatrices.shape != dstMatrices.shape:
+            raise ValueError("Cannot blend {} matrices with {} matrices".format(len(srcMatrices), len(dstMatrices)))
+        # controls already at the destination are left alone, like the isEquivalent test of the Maya blend
+        difference = np.abs(srcMatrices - dstMatrices).reshape(len(srcMatrices), 16)
+        self.changed = np.max(difference, axis=1, initial=0.0) > EQUIVALENT_TOLERANCE
+        self.srcMatrices = srcMatrices
+        self.dstMatrices = dstMatrices
+        self.srcTranslations, self.srcQuaternions, self.srcScales = transforms.decomposeMatrices(srcMatrices[self.changed])
+        self.dstTranslations, self.dstQuaternions, self.dstScales = transforms.decomposeMatrices(dstMatrices[self.changed])
+
+    def __len__(self):
+        return len(self.srcMatrices)
+
+    def blend(self, factor):
+        """
+        Matrices of every control at a blend factor
+        Args:
+            factor (float): 0.0 is the source pose, 1.0 the destination pose, clamped
+        Returns:
+            np.ndarray: (N, 4, 4) matrices, controls that do not change are the source matrices
+        """
+        matrices = self.srcMatrices.copy()
+        if self.changed.any():
+            matrices[self.changed] = self.blendChanged(factor)
+        return matrices
+
+    def blendChanged(self, factor):
+        """
+        Matrices of the controls the blend moves only, in the order of getChangedIndices
+        Returns:
+            np.ndarray: (M, 4, 4) matrices
+        """
+        factor = max(0.0, min(1.0, float(factor)))
+        translations = self.srcTranslations + (self.dstTranslations - self.srcTranslations) * factor
+        scales = self.srcScales + (self.dstScales - self.srcScales) * factor
+        quaternions = slerpQuaternions(self.srcQuaternions, self.dstQuaternions, factor)
+        return transforms.composeMatrices(translations, quaternions, scales)
+
+    def getChangedIndices(self):
+        """Indices of the controls the blend moves"""
+        return np.flatnonzero(self.changed)
+
+
+def averageQuaternions(quaternions, weights, method="sum", iterations=2):
+    """
+    Weighted average of the quaternions of several poses, for every control at once
+    Args:
+        quaternions (np.ndarray): (P, N, 4) quaternions (x, y, z, w) of P poses and N controls
+        weights (np.ndarray): (P, N) weights, normalised per control by the caller
+        method (str): "sum" for the iterative normalised summation, "eigen" for the principal eigenvector
+            of the weighted outer products, exact but several times slower
+        iterations (int): Sign alignments of the summation
+    Returns:
+        np.ndarray: (N, 4) unit quaternions
+    """
+    weights = weights[:, :, np.newaxis]
+    if method == "eigen":
+        # q and -q give the same outer product, so no sign alignment is needed
+        outer = np.einsum("pni,pnj->nij", quaternions * weights, quaternions)
+        _, vectors = np.linalg.eigh(outer)
+        return transforms.normalizeQuaternions(vectors[:, :, -1])
+    if method != "sum":
+        raise ValueError("Unknown quaternion average method: {}".format(method))
+    # align every quaternion with the current mean before summing, starting from the heaviest pose
+    heaviest = np.argmax(weights[:, :, 0], axis=0)
+    mean = quaternions[heaviest, np.arange(quaternions.shape[1])]
+    for _ in range(max(1, iterations)):
+        signs = np.where(np.sum(quaternions * mean, axis=2, keepdims=True) < 0.0, -1.0, 1.0)
+        mean = transforms.normalizeQuaternions(np.sum(quaternions * signs * weights, axis=0))
+    return mean
+
+
+def normalizeWeights(weights, poseCount, controlCount):
+    """(P,) or (P, N) weights to (P, N) weights summing to one per control, all zero weights give the first pose"""
+    weights = np.asarray(weights, dtype=np.float64)
+    if weights.ndim == 1:
+        weights = np.repeat(weights[:, np.newaxis], controlCount, axis=1)
+    if weights.shape != (poseCount, controlCount):
+        raise ValueError("Expected {} weights per control, got {}".format(poseCount, weights.shape))
+    weights = np.maximum(weights, 0.0)
+    totals = weights.sum(axis=0)
+    empty = totals <= 0.0
+    if empty.any():
+        weights[0, empty] = 1.0
+        totals[empty] = 1.0
+    return weights / totals
+
+
+class MultiPoseBlender(object):
+    """
+    Weighted blend of several poses over the same controls, decomposed once. Each blend averages the
+    translations, scales and quaternions of every control in one vectorised evaluation, fast enough to
+    follow a point dragged in a blend space
+    """
+    def __init__(self, poseMatrices, method="sum"):
+        """
+        Args:
+            poseMatrices (list): P stacks of (N, 16) or (N, 4, 4) matrices, the same controls in the same order
+            method (str): Quaternion average, see averageQuaternions
+        """
+        stacks = [transforms.asMatrixStack(matrices) for matrices in poseMatrices]
+        if not stacks or any(len(stack) != len(stacks[0]) for stack in stacks):
+            raise ValueError("Every pose of a blend needs the same controls")
+        self.poseCount = len(stacks)
+        self.controlCount = len(stacks[0])
+        self.method = method
+        translations, quaternions, scales = transforms.decomposeMatrices(np.concatenate(stacks))
+        shape = (self.poseCount, self.controlCount)
+        self.translations = translations.reshape(shape + (3,))
+        self.quaternions = quaternions.reshape(shape + (4,))
+        self.scales = scales.reshape(shape + (3,))
+
+    def __len__(self):
+        return self.controlCount
+
+    def blend(self, weights):
+        """
+        Matrices of every control for a set of weights
+        Args:
+            weights (list): One weight per pose, or a (P, N) array of weights per pose and control
+        Returns:
+            np.ndarray: (N, 4, 4) matrices
+        """
+        weights = normalizeWeights(weights, self.poseCount, self.controlCount)
+        columns = weights[:, :, np.newaxis]
+        translations = np.sum(self.translations * columns, axis=0)
+        scales = np.sum(self.scales * columns, axis=0)
+        quaternions = averageQuaternions(self.quaternions, weights, self.method)
+        return transforms.composeMatrices(translations, quaternions, scales)
+
+
+def getBlendSpaceWeights(point, positions, power=2.0):
+    """
+    Inverse distance weights of the poses of a 2D blend space, a point on a pose gives that pose only
+    Args:
+        point (tuple): (x, y) dragged point
+        positions (list): (x, y) position of every pose
+        power (float): Falloff, higher values keep the closest pose dominant for longer
+    Returns:
+        np.ndarray: (P,) weights summing to one
+    """
+    distances = np.linalg.norm(np.asarray(positions, dtype=np.float64) - np.asarray(point, dtype=np.float64), axis=1)
+    onPose = distances < 1e-9
+    if onPose.any():
+        return onPose / float(onPose.sum())
+    weights = 1.0 / distances ** power
+    return weights / weights.sum()
@@ -0,0 +1,315 @@
+import math
+import os
+import sqlite3
+from datetime import datetime
+
+from . import config
+from . import poseio
+from . import posepack
+from . import posestore
+from . import scanner
+from . import utils
+
+CATALOG_VERSION = 1
+CATALOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS directories (
+    path TEXT PRIMARY KEY,
+    parent TEXT,
+    name TEXT,
+    kind TEXT,
+    mtime REAL
+);
+CREATE TABLE IF NOT EXISTS poses (
+    directory TEXT,
+    poseName TEXT,
+    fullPath TEXT,
+    packFile TEXT,
+    poseType TEXT,
+    cTime REAL,
+    mTime REAL,
+    size INTEGER,
+    imgFile TEXT,
+    objectCount INTEGER,
+    namespace TEXT,
+    hash TEXT,
+    PRIMARY KEY (directory, poseName)
+);
+CREATE INDEX IF NOT EXISTS posesDirectory ON poses (directory);
+"""
+POSE_COLUMNS = ["directory", "poseName", "fullPath", "packFile", "poseType", "cTime", "mTime", "size", "imgFile",
+                "objectCount", "namespace", "hash"]
+
+
+def formatDate(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime('%m-%d-%Y %I:%M %p')
+
+
+def readPoseRecords(charDirectory, scanRecords, existingFiles=None, mapper=None):
+    """
+    Collect the catalog records of pose files, metadata comes from the pose headers
+    Args:
+        charDirectory (str): Character directory
+        scanRecords (list): Pose records to read, see scanner.scanPoseDirectory
+        existingFiles (list): Every pose file of the directory, see poseio.getDirectoryMetadata
+        mapper (callable): map like function for the header reads, see poseio.getDirectoryMetadata
+    Returns:
+        list: Record dictionaries with the POSE_COLUMNS keys
+    """
+    stats = {record["poseFile"]: (record["cTime"], record["mTime"], record["size"]) for record in scanRecords}
+    metadata = poseio.getDirectoryMetadata(charDirectory, list(stats.keys()), stats=stats, existingFiles=existingFiles,
+                                           mapper=mapper)
+    records = []
+    for scanRecord in scanRecords:
+        imgFile = scanRecord["imgFile"]
+        if not imgFile and scanRecord["poseFile"].endswith(config.POSE_REF_EXTENSION):
+            imgFile = posestore.resolveThumbnailRef(posestore.readPoseRef(scanRecord["fullPath"]))
+        meta = metadata[scanRecord["poseFile"]]
+        records.append({
+            "directory": charDirectory,
+            "poseName": scanRecord["poseName"],
+            "fullPath": scanRecord["fullPath"],
+            "packFile": "",
+            "poseType": utils.getPoseType(scanRecord["poseName"]),
+            "cTime": scanRecord["cTime"],
+            "mTime": scanRecord["mTime"],
+            "size": scanRecord["size"],
+            "imgFile": imgFile,
+            "objectCount": meta["controlCount"],
+            "namespace": meta["namespace"],
+            "hash": meta["hash"]
+        })
+    return records
+
+
+def readPackRecords(packPath):
+    records = []
+    charDirectory = os.path.dirname(packPath)
+    with posepack.PosePack(packPath) as pack:
+        for poseName, entry in pack.entries.items():
+            records.append({
+                "directory": charDirectory,
+                "poseName": poseName,
+                "fullPath": packPath,
+                "packFile": packPath,
+                "poseType": utils.getPoseType(poseName),
+                "cTime": entry["cTime"],
+                "mTime": entry["mTime"],
+                "size": entry["poseSize"],
+                "imgFile": "",
+                "objectCount": entry["meta"]["controlCount"],
+                "namespace": entry["meta"]["namespace"],
+                "hash": entry["meta"]["hash"]
+            })
+    return records
+
+
+def recordToPoseInformation(record):
+    """Convert a catalog record to the pose information dictionary used by the UI, see utils.getPoseFileInformation"""
+    poseInfo = {
+        'poseName': record["poseName"],
+        'poseType': record["poseType"],
+        'fullPath': record["fullPath"],
+        'imgFile': record["imgFile"],
+        'cDate': formatDate(record["cTime"]),
+        'mDate': formatDate(record["mTime"]),
+        'cTime': record["cTime"],
+        'mTime': record["mTime"],
+        'size': str("{} KB".format(math.ceil(record["size"] / 1024))),
+        'objectCount': record["objectCount"],
+        'namespace': record["namespace"],
+        'hash': record["hash"]
+    }
+    if record["packFile"]:
+        poseInfo['packFile'] = record["packFile"]
+    return poseInfo
+
+
+class PoseCatalog(object):
+    """
+    Persistent SQLite catalog of the pose library metadata.
+
+    refresh only lists the directories whose mtime changed since the last refresh and only re-reads the
+    pose files whose (mtime, size) changed, everything else is answered from the database.
+    """
+    def __init__(self, rootDirectory=None, catalogPath=None):
+        self.rootDirectory = os.path.normpath(rootDirectory or config.PROJECT_ROOT)
+        self.catalogPath = catalogPath or config.CATALOG_FILE
+        self.connection = sqlite3.connect(self.catalogPath, timeout=30.0)
+        self.connection.row_factory = sqlite3.Row
+        self.initSchema()
+
+    def initSchema(self):
+        with self.connection:
+            self.connection.executescript(CATALOG_SCHEMA)
+            row = self.connection.execute("SELECT value FROM info WHERE key = 'version'").fetchone()
+            if row is None or int(row["value"]) != CATALOG_VERSION:
+                # the catalog is only a cache of the library, rebuild it when the layout changes
+                self.connection.execute("DELETE FROM directories")
+                self.connection.execute("DELETE FROM poses")
+                self.connection.execute("INSERT OR REPLACE INTO info VALUES ('version', ?)", (str(CATALOG_VERSION),))
+
+    def close(self):
+        self.connection.close()
+
+    def getDirectoryMtime(self, path):
+        row = self.connection.execute("SELECT mtime FROM directories WHERE path = ?", (path,)).fetchone()
+        return row["mtime"] if row else None
+
+    def setDirectory(self, path, kind, mtime):
+        self.connection.execute("INSERT OR REPLACE INTO directories VALUES (?, ?, ?, ?, ?)",
+                                (path, os.path.dirname(path), os.path.basename(path), kind, mtime))
+
+    def removeDirectory(self, path):
+        self.connection.execute("DELETE FROM directories WHERE path = ? OR parent = ?", (path, path))
+        prefix = path + os.sep
+        self.connection.execute("DELETE FROM poses WHERE directory = ? OR substr(directory, 1, ?) = ?",
+                                (path, len(prefix), prefix))
+
+    def listSubdirectories(self, path):
+        subdirectories = []
+        for name in os.listdir(path):
+            subdirectory = os.path.join(path, name)
+            # hidden entries hold library data like the pose store or this catalog
+            if not name.startswith(".") and os.path.isdir(subdirectory):
+                subdirectories.append(subdirectory)
+        return subdirectories
+
+    def refresh(self, force=False, parallelScanner=None):
+        """
+        Bring the catalog up to date with the library on disk
+        Args:
+            force (bool): If True, stat every pose file even in directories whose mtime did not change,
+                to pick up files edited in place
+            parallelScanner (scanner.ParallelScanner): Scan the characters with a thread pool, for libraries on
+                network shares. Cancelling it rolls the refresh back
+        Returns:
+            int: Number of pose records written
+        """
+        updated = 0
+        with self.connection:
+            characters = []
+            for category in self.refreshChildren(self.rootDirectory, "category", force):
+                characters.extend(self.refreshChildren(category, "character", force))
+            prescans = {}
+            if parallelScanner:
+                mtimes = parallelScanner.statDirectories(characters)
+                changed = [character for character in characters
+                           if mtimes[character] is not None and (force or mtimes[character] != self.getDirectoryMtime(character))]
+                scans = parallelScanner.scanPoseDirectories(changed)
+                prescans = {character: (mtimes[character], scans.get(character)) for character in characters}
+            for character in characters:
+                updated += self.refreshCharacter(character, force, inTransaction=True, parallelScanner=parallelScanner,
+                                                 prescan=prescans.get(character))
+        return updated
+
+    def refreshChildren(self, path, kind, force):
+        """Update the directory rows under path if its mtime changed, return the child directories"""
+        mtime = os.stat(path).st_mtime
+        known = [row["path"] for row in self.connection.execute("SELECT path FROM directories WHERE parent = ?", (path,))]
+        if not force and known and self.getDirectoryMtime(path) == mtime:
+            return known
+        children = self.listSubdirectories(path)
+        for removed in set(known) - set(children):
+            self.removeDirectory(removed)
+        for child in children:
+            if child not in known:
+                # mtime 0 makes sure the new directory gets listed
+                self.setDirectory(child, kind, 0.0)
+        if path != self.rootDirectory:
+            self.connection.execute("UPDATE directories SET mtime = ? WHERE path = ?", (mtime, path))
+        else:
+            self.setDirectory(path, "root", mtime)
+        return children
+
+    def refreshCharacter(self, charDirectory, force=False, inTransaction=False, parallelScanner=None, prescan=None):
+        """
+        Update the pose records of one character directory
+        Args:
+            charDirectory (str): Character directory
+            force (bool): If True, stat the pose files even if the directory mtime did not change
+            parallelScanner (scanner.ParallelScanner): Scan and read the headers with a thread pool
+            prescan (tuple): (directory mtime, pose records or None) already scanned by refresh
+        Returns:
+            int: Number of pose records written
+        """
+        charDirectory = os.path.normpath(charDirectory)
+        if not inTransaction:
+            with self.connection:
+                return self.refreshCharacter(charDirectory, force, inTransaction=True, parallelScanner=parallelScanner)
+
+        if prescan:
+            mtime, scanRecords = prescan
+        else:
+            mtime = os.stat(charDirectory).st_mtime if os.path.isdir(charDirectory) else None
+            scanRecords = None
+        if mtime is None:
+            self.removeDirectory(charDirectory)
+            return 0
+        storedMtime = self.getDirectoryMtime(charDirectory)
+        if not force and storedMtime == mtime:
+            return 0
+
+        rows = self.connection.execute("SELECT * FROM poses WHERE directory = ?", (charDirectory,)).fetchall()
+        known = {row["poseName"]: row for row in rows}
+        if scanRecords is None:
+            if parallelScanner:
+                scanRecords = parallelScanner.scanPoseDirectory(charDirectory)
+            else:
+                scanRecords = scanner.scanPoseDirectory(charDirectory)
+        changedRecords = []
+        looseNames = set()
+        for scanRecord in scanRecords:
+            looseNames.add(scanRecord["poseName"])
+            row = known.get(scanRecord["poseName"])
+            if row is None or row["packFile"] or row["mTime"] != scanRecord["mTime"] \
+                    or row["size"] != scanRecord["size"] or row["fullPath"] != scanRecord["fullPath"]:
+                changedRecords.append(scanRecord)
+            elif scanRecord["imgFile"] != row["imgFile"] and \
+                    (scanRecord["imgFile"] or not posestore.isStoreObject(row["imgFile"])):
+                # thumbnail added or removed after the pose was saved, referenced poses keep the store thumbnail
+                changedRecords.append(scanRecord)
+        records = readPoseRecords(charDirectory, changedRecords,
+                                  existingFiles=[scanRecord["poseFile"] for scanRecord in scanRecords],
+                                  mapper=parallelScanner.map if parallelScanner else None)
+
+        # packed poses, loose files take precedence
+        packPath = posepack.findPosePack(charDirectory)
+        packNames = set()
+        if packPath:
+            for record in readPackRecords(packPath):
+                if record["poseName"] not in looseNames:
+                    packNames.add(record["poseName"])
+                    records.append(record)
+
+        for poseName in set(known.keys()) - looseNames - packNames:
+            self.connection.execute("DELETE FROM poses WHERE directory = ? AND poseName = ?", (charDirectory, poseName))
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO poses ({}) VALUES ({})".format(", ".join(POSE_COLUMNS), ", ".join("?" * len(POSE_COLUMNS))),
+            [[record[column] for column in POSE_COLUMNS] for record in records])
+        if storedMtime is None:
+            self.setDirectory(charDirectory, "character", mtime)
+        else:
+            self.connection.execute("UPDATE directories SET mtime = ? WHERE path = ?", (mtime, charDirectory))
+        return len(records)
+
+    def getCharacters(self):
+        """Same dictionary as utils.folder_structure_to_dictionary, {category: [characters]}"""
+        characters = {}
+        rows = self.connection.execute("SELECT path, name FROM directories WHERE kind = 'category'").fetchall()
+        for row in rows:
+            characters[row["name"]] = [child["name"] for child in self.connection.execute(
+                "SELECT name FROM directories WHERE parent = ? AND kind = 'character'", (row["path"],))]
+        return characters
+
+    def getPoses(self, charDirectory):
+        """
+        Pose information of a character, straight from the catalog
+        Args:
+            charDirectory (str): Character directory
+        Returns:
+            dict: {poseName: pose information}, see recordToPoseInformation
+        """
+        rows = self.connection.execute("SELECT * FROM poses WHERE directory = ? ORDER BY poseName",
+                                       (os.path.normpath(charDirectory),))
+        return {row["poseName"]: recordToPoseInformation(row) for row in rows}
@@ -11,8 +11,68 @@ FOLDER_DICT = {
     "C": ["g", "h", "i"]
 }
 
+BINARY_POSE_EXTENSION = '.bpose'
+# poses stored as a sparse quantised delta against the rest pose of the character, see deltapose.py
+DELTA_POSE_EXTENSION = '.dpose'
+REST_POSE_FILE = 'rest.restpose'
+# quantisation steps of the delta poses: translation in scene units, quaternion components, scale factors
+DELTA_PRECISION = {
+    'translate': 1e-5,
+    'rotate': 1e-6,
+    'scale': 1e-6
+}
+# controls whose matrix is within this distance of the rest matrix are not stored in delta poses
+DELTA_TOLERANCE = 1e-6
+# delta poses store translation, rotation and scale, a matrix further than this from its recomposed
+# matrix, e.g. a sheared one, can not be saved as a delta pose
+DELTA_SHEAR_TOLERANCE = 1e-6
+# extension used by the UI when saving a pose, use DELTA_POSE_EXTENSION for delta storage
+POSE_SAVE_EXTENSION = '.pose'
+
+# named references to pose payloads and thumbnails shared in the content addressed store, see posestore.py
+POSE_REF_EXTENSION = '.poseref'
+POSE_STORE_DIR = os.path.join(PROJECT_ROOT, '.posestore')
+# matrices equal within this tolerance are stored once by the pose store
+DEDUPE_TOLERANCE = 1e-6
+
+# persistent catalog of the library metadata, see catalog.py
+CATALOG_FILE = os.path.join(PROJECT_ROOT, '.posecatalog.sqlite')
+
+# library watcher, see watcher.py: seconds of quiet before a burst of changes is reported, and the
+# polling interval used where inotify is not available
+WATCH_DEBOUNCE = 0.3
+WATCH_POLL_INTERVAL = 2.0
+
+# memory budget in bytes of the parsed poses kept by posecache.PoseCache
+POSE_CACHE_BUDGET = 256 * 1024 * 1024
+
+# threads of scanner.ParallelScanner, raise it for libraries on high latency network shares
+SCAN_WORKERS = 16
+
+# per character pose similarity index, see similarity.py. Translations are multiplied by the weight,
+# so with 0.1 a difference of 10 scene units counts like a unit of quaternion difference
+SIMILARITY_INDEX_FILE = '.posesimilarity.npz'
+SIMILARITY_TRANSLATION_WEIGHT = 0.1
+SIMILAR_POSE_COUNT = 12
+
+# slider ticks whose latency lib.BlendSession keeps for its stats
+BLEND_TICK_SAMPLES = 240
+
+# pose mirroring, see mirror.py. Side tokens ending with "_" are prefixes, starting with "_" suffixes,
+# others match on word boundaries
+MIRROR_SIDE_TOKENS = [("L_", "R_"), ("_L", "_R"), ("_L_", "_R_"), ("Left", "Right"), ("left", "right")]
+MIRROR_AXIS = "x"
+MIRROR_CONVENTION = "orientation"
+MIRROR_POSE_SUFFIX = "_mirror"
+MIRROR_TABLE_CACHE_SIZE = 16
+
+# single file holding every pose and thumbnail of a character, see posepack.py
+POSE_PACK_FILE = 'poses.posepack'
+# lazily generated metadata of legacy poses saved without a header
+POSE_METADATA_FILE = '.posemeta'
+
 VALID_EXTENSIONS = {
-    'File': ['.pose', '.jason'],
+    'File': ['.pose', '.jason', BINARY_POSE_EXTENSION, DELTA_POSE_EXTENSION, POSE_REF_EXTENSION],
     'Img': ['.tga', '.jpg', '.jpeg', '.gif', '.png']
 }
 
@@ -75,6 +135,16 @@ SORTING_OPTIONS = [
     "Date Modified (Newest)"
 ]
 
+# (pose information key, descending) of every sorting option, dates sort on the raw epoch timestamps
+SORTING_KEYS = [
+    ("poseName", False),
+    ("poseName", True),
+    ("cTime", False),
+    ("cTime", True),
+    ("mTime", False),
+    ("mTime", True)
+]
+
 # If you need to map display names to values
 SORTING_VALUES = {
     "Name (A to Z)": 0,
@@ -0,0 +1,143 @@
+import maya.cmds as mc
+import maya.api.OpenMaya as om
+
+from . import handlecache
+
+# Rig controls of every character namespace, behind lib.getControls.
+# A namespace is indexed with one bulk query: the control group, then every node of the namespace with a
+# controlType attribute, kept when it is under the group. The controls are stored as a list in scene order
+# and a set, so filtering the selection is a set lookup per selected node. An entry is only built again
+# when its rig changes: a new scene, a scene open or a reference change clears the index, a transform
+# added, renamed or deleted in a namespace marks that namespace and its parents for a rebuild
+CONTROL_GROUPS = ["ctrl_GRP", "ctrl", "controls_GRP", "CONTROLS", "Controls_GRP", "ControlsGRP", "controls"]
+CONTROL_ATTRIBUTE = "controlType"
+
+
+class NamespaceControls(object):
+    """Control group and controls of one namespace, long DAG paths"""
+    def __init__(self, namespace, topNode, controls):
+        self.namespace = namespace
+        self.topNode = topNode
+        self.controls = controls
+        self.controlSet = set(controls)
+
+    def filterSelection(self, selectedNodes):
+        """Selected nodes that are controls of the rig, in selection order"""
+        return [node for node in selectedNodes if node in self.controlSet]
+
+
+def findControlGroup(namespace=None):
+    """Long name of the control group of a namespace, the namespaced groups first, None when there is none"""
+    candidates = list(CONTROL_GROUPS)
+    if namespace:
+        candidates = ["{}:{}".format(namespace, group) for group in CONTROL_GROUPS] + candidates
+    existing = set(mc.ls(candidates) or [])
+    for group in candidates:
+        if group in existing:
+            return (mc.ls(group, long=True) or [None])[0]
+    return None
+
+
+def buildNamespaceControls(namespace=None):
+    """
+    Index the controls of a namespace with one query of the nodes carrying the control attribute
+    Returns:
+        NamespaceControls: None when the namespace has no control group
+    """
+    topNode = findControlGroup(namespace)
+    if not topNode:
+        return None
+    print("Found control group: {}".format(topNode))
+    pattern = handlecache.joinControlName(namespace, "*.{}".format(CONTROL_ATTRIBUTE))
+    # recursive finds the controls of nested namespaces too, e.g. char:face:ctrl
+    nodes = mc.ls(pattern, objectsOnly=True, long=True, type="transform", recursive=True) or []
+    prefix = topNode + "|"
+    return NamespaceControls(namespace, topNode, [node for node in nodes if node.startswith(prefix)])
+
+
+class ControlIndex(object):
+    def __init__(self):
+        # namespace -> NamespaceControls, None for namespaces without a control group
+        self.namespaces = {}
+        self.dirty = set()
+        self.callbackIds = []
+        self.builds = 0
+
+    def install(self):
+        """Register the scene callbacks that mark the index out of date"""
+        if self.callbackIds:
+            return
+        for message in handlecache.SCENE_MESSAGES:
+            self.callbackIds.append(om.MSceneMessage.addCallback(getattr(om.MSceneMessage, message), self.onSceneChanged))
+        self.callbackIds.append(om.MDGMessage.addNodeAddedCallback(self.onNodeChanged, "transform"))
+        self.callbackIds.append(om.MDGMessage.addNodeRemovedCallback(self.onNodeChanged, "transform"))
+        self.callbackIds.append(om.MNodeMessage.addNameChangedCallback(om.MObject(), self.onNodeRenamed))
+
+    def uninstall(self):
+        if self.callbackIds:
+            om.MMessage.removeCallbacks(self.callbackIds)
+            self.callbackIds = []
+        self.clear()
+
+    def clear(self):
+        self.namespaces.clear()
+        self.dirty.clear()
+
+    def onSceneChanged(self, *args):
+        self.clear()
+
+    def onNodeChanged(self, node, *args):
+        self.invalidate(om.MFnDependencyNode(node).name())
+
+    def onNodeRenamed(self, node, previousName, *args):
+        if not node.hasFn(om.MFn.kTransform):
+            return
+        self.invalidate(previousName)
+        self.invalidate(om.MFnDependencyNode(node).name())
+
+    def invalidate(self, name):
+        """Mark the indexed namespaces holding a node for a rebuild, nested namespaces are indexed with their parent"""
+        namespace = handlecache.splitControlName(name)[0]
+        for indexed in self.namespaces:
+            if indexed is None or namespace == indexed or (namespace or "").startswith(indexed + ":"):
+                self.dirty.add(indexed)
+
+    def refresh(self, namespace=None):
+        """Rebuild the controls of a namespace, e.g. after adding the control attribute to a node"""
+        self.namespaces[namespace] = buildNamespaceControls(namespace)
+        self.dirty.discard(namespace)
+        self.builds += 1
+        return self.namespaces[namespace]
+
+    def getNamespaceControls(self, namespace=None):
+        """
+        Controls of a namespace, built on first use and after the rig changed
+        Returns:
+            NamespaceControls: None when the namespace has no control group
+        """
+        if namespace in self.namespaces and namespace not in self.dirty:
+            return self.namespaces[namespace]
+        return self.refresh(namespace)
+
+
+# a reload of the module releases the callbacks of the previous index
+if globals().get("_controlIndex") is not None:
+    _controlIndex.uninstall()
+_controlIndex = None
+
+
+def getControlIndex():
+    """Control index of the session, its scene callbacks are registered on first use"""
+    global _controlIndex
+    if _controlIndex is None:
+        _controlIndex = ControlIndex()
+        _controlIndex.install()
+    return _controlIndex
+
+
+def releaseControlIndex():
+    """Remove the scene callbacks and drop the index, when the UI closes"""
+    global _controlIndex
+    if _controlIndex is not None:
+        _controlIndex.uninstall()
+        _controlIndex = None
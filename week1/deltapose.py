@@ -0,0 +1,258 @@
+import io
+import json
+import os
+import struct
+
+import numpy as np
+
+from . import config
+from . import poseio
+from . import transforms
+from . import utils
+
+# Delta pose layout (little endian):
+#   header    : magic, version, flags, rest control count, changed count, extra count, names size,
+#               meta size, translation step, rotation step, scale step, integer width of the
+#               translation / rotation / scale arrays, sha1 of the rest pose
+#   meta      : compact json metadata block, see poseio.buildPoseMetadata
+#   presence  : one bit per rest pose control (sorted names), set if the control is part of the pose
+#   changed   : uint32 indices of the rest pose controls that differ from the rest pose
+#   names     : NUL separated names of the pose controls that are not in the rest pose
+#   values    : quantised translation deltas (K, 3), rotation deltas (K, 4), scale deltas (K, 3)
+#               for the changed controls followed by the extra controls
+DELTA_MAGIC = b"PLDP"
+DELTA_VERSION = 1
+DELTA_HEADER = struct.Struct("<4sHHIIIIIdddBBB5x40s")
+INTEGER_TYPES = {1: "<i1", 2: "<i2", 4: "<i4", 8: "<i8"}
+
+
+def isDeltaPoseData(data):
+    return data.startswith(DELTA_MAGIC)
+
+
+def getRestPosePath(charDirectory):
+    return os.path.join(charDirectory, config.REST_POSE_FILE)
+
+
+def readRestPose(charDirectory):
+    """
+    Read the rest pose delta poses of a character directory are stored against
+    Args:
+        charDirectory (str): Character directory
+    Returns:
+        tuple: (sorted control names, (N, 16) float64 rest matrices, sha1 of the rest pose)
+    """
+    restPosePath = getRestPosePath(charDirectory)
+    if not os.path.isfile(restPosePath):
+        raise IOError("No rest pose for delta poses in {}".format(charDirectory))
+    controls, matrices = poseio.readPoseArrays(restPosePath)
+    meta = poseio.readPoseMetadata(restPosePath)
+    return controls, matrices, meta["hash"]
+
+
+def quantise(values, step):
+    quantised = np.round(values / step)
+    width = 1
+    limit = np.abs(quantised).max() if quantised.size else 0
+    while width < 8 and limit > np.iinfo(INTEGER_TYPES[width]).max:
+        width *= 2
+    return quantised.astype(INTEGER_TYPES[width]), width
+
+
+def encodeDeltaPose(poseData, restControls, restMatrices, restHash, meta=None, precision=None, tolerance=None):
+    """
+    Encode matrix pose data as a sparse, quantised delta against a rest pose. Changed controls are stored
+    as translation, rotation and scale, shear can not be stored
+    Args:
+        poseData (dict): {control: matrix} pose data
+        restControls (list): Sorted rest pose control names
+        restMatrices (np.ndarray): (N, 16) rest pose matrices
+        restHash (str): sha1 of the rest pose, checked when decoding
+        meta (dict): Metadata stored in the header
+        precision (dict): Quantisation steps for 'translate', 'rotate' and 'scale', see config.DELTA_PRECISION
+        tolerance (float): Controls whose matrix is within this distance of the rest matrix are not stored
+    Returns:
+        bytes: The encoded delta pose
+    Raises:
+        ValueError: A changed control has a sheared or otherwise non TRS matrix, save the pose in
+            another format
+    """
+    precision = dict(config.DELTA_PRECISION, **(precision or {}))
+    tolerance = config.DELTA_TOLERANCE if tolerance is None else tolerance
+    for control, matrix in poseData.items():
+        if isinstance(matrix, dict) or len(matrix) != poseio.MATRIX_SIZE:
+            raise ValueError("Delta poses only store 16 value matrices, got invalid data for control: {}".format(control))
+
+    restIndices = {control: index for index, control in enumerate(restControls)}
+    presence = np.zeros(len(restControls), dtype=bool)
+    poseIndices = []
+    poseMatrices = []
+    extraControls = []
+    extraMatrices = []
+    for control in sorted(poseData.keys()):
+        index = restIndices.get(control)
+        if index is None:
+            extraControls.append(control)
+            extraMatrices.append(poseData[control])
+        else:
+            presence[index] = True
+            poseIndices.append(index)
+            poseMatrices.append(poseData[control])
+
+    poseIndices = np.asarray(poseIndices, dtype=np.uint32)
+    poseMatrices = np.asarray(poseMatrices, dtype=np.float64).reshape(-1, poseio.MATRIX_SIZE)
+    difference = np.abs(poseMatrices - restMatrices[poseIndices]).max(axis=1) if len(poseIndices) else np.zeros(0)
+    changed = difference > tolerance
+    changedIndices = poseIndices[changed]
+
+    # extra controls are stored against the identity
+    extraMatrices = np.asarray(extraMatrices, dtype=np.float64).reshape(-1, poseio.MATRIX_SIZE)
+    baseMatrices = np.concatenate([restMatrices[changedIndices], np.tile(np.eye(4).ravel(), (len(extraMatrices), 1))])
+    targetMatrices = np.concatenate([poseMatrices[changed], extraMatrices])
+    baseT, baseQ, baseS = transforms.decomposeMatrices(baseMatrices)
+    targetT, targetQ, targetS = transforms.decomposeMatrices(targetMatrices)
+    recomposed = transforms.composeMatrices(targetT, targetQ, targetS).reshape(-1, poseio.MATRIX_SIZE)
+    sheared = np.abs(recomposed - targetMatrices).max(axis=1) > config.DELTA_SHEAR_TOLERANCE
+    if np.any(sheared):
+        targetControls = [restControls[index] for index in changedIndices] + extraControls
+        raise ValueError("Delta poses only store translation, rotation and scale, sheared controls: {}".format(
+            ", ".join(control for control, shear in zip(targetControls, sheared) if shear)))
+    deltaQ = transforms.multiplyQuaternions(transforms.conjugateQuaternions(baseQ), targetQ)
+    deltaQ *= np.where(deltaQ[:, 3:] < 0.0, -1.0, 1.0)
+
+    translations, translationWidth = quantise(targetT - baseT, precision["translate"])
+    rotations, rotationWidth = quantise(deltaQ, precision["rotate"])
+    scales, scaleWidth = quantise(targetS - baseS, precision["scale"])
+
+    namesBlock = "\0".join(extraControls).encode("utf-8")
+    metaBlock = json.dumps(meta or poseio.buildPoseMetadata(poseData), separators=(",", ":"), sort_keys=True).encode("utf-8")
+    header = DELTA_HEADER.pack(DELTA_MAGIC, DELTA_VERSION, 0, len(restControls), len(changedIndices),
+                               len(extraControls), len(namesBlock), len(metaBlock), precision["translate"],
+                               precision["rotate"], precision["scale"], translationWidth, rotationWidth,
+                               scaleWidth, restHash.encode("ascii"))
+    buffer = io.BytesIO()
+    buffer.write(header)
+    buffer.write(metaBlock)
+    buffer.write(np.packbits(presence).tobytes())
+    buffer.write(changedIndices.astype("<u4").tobytes())
+    buffer.write(namesBlock)
+    buffer.write(translations.tobytes())
+    buffer.write(rotations.tobytes())
+    buffer.write(scales.tobytes())
+    return buffer.getvalue()
+
+
+def readDeltaHeader(data):
+    if len(data) < DELTA_HEADER.size:
+        raise ValueError("Truncated delta pose header")
+    fields = DELTA_HEADER.unpack_from(data)
+    if fields[0] != DELTA_MAGIC:
+        raise ValueError("Not a delta pose")
+    if fields[1] > DELTA_VERSION:
+        raise ValueError("Unsupported delta pose version: {}".format(fields[1]))
+    keys = ("magic", "version", "flags", "restCount", "changedCount", "extraCount", "namesSize", "metaSize",
+            "translateStep", "rotateStep", "scaleStep", "translateWidth", "rotateWidth", "scaleWidth", "restHash")
+    header = dict(zip(keys, fields))
+    header["restHash"] = header["restHash"].decode("ascii")
+    return header
+
+
+def decodeDeltaMetadata(data):
+    header = readDeltaHeader(data)
+    if not header["metaSize"]:
+        return None
+    start = DELTA_HEADER.size
+    return json.loads(data[start:start + header["metaSize"]].decode("utf-8"))
+
+
+def decodeDeltaPose(data, restControls, restMatrices, restHash):
+    """
+    Rebuild the {control: matrix} dictionary lib.applyPose expects from a delta pose
+    Args:
+        data (bytes): Encoded delta pose
+        restControls (list): Sorted rest pose control names
+        restMatrices (np.ndarray): (N, 16) rest pose matrices
+        restHash (str): sha1 of the rest pose
+    Returns:
+        dict: Pose data, matrices as lists of 16 floats
+    """
+    header = readDeltaHeader(data)
+    if header["restHash"] != restHash or header["restCount"] != len(restControls):
+        raise ValueError("The delta pose was saved against a different rest pose")
+
+    offset = DELTA_HEADER.size + header["metaSize"]
+    restCount = header["restCount"]
+    presenceSize = (restCount + 7) // 8
+    valuesSize = (header["changedCount"] + header["extraCount"]) * (
+        3 * header["translateWidth"] + 4 * header["rotateWidth"] + 3 * header["scaleWidth"])
+    if len(data) < offset + presenceSize + header["changedCount"] * 4 + header["namesSize"] + valuesSize:
+        raise ValueError("Truncated delta pose data")
+    presence = np.unpackbits(np.frombuffer(data, dtype=np.uint8, count=presenceSize, offset=offset))[:restCount]
+    offset += presenceSize
+    changedCount = header["changedCount"]
+    changedIndices = np.frombuffer(data, dtype="<u4", count=changedCount, offset=offset)
+    offset += changedCount * 4
+    extraCount = header["extraCount"]
+    namesBlock = data[offset:offset + header["namesSize"]]
+    extraControls = namesBlock.decode("utf-8").split("\0") if extraCount else []
+    offset += header["namesSize"]
+
+    count = changedCount + extraCount
+    arrays = []
+    for name, columns in (("translate", 3), ("rotate", 4), ("scale", 3)):
+        dtype = INTEGER_TYPES[header[name + "Width"]]
+        values = np.frombuffer(data, dtype=dtype, count=count * columns, offset=offset).reshape(count, columns)
+        offset += values.nbytes
+        arrays.append(values * header[name + "Step"])
+    deltaT, deltaQ, deltaS = arrays
+
+    baseMatrices = np.concatenate([restMatrices[changedIndices], np.tile(np.eye(4).ravel(), (extraCount, 1))])
+    baseT, baseQ, baseS = transforms.decomposeMatrices(baseMatrices)
+    matrices = transforms.composeMatrices(baseT + deltaT, transforms.multiplyQuaternions(baseQ, deltaQ), baseS + deltaS)
+    matrices = matrices.reshape(count, poseio.MATRIX_SIZE)
+
+    # unchanged controls get the exact rest matrix back
+    poseMatrices = restMatrices.copy()
+    poseMatrices[changedIndices] = matrices[:changedCount]
+    poseData = {}
+    for index in np.flatnonzero(presence):
+        poseData[restControls[index]] = poseMatrices[index].tolist()
+    for control, matrix in zip(extraControls, matrices[changedCount:]):
+        poseData[control] = matrix.tolist()
+    return poseData
+
+
+def encodeDeltaPoseFile(charDirectory, poseData, meta=None):
+    restControls, restMatrices, restHash = readRestPose(charDirectory)
+    return encodeDeltaPose(poseData, restControls, restMatrices, restHash, meta=meta)
+
+
+def loadDeltaPose(data, charDirectory):
+    restControls, restMatrices, restHash = readRestPose(charDirectory)
+    return decodeDeltaPose(data, restControls, restMatrices, restHash)
+
+
+def setRestPose(charDirectory, restPoseData):
+    """
+    Save the rest pose of a character. Existing delta poses are re-encoded against the new rest pose
+    Args:
+        charDirectory (str): Character directory
+        restPoseData (dict): {control: matrix} rest pose, usually every control at its default value
+    Returns:
+        list: Paths of the delta poses that were re-encoded
+    """
+    deltaPoses = {}
+    if os.path.isfile(getRestPosePath(charDirectory)):
+        for poseFile in os.listdir(charDirectory):
+            if not poseFile.endswith(config.DELTA_POSE_EXTENSION):
+                continue
+            posePath = os.path.join(charDirectory, poseFile)
+            with open(posePath, "rb") as fp:
+                data = fp.read()
+            deltaPoses[posePath] = (loadDeltaPose(data, charDirectory), decodeDeltaMetadata(data))
+
+    restMeta = poseio.buildPoseMetadata(restPoseData, poseName="rest")
+    utils.atomicWriteFile(getRestPosePath(charDirectory), poseio.encodeBinaryPose(restPoseData, restMeta))
+    for posePath, (poseData, meta) in deltaPoses.items():
+        utils.atomicWriteFile(posePath, encodeDeltaPoseFile(charDirectory, poseData, meta))
+    return list(deltaPoses.keys())
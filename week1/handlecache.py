@@ -0,0 +1,213 @@
+import maya.api.OpenMaya as om
+
+# Session cache of the scene controls, keyed by (namespace, short name) like the controls of the pose files.
+# A control is resolved into a ControlHandle once, the DAG path, its MFnTransform and the channel plugs
+# the apply engine writes, and every later apply, blend tick or pose selection reuses it without a name lookup.
+# Controls are expected to be unique within a namespace, as poses store them by short name.
+# Scene callbacks keep the cache in step with the scene: a new scene, a scene open and a reference
+# change clear it, a renamed or deleted transform drops its entry. getStats reports the hits and misses
+CHANNELS = ("translateX", "translateY", "translateZ", "rotateX", "rotateY", "rotateZ", "scaleX", "scaleY", "scaleZ")
+PIVOT_TOLERANCE = 1e-6
+SCENE_MESSAGES = ("kAfterNew", "kAfterOpen", "kAfterLoadReference", "kAfterUnloadReference",
+                  "kAfterRemoveReference", "kAfterCreateReference", "kAfterImport")
+
+
+def splitControlName(control):
+    """(namespace, short name) of a control name or DAG path, the namespace is None without one"""
+    namespace, _, shortName = control.split("|")[-1].rpartition(":")
+    return namespace or None, shortName
+
+
+def joinControlName(namespace, shortName):
+    return "{}:{}".format(namespace, shortName) if namespace else shortName
+
+
+def isPlugWritable(plug):
+    """Locked channels and channels driven by anything but an animation curve are left alone, like xform"""
+    for channel in (plug, plug.parent()):
+        if channel.isLocked:
+            return False
+        if channel.isDestination and not channel.source().node().hasFn(om.MFn.kAnimCurve):
+            return False
+    return True
+
+
+class ControlHandle(object):
+    """
+    Resolved scene control, valid as long as its node exists and keeps its name. The plugs are resolved
+    once, the state that can change without a rename, locks, connections, pivots, rotate axis and joint
+    orient, is read again by refreshState before every apply
+    """
+    def __init__(self, name, dagPath):
+        node = dagPath.node()
+        self.name = name
+        self.dagPath = dagPath
+        self.objectHandle = om.MObjectHandle(node)
+        self.transformFn = om.MFnTransform(dagPath)
+        self.plugs = [self.transformFn.findPlug(channel, False) for channel in CHANNELS]
+        self.rotateOrderPlug = self.transformFn.findPlug("rotateOrder", False)
+        self.jointOrientPlugs = None
+        if node.hasFn(om.MFn.kJoint):
+            self.jointOrientPlugs = [self.transformFn.findPlug(attribute, False)
+                                     for attribute in ("jointOrientX", "jointOrientY", "jointOrientZ")]
+        self.refreshState()
+
+    def refreshState(self):
+        """Read the channels a pose can set, the pivots and the orientation of the control"""
+        # (index in CHANNELS, plug) of the channels a pose can set
+        self.channels = [(index, plug) for index, plug in enumerate(self.plugs) if isPlugWritable(plug)]
+        pivots = [self.transformFn.rotatePivot(om.MSpace.kTransform), self.transformFn.scalePivot(om.MSpace.kTransform),
+                  self.transformFn.rotatePivotTranslation(om.MSpace.kTransform),
+                  self.transformFn.scalePivotTranslation(om.MSpace.kTransform)]
+        self.pivoted = any(abs(value) > PIVOT_TOLERANCE for pivot in pivots for value in (pivot.x, pivot.y, pivot.z))
+        # rotation of a transform is rotateAxis * rotate * jointOrient
+        rotateAxis = self.transformFn.rotateOrientation(om.MSpace.kTransform)
+        self.rotateAxisInverse = None if rotateAxis.isEquivalent(om.MQuaternion()) else rotateAxis.inverse()
+        self.jointOrientInverse = None
+        if self.jointOrientPlugs:
+            jointOrient = om.MEulerRotation(*[plug.asDouble() for plug in self.jointOrientPlugs])
+            if not jointOrient.isZero():
+                self.jointOrientInverse = jointOrient.asQuaternion().inverse()
+
+    def isValid(self):
+        return self.objectHandle.isValid()
+
+    def getMatrix(self):
+        """Object space matrix as a list of 16 floats, like mc.xform(query=True, matrix=True, objectSpace=True)"""
+        return list(self.transformFn.transformation().asMatrix())
+
+    def getChannelValues(self, matrix):
+        """Values of CHANNELS for an object space matrix, rotations in radians in the rotate order of the control"""
+        transformation = om.MTransformationMatrix(om.MMatrix(matrix))
+        translation = transformation.translation(om.MSpace.kTransform)
+        rotation = transformation.rotation(asQuaternion=True)
+        if self.rotateAxisInverse is not None:
+            rotation = self.rotateAxisInverse * rotation
+        if self.jointOrientInverse is not None:
+            rotation = rotation * self.jointOrientInverse
+        # the rotateOrder enum and the MEulerRotation orders share the same values
+        euler = rotation.asEulerRotation().reorder(self.rotateOrderPlug.asInt())
+        scale = transformation.scale(om.MSpace.kTransform)
+        return (translation.x, translation.y, translation.z, euler.x, euler.y, euler.z, scale[0], scale[1], scale[2])
+
+
+class HandleCache(object):
+    def __init__(self):
+        # (namespace, short name) -> ControlHandle
+        self.handles = {}
+        # MObjectHandle hash -> (namespace, short name), for the node callbacks
+        self.keysByHash = {}
+        self.callbackIds = []
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self.handles)
+
+    def install(self):
+        """Register the scene callbacks that invalidate the cache"""
+        if self.callbackIds:
+            return
+        for message in SCENE_MESSAGES:
+            self.callbackIds.append(om.MSceneMessage.addCallback(getattr(om.MSceneMessage, message), self.onSceneChanged))
+        self.callbackIds.append(om.MNodeMessage.addNameChangedCallback(om.MObject(), self.onNodeRenamed))
+        self.callbackIds.append(om.MDGMessage.addNodeRemovedCallback(self.onNodeRemoved, "transform"))
+
+    def uninstall(self):
+        if self.callbackIds:
+            om.MMessage.removeCallbacks(self.callbackIds)
+            self.callbackIds = []
+        self.clear()
+
+    def clear(self):
+        self.handles.clear()
+        self.keysByHash.clear()
+
+    def onSceneChanged(self, *args):
+        self.invalidations += len(self.handles)
+        self.clear()
+
+    def onNodeRenamed(self, node, previousName, *args):
+        self.discard(node)
+
+    def onNodeRemoved(self, node, *args):
+        self.discard(node)
+
+    def discard(self, node):
+        key = self.keysByHash.pop(om.MObjectHandle(node).hashCode(), None)
+        if key is not None and self.handles.pop(key, None) is not None:
+            self.invalidations += 1
+
+    def getHandle(self, control, namespace=None):
+        """
+        Handle of a scene control
+        Args:
+            control (str): Control name or DAG path, or the short name when a namespace is given
+            namespace (str): Namespace of the character, replaces the namespace of the control
+        Returns:
+            ControlHandle: None when no transform has that name
+        """
+        controlNamespace, shortName = splitControlName(control)
+        key = (namespace or controlNamespace, shortName)
+        handle = self.handles.get(key)
+        if handle is not None and handle.isValid():
+            self.hits += 1
+            return handle
+        self.misses += 1
+        # DAG paths resolve duplicated short names, other names resolve with their namespace
+        name = control if namespace is None and "|" in control else joinControlName(*key)
+        selectionList = om.MSelectionList()
+        try:
+            selectionList.add(name)
+            dagPath = selectionList.getDagPath(0)
+        except (RuntimeError, TypeError):
+            # missing, ambiguous or not a DAG node
+            return None
+        if not dagPath.node().hasFn(om.MFn.kTransform):
+            return None
+        handle = ControlHandle(name, dagPath)
+        self.handles[key] = handle
+        self.keysByHash[handle.objectHandle.hashCode()] = key
+        return handle
+
+    def getHandles(self, controls, namespace=None):
+        """Handles of several controls, None for the missing ones"""
+        return [self.getHandle(control, namespace) for control in controls]
+
+    def getStats(self):
+        """
+        Returns:
+            dict: handles, hits, misses, hit rate and the entries dropped by the scene callbacks
+        """
+        lookups = self.hits + self.misses
+        return {"handles": len(self.handles), "hits": self.hits, "misses": self.misses,
+                "hitRate": self.hits / float(lookups) if lookups else 0.0, "invalidations": self.invalidations}
+
+    def resetStats(self):
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+
+# a reload of the module releases the callbacks of the previous cache
+if globals().get("_handleCache") is not None:
+    _handleCache.uninstall()
+_handleCache = None
+
+
+def getHandleCache():
+    """Handle cache of the session, its scene callbacks are registered on first use"""
+    global _handleCache
+    if _handleCache is None:
+        _handleCache = HandleCache()
+        _handleCache.install()
+    return _handleCache
+
+
+def releaseHandleCache():
+    """Remove the scene callbacks and drop the cache, when the UI closes"""
+    global _handleCache
+    if _handleCache is not None:
+        _handleCache.uninstall()
+        _handleCache = None
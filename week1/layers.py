@@ -0,0 +1,145 @@
+import fnmatch
+
+import numpy as np
+
+from . import blend
+from . import transforms
+from . import utils
+
+# Pose layer stack, e.g. a body pose, an additive hand pose and a face pose evaluated together.
+# Layers are applied bottom to top on the decomposed base pose: an override layer blends its controls
+# towards its pose by its weight, an additive layer adds its difference to a reference pose, usually the
+# rest pose. Masks are compiled into index arrays when a layer is added, evaluate then runs one vectorised
+# pass per layer and returns every control touched by the stack once.
+OVERRIDE = "override"
+ADDITIVE = "additive"
+IDENTITY_QUATERNION = np.array([0.0, 0.0, 0.0, 1.0])
+
+
+def getShortName(control):
+    return control.split("|")[-1].split(":")[-1]
+
+
+class ControlMask(object):
+    """
+    Controls a layer acts on. A control is kept when it matches any pattern or category, or all controls
+    when neither is given, and is not excluded
+    Args:
+        patterns (list): fnmatch patterns of control short names, e.g. ["L_*_finger*"]
+        poseTypes (list): utils.getPoseType categories of the control names, e.g. ["Hand"]
+        exclude (list): fnmatch patterns of controls to leave out
+    """
+    def __init__(self, patterns=None, poseTypes=None, exclude=None):
+        self.patterns = list(patterns or [])
+        self.poseTypes = list(poseTypes or [])
+        self.exclude = list(exclude or [])
+
+    def matches(self, control):
+        name = getShortName(control)
+        if any(fnmatch.fnmatchcase(name, pattern) for pattern in self.exclude):
+            return False
+        if not self.patterns and not self.poseTypes:
+            return True
+        return any(fnmatch.fnmatchcase(name, pattern) for pattern in self.patterns) \
+            or utils.getPoseType(name) in self.poseTypes
+
+    def compile(self, controls):
+        """Indices of the matching controls in a control list"""
+        return np.array([index for index, control in enumerate(controls) if self.matches(control)], dtype=np.int64)
+
+
+class PoseLayer(object):
+    """
+    One layer of a LayerStack
+    Args:
+        poseData (dict): {control: matrix} of the layer pose
+        mode (str): OVERRIDE or ADDITIVE
+        weight (float): 0.0 to 1.0
+        mask (ControlMask): Controls of the layer, the controls of the pose by default
+        referencePoseData (dict): Pose the additive difference is taken from, the identity when missing
+        name (str): Label of the layer
+    """
+    def __init__(self, poseData, mode=OVERRIDE, weight=1.0, mask=None, referencePoseData=None, name=None):
+        if mode not in (OVERRIDE, ADDITIVE):
+            raise ValueError("Unknown pose layer mode: {}".format(mode))
+        self.poseData = {getShortName(control): matrix for control, matrix in poseData.items()}
+        self.mode = mode
+        self.weight = weight
+        self.mask = mask or ControlMask()
+        self.referencePoseData = {getShortName(control): matrix for control, matrix in (referencePoseData or {}).items()}
+        self.name = name or mode
+
+
+class CompiledLayer(object):
+    """Index array and decomposed components of a layer for the controls of a stack"""
+    def __init__(self, layer, controls):
+        self.layer = layer
+        shortNames = [getShortName(control) for control in controls]
+        indices = layer.mask.compile(controls)
+        self.indices = np.array([index for index in indices if layer.poseData.get(shortNames[index])], dtype=np.int64)
+        matrices = [layer.poseData[shortNames[index]] for index in self.indices]
+        translations, quaternions, scales = transforms.decomposeMatrices(np.reshape(matrices, (-1, 16)))
+        if layer.mode == ADDITIVE:
+            references = [layer.referencePoseData.get(shortNames[index]) for index in self.indices]
+            refTranslations, refQuaternions, refScales = transforms.decomposeMatrices(
+                [reference or np.identity(4).ravel() for reference in references] or np.zeros((0, 16)))
+            translations = translations - refTranslations
+            quaternions = transforms.multiplyQuaternions(transforms.conjugateQuaternions(refQuaternions), quaternions)
+            scales = scales - refScales
+        self.translations = translations
+        self.quaternions = quaternions
+        self.scales = scales
+
+
+class LayerStack(object):
+    """
+    Layers evaluated on top of a base pose, usually the current scene pose of the controls
+    Args:
+        controls (list): Scene controls of the stack
+        baseMatrices (np.ndarray): (N, 16) or (N, 4, 4) matrices of the controls under the layers
+    """
+    def __init__(self, controls, baseMatrices):
+        self.controls = list(controls)
+        self.baseMatrices = transforms.asMatrixStack(baseMatrices)
+        if len(self.baseMatrices) != len(self.controls):
+            raise ValueError("Expected {} base matrices, got {}".format(len(self.controls), len(self.baseMatrices)))
+        self.baseTranslations, self.baseQuaternions, self.baseScales = transforms.decomposeMatrices(self.baseMatrices)
+        self.layers = []
+        self.touched = np.zeros(0, dtype=np.int64)
+
+    def addLayer(self, layer):
+        """Compile a PoseLayer for the controls of the stack and put it on top"""
+        compiled = CompiledLayer(layer, self.controls)
+        self.layers.append(compiled)
+        self.touched = np.union1d(self.touched, compiled.indices).astype(np.int64)
+        return compiled
+
+    def setWeight(self, index, weight):
+        self.layers[index].layer.weight = weight
+
+    def evaluate(self):
+        """
+        Evaluate every layer
+        Returns:
+            tuple: (indices of the controls touched by the stack, (M, 4, 4) matrices of those controls)
+        """
+        translations = self.baseTranslations.copy()
+        quaternions = self.baseQuaternions.copy()
+        scales = self.baseScales.copy()
+        for compiled in self.layers:
+            weight = max(0.0, min(1.0, float(compiled.layer.weight)))
+            indices = compiled.indices
+            if not weight or not len(indices):
+                continue
+            if compiled.layer.mode == OVERRIDE:
+                translations[indices] += (compiled.translations - translations[indices]) * weight
+                scales[indices] += (compiled.scales - scales[indices]) * weight
+                quaternions[indices] = blend.slerpQuaternions(quaternions[indices], compiled.quaternions, weight)
+            else:
+                translations[indices] += compiled.translations * weight
+                scales[indices] += compiled.scales * weight
+                identity = np.broadcast_to(IDENTITY_QUATERNION, compiled.quaternions.shape)
+                delta = blend.slerpQuaternions(identity, compiled.quaternions, weight)
+                quaternions[indices] = transforms.multiplyQuaternions(quaternions[indices], delta)
+        touched = self.touched
+        return touched, transforms.composeMatrices(translations[touched], quaternions[touched], scales[touched])
@@ -1,9 +1,22 @@
 import json
 import os
+import time
+from collections import deque
 import maya.cmds as mc
 import maya.api.OpenMaya as om
+import numpy as np
 from . import config
 from . import utils
+from . import poseio
+from . import posecache
+from . import deltapose
+from . import schema
+from . import blend
+from . import layers
+from . import handlecache
+from . import controlindex
+from . import poseapply
+from . import writer
 
 
 
@@ -63,58 +76,32 @@ def getJoints():
 #     return controls
 
 def getControls(selection = True):
+    """
+    Controls of the character of the selected node, from the control index of its namespace
+    Args:
+        selection (bool): If True, only return the selected controls, or the selection when none is a control
+    Returns:
+        list: Control names, long DAG paths
+    """
     selectedNodes = mc.ls(selection = True) or []
     if not selectedNodes:
         mc.warning("please select at least one control in the scene.")
         return []
+    namespace = handlecache.splitControlName(selectedNodes[0])[0]
     
-    # Try to find namespace
-    namespace = None
-    if selectedNodes:
-        if ":" in selectedNodes[0]:
-            namespace = selectedNodes[0].split(":")[0]
-    else:
-        all_nodes = mc.ls("*:*") or []
-        if all_nodes:
-            namespace = all_nodes[0].split(":")[0]
-    
-    # List of possible control group names
-    possible_groups = [
-        "ctrl_GRP",
-        "ctrl",
-        "controls_GRP",
-        "CONTROLS",
-        "Controls_GRP",
-        "ControlsGRP",
-        "controls"
-    ]
-    
-    # Add namespace versions if namespace exists
-    if namespace:
-        possible_groups.extend(["{}:{}".format(namespace, group) for group in possible_groups])
-    
-    # Try to find the control group
-    topNode = None
-    for group in possible_groups:
-        if mc.objExists(group):
-            topNode = group
-            print("Found control group: {}".format(topNode))
-            break
-    
-    if not topNode:
+    # the index is built with one query per namespace and only rebuilt when the rig changes
+    namespaceControls = controlindex.getControlIndex().getNamespaceControls(namespace)
+    if namespaceControls is None:
         # If we're in selection mode, just return the selection
-        if selection and selectedNodes:
+        if selection:
             return selectedNodes
         mc.warning("Could not find control group in scene!")
         return []
     
-    #how to select: select all children, and get the controls
-    allChildren = mc.listRelatives(topNode, allDescendents = True, type = "transform", fullPath = True) or []
-    controls = [control for control in allChildren if mc.objExists(control + ".controlType")]
-    
+    controls = namespaceControls.controls
     # Filter by selection if needed
-    if selection and selectedNodes:
-        controls = [control for control in controls if control in selectedNodes]
+    if selection:
+        controls = namespaceControls.filterSelection(mc.ls(selection = True, long = True) or [])
     
     if not controls:
         if selection:
@@ -122,15 +109,15 @@ def getControls(selection = True):
             return selectedNodes
         mc.warning("No controls found!")
     
-    return controls
+    return list(controls)
     
 
 def getPoseData(controls):
     poseData = dict()
     for control in controls:
         matrix = mc.xform(control, matrix=True, objectSpace=True, query=True)
-        #remove namespace if exists
-        control = control.split(":")[-1]
+        #remove the DAG path and the namespace if they exist
+        control = control.split("|")[-1].split(":")[-1]
         poseData[control] = matrix
     return poseData
 
@@ -205,62 +192,130 @@ def getPoseData(controls):
 #                 for attr in keyableAttrs:
 #                     mc.setKeyframe(control, attr=attr)
 
+def iterPoseItems(poseData):
+    """
+    Iterate (control, matrix) pairs of a pose dictionary or of a pose stream from iterPoseData.
+    Controls saved with the legacy attribute schema are converted to matrices on the fly
+    """
+    items = poseData.items() if isinstance(poseData, dict) else poseData
+    for control, value in items:
+        yield schema.upgradePoseItem(control, value)
+
 def applyPose(poseData, selectedControls = None, excludeRootAndMainControls = False, keyPosedControls = False):
+    """
+    Apply a pose on the character of the selected control, through the OpenMaya engine of poseapply
+    Args:
+        poseData (dict or iterable): Pose data, or a (control, matrix) stream from iterPoseData so the
+            controls are posed while the file is still being read
+    """
     selectedNodes = mc.ls(selection=True)
     if not selectedNodes:
         mc.warning("Please select the character in the scene.")
         return
     selectedNode = selectedNodes[0]
     namespace = getNamespace(selectedNode)
+    applyPoseItems(iterPoseItems(poseData), namespace, selectedControls, excludeRootAndMainControls, keyPosedControls)
 
-    for control, matrix in poseData.items():
-        # Apply pose only if the control exists in the scene
-        if namespace:
-            control = "{}:{}".format(namespace, control)
-
-        if not mc.ls(control):
-            continue
-        if excludeRootAndMainControls:
-            if "RootControl1" in control or "MainControl1" in control:
-                continue
-        # Check if applying to all controls or selected controls
-        if selectedControls is None or control in selectedControls:
-            mc.xform(control, matrix=matrix, objectSpace=True)
-            if keyPosedControls:
-                keyableAttrs = mc.listAttr(control, keyable=True) or []
-                for attr in keyableAttrs:
-                    mc.setKeyframe(control, attribute=attr)
+def applyPoseItems(poseItems, namespace=None, selectedControls=None, excludeRootAndMainControls=False,
+                   keyPosedControls=False):
+    """
+    Pose the scene controls through poseapply as one undo step, with their keys
+    Args:
+        poseItems (iterable): (control, matrix) pairs
+        namespace (str): Namespace of the character, the namespace of the controls when None
+    Returns:
+        list: Scene controls that were posed
+    """
+    # one undo step for the whole pose and its keys
+    mc.undoInfo(openChunk=True, chunkName="applyPose")
+    try:
+        posedControls = poseapply.getApplyEngine().apply(
+            poseItems, namespace, selectedControls, excludeRootAndMainControls)
+        if keyPosedControls:
+            keyControls(posedControls)
+    finally:
+        mc.undoInfo(closeChunk=True)
+    return posedControls
+
+def keyControls(controls):
+    """
+    Key every keyable attribute of the controls at the current time in one setKeyframe call, instead of
+    a listAttr and a setKeyframe per attribute
+    Args:
+        controls (list): Controls to key
+    """
+    if controls:
+        mc.setKeyframe(controls)
                 
 # def writePoseData(filepath, poseData):
 #     with open(filepath, "w") as fp:
 #         json.dump(poseData, fp, ensure_ascii=True, indent=4, sort_keys=True)
 
-def writePoseData(filepath, poseData):
+def writePoseData(filepath, poseData, namespace=None):
     """
-    Write pose data to file
+    Write pose data to file, files with the binary pose extension are written in the binary format
     Args:
         filepath (str): Path to save the pose file
         poseData (dict): Pose data to save
+        namespace (str): Namespace of the character the pose comes from, stored in the pose header
     """
     try:
         # Verify data structure before saving
-        if not isinstance(poseData, dict):
-            raise ValueError("Pose data must be a dictionary")
-        
-        for ctrl, data in poseData.items():
-            if not isinstance(data, dict):
-                raise ValueError("Control data must be a dictionary for control: {}".format(ctrl))
+        poseio.validatePoseData(poseData)
         
-        with open(filepath, 'w') as fp:
-            json.dump(poseData, fp, ensure_ascii = False, indent = 4, sort_keys = True)
+        poseName = os.path.splitext(os.path.basename(filepath))[0]
+        meta = poseio.buildPoseMetadata(poseData, poseName=poseName, namespace=namespace)
+        poseio.writePoseFile(filepath, poseData, meta)
         print("Successfully wrote pose data with {} controls".format(len(poseData)))
     except Exception as e:
         mc.warning("Error writing pose file: {}".format(e))
 
+def writePoseDataAsync(filepath, poseData, namespace=None):
+    """
+    Queue pose data to be written on the background writer thread, returns immediately.
+    Use flushPoseWrites when a script needs the file on disk before going on
+    Args:
+        filepath (str): Path to save the pose file
+        poseData (dict): Pose data to save
+        namespace (str): Namespace of the character the pose comes from, stored in the pose header
+    """
+    writer.getWriteQueue().submit(filepath, poseData, namespace=namespace)
+
+def flushPoseWrites(timeout=None):
+    """
+    Block until every queued pose write is committed
+    Args:
+        timeout (float): Maximum time to wait in seconds, None waits forever
+    Returns:
+        bool: True if every write is committed
+    """
+    return writer.getWriteQueue().flush(timeout)
+
+def saveRestPose(charDirectory, controls):
+    """
+    Save the current pose of the controls as the rest pose delta poses of the character are stored against.
+    Run it with the rig at its default pose
+    Args:
+        charDirectory (str): Character directory
+        controls (list): Controls of the rig, usually lib.getControls(selection=False)
+    """
+    reencodedPoses = deltapose.setRestPose(charDirectory, getPoseData(controls))
+    print("Saved rest pose with {} controls, re-encoded {} delta poses".format(len(controls), len(reencodedPoses)))
+
 def readPoseData(filepath):
-    with open(filepath) as fp:
-        poseData = json.load(fp)
-    return poseData
+    # json and binary poses share the same extension list, so detect the format by header.
+    # parsed poses are cached until the file changes, see posecache.PoseCache
+    return posecache.getPoseCache().get(filepath, lambda: poseio.readPoseFile(filepath))
+
+def iterPoseData(filepath):
+    """
+    Stream the (control, matrix) pairs of a pose file, applyPose and poseBlend accept the stream directly
+    Args:
+        filepath (str): Path of the pose file
+    Returns:
+        generator: (control, matrix) pairs in file order
+    """
+    return posecache.getPoseCache().stream(filepath, lambda: poseio.iterPoseFile(filepath))
 
 def getViewportSettings():
     """Get current viewport settings
@@ -339,27 +394,246 @@ def createThumbnailFromCurrentView(poseName, poseDir, fileType='png'):
     restoreViewportSettings(activeView, backgroundColor)
 
 def poseBlend(srcPoseData, dstPoseData, factor):
-    factorNormalized = factor / 100.0
-    mc.refresh(suspend=True)
-    for control, matrix in srcPoseData.items():
-        if not mc.ls(control):
-            continue
-        srcMatrix = om.MMatrix(matrix)
-        if not dstPoseData.get(control.split(":")[-1]):
+    """
+    Blend the scene controls from their current matrices towards a pose
+    Args:
+        srcPoseData (dict): {scene control: matrix} of the current pose
+        dstPoseData (dict or iterable): Pose to blend to, or a (control, matrix) stream from iterPoseData
+        factor (float): Blend factor from 0 to 100
+    """
+    controls, blender = createPoseBlender(srcPoseData, dstPoseData)
+    applyBlend(controls, blender, factor / 100.0)
+
+def createPoseBlender(srcPoseData, dstPoseData):
+    """
+    Match the pose controls with the scene controls and decompose both poses once
+    Args:
+        srcPoseData (dict): {scene control: matrix} of the current pose
+        dstPoseData (dict or iterable): Pose to blend to, or a (control, matrix) stream from iterPoseData
+    Returns:
+        tuple: (scene controls, blend.PoseBlender of their matrices)
+    """
+    # pose files store controls without namespace, match them with the scene controls by short name
+    srcControls = {control.split("|")[-1].split(":")[-1]: control for control in srcPoseData}
+    handleCache = handlecache.getHandleCache()
+    controls = []
+    dstMatrices = []
+    for dstControl, dstMatrix in iterPoseItems(dstPoseData):
+        control = srcControls.get(dstControl.split(":")[-1])
+        if not control or not dstMatrix:
             continue
-        else:
-            dstMatrix = om.MMatrix(dstPoseData.get(control.split(":")[-1]))
-        #optimization purpose
-        if srcMatrix.isEquivalent(dstMatrix, 1e-5):
+        if handleCache.getHandle(control) is None:
             continue
-        blendedMatrix = blendTransformationMatrices(srcMatrix, dstMatrix, factorNormalized)
-        # use dagpath to apply blendmatrix on controls
-        sel = om.MSelectionList()
-        sel.add(control)
-        dagPath = sel.getDagPath(0)
-        transfromFn = om.MFnTransform(dagPath)
-        transfromFn.setTransformation(om.MTransformationMatrix(blendedMatrix))
-    mc.refresh(suspend=False)
+        controls.append(control)
+        dstMatrices.append(dstMatrix)
+    srcMatrices = [srcPoseData[control] for control in controls]
+    return controls, blend.PoseBlender(srcMatrices, dstMatrices)
+
+def applyBlend(controls, blender, factor):
+    """
+    Set the controls to the matrices of a blend, controls already at the destination are skipped
+    Args:
+        controls (list): Scene controls, in the order of the blender matrices
+        blender (blend.PoseBlender): Decomposed source and destination matrices
+        factor (float): Blend factor from 0.0 to 1.0
+    """
+    changedControls = [controls[index] for index in blender.getChangedIndices()]
+    setTransformMatrices(getTransformFns(changedControls), blender.blendChanged(factor))
+
+def getTransformFns(controls):
+    """MFnTransform of every control from the handle cache, so blends can write them without name lookups"""
+    return [handle.transformFn for handle in handlecache.getHandleCache().getHandles(controls)]
+
+def getControlMatrices(controls):
+    """
+    Object space matrices of the scene controls, read through the handle cache
+    Returns:
+        dict: {control: matrix} of the controls that exist
+    """
+    handleCache = handlecache.getHandleCache()
+    controlMatrices = {}
+    for control in controls:
+        handle = handleCache.getHandle(control)
+        if handle is not None:
+            controlMatrices[control] = handle.getMatrix()
+    return controlMatrices
+
+def setTransformMatrices(transformFns, matrices):
+    """Set the transforms to a (N, 4, 4) stack of matrices with the viewport refresh suspended"""
+    matrices = matrices.reshape(len(transformFns), 16).tolist()
+    mc.refresh(suspend=True)
+    try:
+        for transformFn, matrix in zip(transformFns, matrices):
+            transformFn.setTransformation(om.MTransformationMatrix(om.MMatrix(matrix)))
+    finally:
+        mc.refresh(suspend=False)
+
+class BlendSession(object):
+    """
+    Everything the blend slider needs, prepared once when a pose is selected: the decomposed source and
+    destination matrices, the controls that differ and their MFnTransform handles. A slider tick only
+    interpolates and writes the matrices. The latency of the last ticks is kept for profiling
+    """
+    def __init__(self, srcPoseData, dstPoseData):
+        controls, self.blender = createPoseBlender(srcPoseData, dstPoseData)
+        self.initSession([controls[index] for index in self.blender.getChangedIndices()])
+    
+    def initSession(self, controls):
+        """Resolve the controls the session writes, shared by every session"""
+        self.controls = controls
+        self.transformFns = getTransformFns(self.controls)
+        # (interpolation seconds, write seconds) of the last ticks
+        self.tickTimes = deque(maxlen=config.BLEND_TICK_SAMPLES)
+    
+    def __len__(self):
+        return len(self.controls)
+    
+    def apply(self, factor):
+        """
+        Set the controls to the blend at a factor
+        Args:
+            factor (float): Blend factor from 0.0, the scene pose when the session was created, to 1.0
+        """
+        self.writeMatrices(lambda: self.blender.blendChanged(factor))
+    
+    def writeMatrices(self, evaluate):
+        """
+        Set the controls to the matrices evaluate() returns and record the latency of the tick
+        Args:
+            evaluate (callable): Returns the (N, 4, 4) matrices of the controls
+        """
+        if not self.controls:
+            return
+        start = time.perf_counter()
+        matrices = evaluate()
+        evaluated = time.perf_counter()
+        setTransformMatrices(self.transformFns, matrices)
+        self.tickTimes.append((evaluated - start, time.perf_counter() - evaluated))
+    
+    def getLatencyStats(self):
+        """
+        Latency of the recorded ticks in milliseconds
+        Returns:
+            dict: tick count, median and worst total latency, mean interpolation and write latency
+        """
+        if not self.tickTimes:
+            return {"ticks": 0, "median": 0.0, "worst": 0.0, "interpolate": 0.0, "write": 0.0}
+        totals = sorted(interpolate + write for interpolate, write in self.tickTimes)
+        count = len(self.tickTimes)
+        return {
+            "ticks": count,
+            "median": totals[count // 2] * 1000.0,
+            "worst": totals[-1] * 1000.0,
+            "interpolate": sum(interpolate for interpolate, _ in self.tickTimes) / count * 1000.0,
+            "write": sum(write for _, write in self.tickTimes) / count * 1000.0
+        }
+
+def blendPoses(poseDatas, weights, method="sum"):
+    """
+    Weighted blend of several poses, without touching the scene
+    Args:
+        poseDatas (list): Pose data dictionaries {control: matrix}
+        weights (list): One weight per pose
+        method (str): Quaternion average, "sum" or "eigen", see blend.averageQuaternions
+    Returns:
+        dict: {control: matrix} of the controls every pose stores
+    """
+    if not poseDatas:
+        raise ValueError("Blending needs at least one pose")
+    poseDatas = [dict(iterPoseItems(poseData)) for poseData in poseDatas]
+    controls = [control for control in poseDatas[0] if all(control in poseData for poseData in poseDatas[1:])]
+    if not controls:
+        raise ValueError("The poses to blend have no control in common")
+    blender = blend.MultiPoseBlender([[poseData[control] for control in controls] for poseData in poseDatas], method)
+    return dict(zip(controls, blender.blend(weights).reshape(len(controls), 16).tolist()))
+
+class MultiBlendSession(BlendSession):
+    """
+    Live weighted blend of several poses on the scene controls, e.g. hand shapes placed in a 2D blend space.
+    Controls a pose does not store keep their scene matrix in that pose. apply only averages and writes
+    """
+    def __init__(self, srcPoseData, poseDatas, method="sum"):
+        """
+        Args:
+            srcPoseData (dict): {scene control: matrix} of the current pose
+            poseDatas (list): Poses to blend, dictionaries or (control, matrix) streams
+            method (str): Quaternion average, see blend.averageQuaternions
+        """
+        srcControls = {control.split("|")[-1].split(":")[-1]: control for control in srcPoseData}
+        poseMatrices = []
+        for poseData in poseDatas:
+            matrices = {}
+            for poseControl, matrix in iterPoseItems(poseData):
+                control = srcControls.get(poseControl.split(":")[-1])
+                if control and matrix:
+                    matrices[control] = matrix
+            poseMatrices.append(matrices)
+        handleCache = handlecache.getHandleCache()
+        controls = [control for control in srcPoseData if any(control in matrices for matrices in poseMatrices)
+                    and handleCache.getHandle(control) is not None]
+        self.blender = blend.MultiPoseBlender(
+            [[matrices.get(control, srcPoseData[control]) for control in controls] for matrices in poseMatrices],
+            method)
+        self.initSession(controls)
+    
+    def apply(self, weights):
+        """
+        Set the controls to the weighted blend
+        Args:
+            weights (list): One weight per pose, e.g. from blend.getBlendSpaceWeights
+        """
+        self.writeMatrices(lambda: self.blender.blend(weights))
+
+class LayerSession(BlendSession):
+    """
+    A stack of pose layers on the character of the selected control, e.g. a body pose, an additive hand
+    pose and a face pose. The masks are compiled and the poses decomposed once against the scene pose at
+    creation, apply evaluates every layer and writes each control once. Change the weights with
+    stack.setWeight and apply again. apply is the live preview of a weight slider, it is not undoable,
+    commit writes the layers like applyPose
+    """
+    def __init__(self, poseLayers, namespace=None):
+        """
+        Args:
+            poseLayers (list): layers.PoseLayer, bottom first
+            namespace (str): Namespace of the character, from the selected control by default
+        """
+        if namespace is None:
+            selectedNodes = mc.ls(selection=True)
+            namespace = getNamespace(selectedNodes[0]) if selectedNodes else None
+        shortNames = []
+        for layer in poseLayers:
+            shortNames.extend(control for control in layer.poseData if control not in shortNames)
+        handles = [handle for handle in handlecache.getHandleCache().getHandles(shortNames, namespace) if handle]
+        controls = [handle.name for handle in handles]
+        baseMatrices = [handle.getMatrix() for handle in handles]
+        self.stack = layers.LayerStack(controls, np.reshape(baseMatrices, (-1, 16)))
+        for layer in poseLayers:
+            self.stack.addLayer(layer)
+        self.initSession([controls[index] for index in self.stack.touched])
+    
+    def apply(self):
+        self.writeMatrices(lambda: self.stack.evaluate()[1])
+    
+    def commit(self, selectedControls=None, excludeRootAndMainControls=False, keyPosedControls=False):
+        """
+        Write the evaluated layers through poseapply as one undo step, see applyPose for the arguments
+        Returns:
+            list: Scene controls that were posed
+        """
+        _, matrices = self.stack.evaluate()
+        poseItems = zip(self.controls, matrices.reshape(len(self.controls), 16).tolist())
+        return applyPoseItems(poseItems, None, selectedControls, excludeRootAndMainControls, keyPosedControls)
+
+def applyPoseLayers(poseLayers, namespace=None, selectedControls=None, excludeRootAndMainControls=False,
+                    keyPosedControls=False):
+    """
+    Evaluate pose layers once on the character of the selected control and apply them like applyPose,
+    one undoable operation instead of an applyPose per pose, see LayerSession
+    """
+    session = LayerSession(poseLayers, namespace)
+    session.commit(selectedControls, excludeRootAndMainControls, keyPosedControls)
+    return session
 
 def blendTransformationMatrices(srcMatrix, dstMatrix, blendFactor):
     """
@@ -376,7 +650,7 @@ def blendTransformationMatrices(srcMatrix, dstMatrix, blendFactor):
     
     #Extrat translation, rotation, scale components
     translation1 = t1.translation(om.MSpace.kWorld)
-    translation2 = t2.translation(om.MSpace.KWorld)
+    translation2 = t2.translation(om.MSpace.kWorld)
     rotation1 = t1.rotation(asQuaternion=True)
     rotation2 = t2.rotation(asQuaternion=True)
     scale1 = t1.scale(om.MSpace.kWorld)
@@ -0,0 +1,98 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from . import config
+from . import poseio
+from . import posestore
+from . import schema
+from . import utils
+
+# Bulk migration of legacy attribute schema poses to the matrix schema. The worker processes only need
+# numpy, run it from mayapy or a standalone python:
+#   mayapy -m pose_library.week1.migrate --dry-run
+
+
+def migratePoseFile(filepath, dryRun=False):
+    """
+    Rewrite one pose file with the current schema, keeping its format
+    Args:
+        filepath (str): Path of the pose file
+        dryRun (bool): If True, convert in memory without writing
+    Returns:
+        dict: Report with the file, status, control count and the time spent
+    """
+    start = time.time()
+    report = {"file": filepath, "status": "", "controls": 0, "seconds": 0.0}
+    try:
+        with open(filepath, "rb") as fp:
+            data = fp.read()
+        if posestore.isPoseRefData(data):
+            # the payload of a reference lives in the pose store and may be shared
+            report["status"] = "skipped (reference)"
+        else:
+            charDirectory = os.path.dirname(os.path.abspath(filepath))
+            poseData = poseio.loadPoseBytes(data, charDirectory)
+            report["controls"] = len(poseData)
+            if schema.getPoseSchema(poseData) == schema.SCHEMA_VERSION:
+                report["status"] = "up to date"
+            else:
+                oldMeta = poseio.loadPoseMetadata(data, created=os.path.getctime(filepath))
+                upgradedPoseData = schema.upgradePoseData(poseData)
+                poseName = os.path.splitext(os.path.basename(filepath))[0]
+                meta = poseio.buildPoseMetadata(upgradedPoseData, poseName=poseName, namespace=oldMeta["namespace"],
+                                                created=oldMeta["created"])
+                encoded = poseio.encodePoseFile(filepath, upgradedPoseData, meta)
+                if not dryRun:
+                    utils.atomicWriteFile(filepath, encoded)
+                report["status"] = "migrated"
+    except Exception as e:
+        report["status"] = "failed: {}".format(e)
+    report["seconds"] = time.time() - start
+    return report
+
+
+def findPoseFiles(rootDirectory):
+    poseFiles = []
+    for charDirectory in posestore.iterCharacterDirectories(rootDirectory):
+        for poseFile in sorted(utils.getValidPoseFiles(os.listdir(charDirectory))):
+            poseFiles.append(os.path.join(charDirectory, poseFile))
+    return poseFiles
+
+
+def migrateLibrary(rootDirectory=None, processes=None, dryRun=False, verbose=True):
+    """
+    Migrate every pose of a library in parallel worker processes
+    Args:
+        rootDirectory (str): Library root, defaults to config.PROJECT_ROOT
+        processes (int): Number of worker processes, defaults to the number of CPUs
+        dryRun (bool): If True, report what would change without writing
+        verbose (bool): If True, print the per file timing report
+    Returns:
+        list: One report per pose file, see migratePoseFile
+    """
+    rootDirectory = rootDirectory or config.PROJECT_ROOT
+    poseFiles = findPoseFiles(rootDirectory)
+    start = time.time()
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        reports = list(executor.map(migratePoseFile, poseFiles, [dryRun] * len(poseFiles), chunksize=8))
+    elapsed = time.time() - start
+
+    if verbose:
+        for report in reports:
+            print("{seconds:8.4f}s  {controls:6d}  {status:<24}  {file}".format(**report))
+        migrated = sum(1 for report in reports if report["status"] == "migrated")
+        failed = sum(1 for report in reports if report["status"].startswith("failed"))
+        print("{}{} of {} poses migrated, {} failed, in {:.2f} seconds".format(
+            "[dry run] " if dryRun else "", migrated, len(reports), failed, elapsed))
+    return reports
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate legacy attribute poses to matrix poses")
+    parser.add_argument("root", nargs="?", default=config.PROJECT_ROOT, help="library root directory")
+    parser.add_argument("--processes", type=int, default=None, help="number of worker processes")
+    parser.add_argument("--dry-run", action="store_true", help="report without writing any file")
+    arguments = parser.parse_args()
+    migrateLibrary(arguments.root, processes=arguments.processes, dryRun=arguments.dry_run)
@@ -0,0 +1,249 @@
+import argparse
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from . import config
+from . import poseio
+from . import schema
+from . import utils
+
+# Pose mirroring. A mirror table is compiled once per rig, from the control names of its poses: the
+# counterpart of every control (L_foot_ctrl <-> R_foot_ctrl, centre controls map to themselves) and a
+# (4, 4) sign pattern per control for the mirror convention. Mirroring a pose is then one elementwise
+# multiply of its (N, 4, 4) matrix stack. Offline, a whole character directory is mirrored with a process
+# pool, the workers only need numpy, run it from mayapy or a standalone python:
+#   mayapy -m pose_library.week1.mirror PROJECT_ROOT/category/character
+#
+# Conventions, for object space matrices of a rig mirrored across config.MIRROR_AXIS:
+#   orientation : every control is reflected, M' = S M S with S the axis reflection. For rigs whose
+#                 left and right controls have mirrored orientations in a world aligned frame
+#   behavior    : left and right controls keep their rotation and negate their translation, like joints
+#                 mirrored with the behavior option. Centre controls are reflected
+ORIENTATION_CONVENTION = "orientation"
+BEHAVIOR_CONVENTION = "behavior"
+AXES = {"x": 0, "y": 1, "z": 2}
+
+
+def getTokenPattern(token):
+    """
+    Pattern of a side token that matches inside a name, on word boundaries only: the start or the end of
+    the name, a separator, or a camel case word (armLeft_ctrl, left01). cleft_ctrl and leftovers_ctrl
+    have no side
+    """
+    pattern = re.escape(token)
+    if token[:1].isalnum():
+        # a lower case token starts a word, an upper case one may also follow a lower case letter
+        pattern = ("(?<![A-Za-z])" if token[0].islower() else "(?<![A-Z])") + pattern
+    if token[-1:].isalnum():
+        pattern += "(?![a-z])"
+    return re.compile(pattern)
+
+
+def swapSideToken(name, left, right):
+    """Replace a side token by the other side, None when the name has neither"""
+    for token, other in ((left, right), (right, left)):
+        if token.endswith("_") and not token.startswith("_"):
+            if name.startswith(token):
+                return other + name[len(token):]
+        elif token.startswith("_") and not token.endswith("_"):
+            if name.endswith(token):
+                return name[:-len(token)] + other
+        else:
+            swapped, count = getTokenPattern(token).subn(lambda match: other, name, count=1)
+            if count:
+                return swapped
+    return None
+
+
+def getMirroredName(name, sideTokens=None):
+    """
+    Name of the counterpart of a control or pose, the name itself for centre names. Namespaces and DAG
+    paths are kept
+    Args:
+        name (str): Control or pose name
+        sideTokens (list): (left, right) tokens tried in order, defaults to config.MIRROR_SIDE_TOKENS.
+            Tokens ending with "_" are prefixes, tokens starting with "_" suffixes, others match on word
+            boundaries, see getTokenPattern
+    Returns:
+        str: Mirrored name
+    """
+    prefix, _, shortName = name.rpartition("|")
+    namespace, _, shortName = shortName.rpartition(":")
+    for left, right in sideTokens or config.MIRROR_SIDE_TOKENS:
+        swapped = swapSideToken(shortName, left, right)
+        if swapped is not None:
+            shortName = swapped
+            break
+    if namespace:
+        shortName = "{}:{}".format(namespace, shortName)
+    return "{}|{}".format(prefix, shortName) if prefix else shortName
+
+
+def getMirrorSigns(axis, convention):
+    """(4, 4) sign patterns of the sided and of the centre controls"""
+    if axis not in AXES:
+        raise ValueError("Unknown mirror axis: {}".format(axis))
+    reflection = np.ones(4)
+    reflection[AXES[axis]] = -1.0
+    reflected = np.outer(reflection, reflection)
+    if convention == ORIENTATION_CONVENTION:
+        return reflected, reflected
+    if convention == BEHAVIOR_CONVENTION:
+        behavior = np.ones((4, 4))
+        behavior[3, :3] = -1.0
+        return behavior, reflected
+    raise ValueError("Unknown mirror convention: {}".format(convention))
+
+
+class MirrorTable(object):
+    """Counterpart names and sign patterns of a list of controls, see getMirrorTable"""
+    def __init__(self, controls, axis, convention):
+        self.controls = list(controls)
+        self.targets = [getMirroredName(control) for control in self.controls]
+        sidedSigns, centreSigns = getMirrorSigns(axis, convention)
+        sided = np.array([target != control for control, target in zip(self.controls, self.targets)], dtype=bool)
+        self.signs = np.where(sided[:, np.newaxis, np.newaxis], sidedSigns, centreSigns)
+
+    def mirrorMatrices(self, matrices):
+        """
+        Mirror a (N, 16) or (N, 4, 4) stack in the order of the controls, row i is the mirrored matrix
+        for targets[i]
+        """
+        return np.asarray(matrices, dtype=np.float64).reshape(-1, 4, 4) * self.signs
+
+
+_mirrorTables = {}
+
+
+def getMirrorTable(controls, axis=None, convention=None):
+    """
+    Compiled mirror table of a set of controls, cached: every pose of a rig shares the same table
+    Args:
+        controls (list): Control names
+        axis (str): "x", "y" or "z", defaults to config.MIRROR_AXIS
+        convention (str): ORIENTATION_CONVENTION or BEHAVIOR_CONVENTION, defaults to config.MIRROR_CONVENTION
+    Returns:
+        MirrorTable: Table for the controls in the given order
+    """
+    key = (tuple(controls), axis or config.MIRROR_AXIS, convention or config.MIRROR_CONVENTION)
+    table = _mirrorTables.get(key)
+    if table is None:
+        if len(_mirrorTables) >= config.MIRROR_TABLE_CACHE_SIZE:
+            _mirrorTables.pop(next(iter(_mirrorTables)))
+        table = MirrorTable(*key)
+        _mirrorTables[key] = table
+    return table
+
+
+def mirrorPoseData(poseData, axis=None, convention=None):
+    """
+    Mirror a pose: every control drives its counterpart with the mirrored matrix
+    Args:
+        poseData (dict): {control: matrix}, any schema
+        axis (str): Mirror axis, see getMirrorTable
+        convention (str): Mirror convention, see getMirrorTable
+    Returns:
+        dict: Mirrored {control: matrix}
+    """
+    poseData = schema.upgradePoseData(poseData)
+    controls = [control for control, matrix in poseData.items() if matrix]
+    table = getMirrorTable(controls, axis, convention)
+    matrices = table.mirrorMatrices([poseData[control] for control in controls])
+    return dict(zip(table.targets, matrices.reshape(len(controls), 16).tolist()))
+
+
+def getMirroredPosePath(filepath, outputDirectory=None):
+    """Path of the mirrored copy of a pose file: left01.pose -> right01.pose, or a suffix for centre names"""
+    directory, filename = os.path.split(filepath)
+    poseName, extension = os.path.splitext(filename)
+    mirroredName = getMirroredName(poseName)
+    if mirroredName == poseName:
+        mirroredName = poseName + config.MIRROR_POSE_SUFFIX
+    return os.path.join(outputDirectory or directory, mirroredName + extension)
+
+
+def mirrorPoseFile(filepath, outputDirectory=None, axis=None, convention=None, overwrite=False):
+    """
+    Write the mirrored copy of one pose file, in the same format
+    Returns:
+        dict: Report with the file, the mirrored file, status, control count and the time spent
+    """
+    start = time.time()
+    outputPath = getMirroredPosePath(filepath, outputDirectory)
+    report = {"file": filepath, "output": outputPath, "status": "", "controls": 0, "seconds": 0.0}
+    try:
+        if os.path.exists(outputPath) and not overwrite:
+            report["status"] = "skipped (exists)"
+        else:
+            with open(filepath, "rb") as fp:
+                data = fp.read()
+            poseData = poseio.loadPoseBytes(data, os.path.dirname(os.path.abspath(filepath)))
+            oldMeta = poseio.loadPoseMetadata(data, created=os.path.getctime(filepath))
+            mirroredPoseData = mirrorPoseData(poseData, axis, convention)
+            poseName = os.path.splitext(os.path.basename(outputPath))[0]
+            meta = poseio.buildPoseMetadata(mirroredPoseData, poseName=poseName, namespace=oldMeta["namespace"])
+            if outputDirectory and not os.path.isdir(outputDirectory):
+                os.makedirs(outputDirectory)
+            poseio.writePoseFile(outputPath, mirroredPoseData, meta)
+            report["controls"] = len(mirroredPoseData)
+            report["status"] = "mirrored"
+    except Exception as e:
+        report["status"] = "failed: {}".format(e)
+    report["seconds"] = time.time() - start
+    return report
+
+
+def mirrorDirectory(charDirectory, outputDirectory=None, processes=None, axis=None, convention=None,
+                    overwrite=False, verbose=True):
+    """
+    Mirror every pose of a character directory in parallel worker processes. Suffixed mirrored copies
+    are skipped and existing poses are kept unless overwrite, so running it twice does not mirror back
+    Args:
+        charDirectory (str): Character directory
+        outputDirectory (str): Directory of the mirrored poses, the character directory by default
+        processes (int): Number of worker processes, defaults to the number of CPUs
+        axis (str): Mirror axis, see getMirrorTable
+        convention (str): Mirror convention, see getMirrorTable
+        overwrite (bool): Replace mirrored poses that already exist
+        verbose (bool): If True, print the per file report
+    Returns:
+        list: One report per pose file, see mirrorPoseFile
+    """
+    poseFiles = []
+    for poseFile in sorted(utils.getValidPoseFiles(os.listdir(charDirectory))):
+        filepath = os.path.join(charDirectory, poseFile)
+        if os.path.splitext(poseFile)[0].endswith(config.MIRROR_POSE_SUFFIX):
+            continue
+        poseFiles.append(filepath)
+    start = time.time()
+    count = len(poseFiles)
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        reports = list(executor.map(mirrorPoseFile, poseFiles, [outputDirectory] * count, [axis] * count,
+                                    [convention] * count, [overwrite] * count, chunksize=8))
+    elapsed = time.time() - start
+
+    if verbose:
+        for report in reports:
+            print("{seconds:8.4f}s  {controls:6d}  {status:<24}  {output}".format(**report))
+        mirrored = sum(1 for report in reports if report["status"] == "mirrored")
+        failed = sum(1 for report in reports if report["status"].startswith("failed"))
+        print("{} of {} poses mirrored, {} failed, in {:.2f} seconds".format(mirrored, len(reports), failed, elapsed))
+    return reports
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mirror every pose of a character directory")
+    parser.add_argument("directory", help="character directory")
+    parser.add_argument("--output", default=None, help="directory of the mirrored poses, the character directory by default")
+    parser.add_argument("--processes", type=int, default=None, help="number of worker processes")
+    parser.add_argument("--axis", choices=sorted(AXES), default=None, help="mirror axis")
+    parser.add_argument("--convention", choices=[ORIENTATION_CONVENTION, BEHAVIOR_CONVENTION], default=None,
+                        help="mirror convention of the rig")
+    parser.add_argument("--overwrite", action="store_true", help="replace mirrored poses that already exist")
+    arguments = parser.parse_args()
+    mirrorDirectory(arguments.directory, arguments.output, arguments.processes, arguments.axis,
+                    arguments.convention, arguments.overwrite)
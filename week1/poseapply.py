@@ -0,0 +1,111 @@
+import os
+
+import maya.cmds as mc
+import maya.api.OpenMaya as om
+
+from . import handlecache
+
+# OpenMaya apply engine of lib.applyPose.
+# Scene controls are resolved once into handlecache.ControlHandle objects: the DAG path, the channel
+# plugs that can be set and the rotate axis and joint orient to take out of the pose rotation. A pose is
+# decomposed into channel values in the rotate order of every control and written through one MDGModifier, run by the
+# poseLibraryApply command of poseapplycmd.py so the whole pose is a single undoable operation.
+# Controls with pivots keep the mc.xform path, their translate is not the translation of the matrix
+APPLY_COMMAND = "poseLibraryApply"
+PLUGIN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "poseapplycmd.py")
+ROOT_AND_MAIN_CONTROLS = ("RootControl1", "MainControl1")
+
+# modifiers waiting for the poseLibraryApply command, see executeModifier
+pendingModifiers = []
+
+
+def isRootOrMainControl(control):
+    return any(name in control for name in ROOT_AND_MAIN_CONTROLS)
+
+
+class PoseApplyEngine(object):
+    """Bulk apply of poses on the controls of a handle cache, the session cache by default"""
+    def __init__(self, handleCache=None):
+        self.handleCache = handleCache
+
+    def resolve(self, poseItems, namespace=None, selectedControls=None, excludeRootAndMainControls=False):
+        """
+        Match the controls of a pose with the scene in one pass
+        Args:
+            poseItems (iterable): (control, matrix) pairs, see lib.iterPoseItems
+            namespace (str): Namespace of the character
+            selectedControls (list): Scene controls to pose, all controls when None
+            excludeRootAndMainControls (bool): Leave the root and main controls alone
+        Returns:
+            list: (scene control, ControlHandle, matrix) of the controls to pose
+        """
+        selected = None
+        if selectedControls is not None:
+            selected = set(handlecache.splitControlName(control) for control in selectedControls)
+        handleCache = self.handleCache if self.handleCache is not None else handlecache.getHandleCache()
+        targets = []
+        for control, matrix in poseItems:
+            if not matrix:
+                continue
+            key = handlecache.splitControlName(control)
+            if namespace:
+                key = (namespace, key[1])
+            if selected is not None and key not in selected:
+                continue
+            if excludeRootAndMainControls and isRootOrMainControl(key[1]):
+                continue
+            handle = handleCache.getHandle(key[1], key[0])
+            if handle is not None:
+                targets.append((handle.name, handle, matrix))
+        return targets
+
+    def apply(self, poseItems, namespace=None, selectedControls=None, excludeRootAndMainControls=False):
+        """
+        Pose the scene controls, every channel is set through one modifier, a single undoable operation
+        Args:
+            poseItems (iterable): (control, matrix) pairs, see resolve for the other arguments
+        Returns:
+            list: Scene controls that were posed
+        """
+        targets = self.resolve(poseItems, namespace, selectedControls, excludeRootAndMainControls)
+        modifier = om.MDGModifier()
+        pivoted = []
+        for control, handle, matrix in targets:
+            # a channel may have been locked or constrained, or a pivot or orientation changed, since it was cached
+            handle.refreshState()
+            if handle.pivoted:
+                pivoted.append((control, matrix))
+                continue
+            values = handle.getChannelValues(matrix)
+            for index, plug in handle.channels:
+                modifier.newPlugValueDouble(plug, values[index])
+        executeModifier(modifier)
+        for control, matrix in pivoted:
+            mc.xform(control, matrix=matrix, objectSpace=True)
+        return [control for control, _, _ in targets]
+
+
+def loadApplyCommand():
+    if not mc.pluginInfo(PLUGIN_PATH, query=True, loaded=True):
+        mc.loadPlugin(PLUGIN_PATH, quiet=True)
+
+
+def executeModifier(modifier):
+    """Run a modifier through the poseLibraryApply command, so it is undone and redone with the Maya undo queue"""
+    loadApplyCommand()
+    pendingModifiers.append(modifier)
+    try:
+        getattr(mc, APPLY_COMMAND)()
+    finally:
+        del pendingModifiers[:]
+
+
+_applyEngine = None
+
+
+def getApplyEngine():
+    """Apply engine shared by lib.applyPose and the UI"""
+    global _applyEngine
+    if _applyEngine is None:
+        _applyEngine = PoseApplyEngine()
+    return _applyEngine
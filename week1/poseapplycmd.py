@@ -0,0 +1,45 @@
+import maya.api.OpenMaya as om
+
+# Maya plugin of the poseLibraryApply command, loaded by poseapply.loadApplyCommand.
+# The command runs the MDGModifier prepared by poseapply.PoseApplyEngine, so a whole pose is one entry of
+# the undo queue, a modifier executed from a script is not undoable on its own. Maya loads plugins from
+# their path outside of the package, the modifier is handed over through poseapply.pendingModifiers
+COMMAND_NAME = "poseLibraryApply"
+
+
+def maya_useNewAPI():
+    pass
+
+
+class PoseApplyCommand(om.MPxCommand):
+    def __init__(self):
+        super(PoseApplyCommand, self).__init__()
+        self.modifier = None
+
+    @staticmethod
+    def creator():
+        return PoseApplyCommand()
+
+    def doIt(self, args):
+        from pose_library.week1 import poseapply
+        if not poseapply.pendingModifiers:
+            raise RuntimeError("{} is run by poseapply, there is no pose to apply".format(COMMAND_NAME))
+        self.modifier = poseapply.pendingModifiers.pop()
+        self.redoIt()
+
+    def redoIt(self):
+        self.modifier.doIt()
+
+    def undoIt(self):
+        self.modifier.undoIt()
+
+    def isUndoable(self):
+        return True
+
+
+def initializePlugin(plugin):
+    om.MFnPlugin(plugin).registerCommand(COMMAND_NAME, PoseApplyCommand.creator)
+
+
+def uninitializePlugin(plugin):
+    om.MFnPlugin(plugin).deregisterCommand(COMMAND_NAME)
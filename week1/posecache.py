@@ -0,0 +1,158 @@
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+from . import config
+
+FLOAT_SIZE = sys.getsizeof(0.0)
+
+
+def estimateItemSize(control, value):
+    """Approximate memory held by one control of parsed pose data in bytes"""
+    size = sys.getsizeof(control) + sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(sys.getsizeof(attribute) + FLOAT_SIZE for attribute in value)
+    else:
+        size += FLOAT_SIZE * len(value)
+    return size
+
+
+def estimatePoseSize(poseData):
+    """Approximate memory held by parsed pose data in bytes, the python objects not the file size"""
+    return sys.getsizeof(poseData) + sum(estimateItemSize(control, value) for control, value in poseData.items())
+
+
+class PoseCache(object):
+    """
+    Bounded LRU cache of parsed pose data.
+
+    Entries are keyed by (path, member, mtime, size): a pose saved again, renamed over or edited gets a new
+    key, so a cached pose is never stale and no explicit invalidation is needed. Only the latest version
+    of a path is kept. The least recently used poses are evicted once the estimated memory of the cached
+    poses exceeds the budget. Cached dictionaries are shared, callers get a shallow copy and must not
+    edit the matrices in place.
+    """
+    def __init__(self, budget=None):
+        self.budget = config.POSE_CACHE_BUDGET if budget is None else budget
+        self.lock = threading.Lock()
+        # key -> (poseData, estimated size), least recently used first
+        self.entries = OrderedDict()
+        # (path, member) -> current key
+        self.keys = {}
+        self.memory = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def getKey(self, filepath, member=None):
+        stat = os.stat(filepath)
+        return os.path.normcase(os.path.abspath(filepath)), member, stat.st_mtime, stat.st_size
+
+    def lookup(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def get(self, filepath, loader, member=None):
+        """
+        Parsed pose data of a file, loaded with loader() on a miss
+        Args:
+            filepath (str): Path of the pose file, its mtime and size validate the cached pose
+            loader (callable): Returns the pose data when it is not cached
+            member (str): Pose name inside the file, for pose packs
+        Returns:
+            dict: Pose data
+        """
+        key = self.getKey(filepath, member)
+        poseData = self.lookup(key)
+        if poseData is None:
+            poseData = loader()
+            self.put(key, poseData)
+        return dict(poseData)
+
+    def stream(self, filepath, streamer, member=None):
+        """
+        (control, matrix) pairs of a file, from the cache or from the stream streamer() returns.
+        A stream that is read to the end is cached
+        """
+        key = self.getKey(filepath, member)
+        poseData = self.lookup(key)
+        if poseData is not None:
+            return iter(list(poseData.items()))
+        return self.storeStream(key, streamer())
+
+    def storeStream(self, key, items):
+        # buffer the pose only while it fits in the budget, a larger pose is streamed without a copy
+        poseData = {}
+        size = sys.getsizeof(poseData)
+        for control, matrix in items:
+            if poseData is not None:
+                size += estimateItemSize(control, matrix)
+                if size > self.budget:
+                    poseData = None
+                else:
+                    poseData[control] = matrix
+            yield control, matrix
+        if poseData is not None:
+            self.put(key, poseData)
+
+    def put(self, key, poseData):
+        size = estimatePoseSize(poseData)
+        with self.lock:
+            if size > self.budget:
+                return
+            previousKey = self.keys.get(key[:2])
+            if previousKey is not None:
+                self.discard(previousKey)
+            self.entries[key] = (poseData, size)
+            self.keys[key[:2]] = key
+            self.memory += size
+            while self.memory > self.budget:
+                oldestKey = next(iter(self.entries))
+                self.discard(oldestKey)
+                self.evictions += 1
+
+    def discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.memory -= entry[1]
+            if self.keys.get(key[:2]) == key:
+                del self.keys[key[:2]]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.keys.clear()
+            self.memory = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "memory": self.memory,
+                "budget": self.budget,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hitRate": float(self.hits) / lookups if lookups else 0.0
+            }
+
+
+_poseCache = None
+_poseCacheLock = threading.Lock()
+
+
+def getPoseCache():
+    """Process wide pose cache shared by lib.readPoseData and the UI"""
+    global _poseCache
+    with _poseCacheLock:
+        if _poseCache is None:
+            _poseCache = PoseCache()
+        return _poseCache
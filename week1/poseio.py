@@ -0,0 +1,570 @@
+import hashlib
+import io
+import json
+import os
+import struct
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from . import config
+from . import deltapose
+from . import posestore
+from . import schema
+from . import utils
+
+# Binary pose layout (little endian):
+#   header   : magic, version, flags, control count, names size, meta size, data offset
+#   meta     : compact json metadata block, see buildPoseMetadata (metaSize bytes)
+#   names    : utf-8 control names separated by NUL bytes (namesSize bytes)
+#   padding  : zero bytes up to the 8 byte aligned data offset
+#   data     : float64 array of shape (controlCount, 16), one object space matrix per control
+BINARY_MAGIC = b"PLBP"
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct("<4sHHIIIQ4x")
+MATRIX_SIZE = 16
+# json poses carry their metadata as the first key of the file
+JSON_META_KEY = "__meta__"
+JSON_META_PEEK_SIZE = 4096
+# streaming readers decode json poses by chunks and binary poses by blocks of rows
+STREAM_CHUNK_SIZE = 64 * 1024
+STREAM_BLOCK_ROWS = 1024
+
+
+def isBinaryPoseFile(filepath):
+    """Check the file header to find out if a pose file is stored in the binary format
+
+    Args:
+        filepath (str): Path of the pose file
+    Returns:
+        bool: True if the file starts with the binary pose magic
+    """
+    with open(filepath, "rb") as fp:
+        return fp.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+
+
+def readBinaryHeader(fp):
+    """Read and validate the header of an opened binary pose file
+
+    Args:
+        fp (file): File object opened in binary mode, positioned at the start of the file
+    Returns:
+        dict: Header fields
+    """
+    raw = fp.read(BINARY_HEADER.size)
+    if len(raw) != BINARY_HEADER.size:
+        raise ValueError("Truncated binary pose header")
+    magic, version, flags, count, namesSize, metaSize, dataOffset = BINARY_HEADER.unpack(raw)
+    if magic != BINARY_MAGIC:
+        raise ValueError("Not a binary pose file")
+    if version > BINARY_VERSION:
+        raise ValueError("Unsupported binary pose version: {}".format(version))
+    return {
+        "version": version,
+        "flags": flags,
+        "count": count,
+        "namesSize": namesSize,
+        "metaSize": metaSize,
+        "dataOffset": dataOffset
+    }
+
+
+def readBinaryNames(fp, header):
+    """Read the control name table that follows the header
+
+    Args:
+        fp (file): File object positioned right after the header
+        header (dict): Header returned by readBinaryHeader
+    Returns:
+        list: Control names, in the same order as the matrix rows
+    """
+    fp.seek(BINARY_HEADER.size + header["metaSize"])
+    return decodeBinaryNames(fp.read(header["namesSize"]), header)
+
+
+def decodeBinaryNames(namesBlock, header):
+    if not header["count"]:
+        return []
+    return namesBlock.decode("utf-8").split("\0")
+
+
+def readPoseArrays(filepath, mmap=False):
+    """Read a binary pose file into a control list and a matrix array without any parsing
+
+    Args:
+        filepath (str): Path of the binary pose file
+        mmap (bool): If True, return a read only memory mapped view of the matrices instead of
+            loading them. Keep in mind the file stays open while the view is alive.
+    Returns:
+        tuple: (list of control names, float64 array of shape (N, 16))
+    """
+    with open(filepath, "rb") as fp:
+        header = readBinaryHeader(fp)
+        controls = readBinaryNames(fp, header)
+        count = header["count"]
+        if not count:
+            return controls, np.zeros((0, MATRIX_SIZE), dtype="<f8")
+        if mmap:
+            matrices = np.memmap(fp, dtype="<f8", mode="r", offset=header["dataOffset"],
+                                 shape=(count, MATRIX_SIZE))
+        else:
+            fp.seek(header["dataOffset"])
+            matrices = np.fromfile(fp, dtype="<f8", count=count * MATRIX_SIZE)
+            if len(matrices) != count * MATRIX_SIZE:
+                raise ValueError("Truncated binary pose data: {}".format(filepath))
+            matrices = matrices.reshape(count, MATRIX_SIZE)
+    return controls, matrices
+
+
+def decodePoseArrays(data):
+    """Same as readPoseArrays, but for a binary pose already loaded in memory
+
+    Args:
+        data (bytes): Encoded binary pose
+    Returns:
+        tuple: (list of control names, float64 array of shape (N, 16))
+    """
+    buffer = io.BytesIO(data)
+    header = readBinaryHeader(buffer)
+    controls = readBinaryNames(buffer, header)
+    count = header["count"]
+    if len(data) < header["dataOffset"] + count * MATRIX_SIZE * 8:
+        raise ValueError("Truncated binary pose data")
+    matrices = np.frombuffer(data, dtype="<f8", count=count * MATRIX_SIZE, offset=header["dataOffset"])
+    return controls, matrices.reshape(count, MATRIX_SIZE)
+
+
+def readBinaryPoseData(filepath):
+    """Read a binary pose file into the {control: matrix} dictionary used by the library
+
+    Args:
+        filepath (str): Path of the binary pose file
+    Returns:
+        dict: Pose data, matrices as lists of 16 floats
+    """
+    controls, matrices = readPoseArrays(filepath)
+    return dict(zip(controls, matrices.tolist()))
+
+
+def encodeBinaryPose(poseData, meta=None):
+    """Serialise matrix pose data into the binary pose layout
+
+    Args:
+        poseData (dict): {control: matrix} where matrix is a sequence of 16 floats
+        meta (dict): Metadata stored in the header, built from the pose data if not given
+    Returns:
+        bytes: The encoded binary pose
+    """
+    controls = sorted(poseData.keys())
+    for control in controls:
+        if "\0" in control:
+            raise ValueError("Invalid control name: {!r}".format(control))
+        if isinstance(poseData[control], dict) or len(poseData[control]) != MATRIX_SIZE:
+            raise ValueError("Binary poses only store 16 value matrices, got invalid data for control: {}".format(control))
+
+    namesBlock = "\0".join(controls).encode("utf-8")
+    metaBlock = json.dumps(meta or buildPoseMetadata(poseData), separators=(",", ":"), sort_keys=True).encode("utf-8")
+    dataOffset = BINARY_HEADER.size + len(metaBlock) + len(namesBlock)
+    padding = (-dataOffset) % 8
+    dataOffset += padding
+
+    matrices = np.asarray([poseData[control] for control in controls], dtype="<f8").reshape(len(controls), MATRIX_SIZE)
+    header = BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, 0, len(controls), len(namesBlock),
+                                len(metaBlock), dataOffset)
+    buffer = io.BytesIO()
+    buffer.write(header)
+    buffer.write(metaBlock)
+    buffer.write(namesBlock)
+    buffer.write(b"\0" * padding)
+    buffer.write(matrices.tobytes())
+    return buffer.getvalue()
+
+
+def writeBinaryPoseData(filepath, poseData, meta=None):
+    """Write matrix pose data to a binary pose file
+
+    Args:
+        filepath (str): Path to save the pose file
+        poseData (dict): {control: matrix} pose data
+        meta (dict): Metadata stored in the header
+    """
+    utils.atomicWriteFile(filepath, encodeBinaryPose(poseData, meta))
+
+
+def readJsonPoseData(filepath):
+    with open(filepath) as fp:
+        poseData = json.load(fp)
+    poseData.pop(JSON_META_KEY, None)
+    return poseData
+
+
+def encodeJsonPose(poseData, meta=None):
+    # metadata goes first so readPoseMetadata only has to decode the top of the file
+    orderedPoseData = OrderedDict([(JSON_META_KEY, meta or buildPoseMetadata(poseData))])
+    for control in sorted(poseData.keys()):
+        orderedPoseData[control] = poseData[control]
+    return json.dumps(orderedPoseData, ensure_ascii=False, indent=4).encode("utf-8")
+
+
+def writeJsonPoseData(filepath, poseData, meta=None):
+    utils.atomicWriteFile(filepath, encodeJsonPose(poseData, meta))
+
+
+def isBinaryPosePath(filepath):
+    """Decide the on disk format of a pose file from its extension, used when writing"""
+    return os.path.splitext(filepath)[-1].lower() == config.BINARY_POSE_EXTENSION
+
+
+def readPoseFile(filepath):
+    """Read any supported pose file. The format is detected from the file header, not the extension
+
+    Args:
+        filepath (str): Path of the pose file
+    Returns:
+        dict: Pose data
+    """
+    with open(filepath, "rb") as fp:
+        magic = fp.read(len(BINARY_MAGIC))
+        if magic == deltapose.DELTA_MAGIC:
+            # delta poses are rebuilt from the rest pose stored next to them
+            return deltapose.loadDeltaPose(magic + fp.read(), os.path.dirname(os.path.abspath(filepath)))
+        if magic == posestore.REF_MAGIC:
+            return readPoseFile(posestore.resolvePoseRef(posestore.decodePoseRef(magic + fp.read())))
+    if magic == BINARY_MAGIC:
+        return readBinaryPoseData(filepath)
+    return readJsonPoseData(filepath)
+
+
+def iterPoseFile(filepath, chunkSize=STREAM_CHUNK_SIZE):
+    """
+    Stream the (control, matrix) pairs of a pose file as they are decoded, memory stays bounded by the
+    chunk size whatever the size of the pose. The format is detected from the file header
+
+    Args:
+        filepath (str): Path of the pose file
+        chunkSize (int): Number of bytes decoded at once for json poses
+    Yields:
+        tuple: (control, matrix)
+    """
+    with open(filepath, "rb") as fp:
+        magic = fp.read(len(BINARY_MAGIC))
+    if magic == posestore.REF_MAGIC:
+        for item in iterPoseFile(posestore.resolvePoseRef(posestore.readPoseRef(filepath)), chunkSize):
+            yield item
+    elif magic == BINARY_MAGIC:
+        for item in iterBinaryPoseFile(filepath):
+            yield item
+    elif magic == deltapose.DELTA_MAGIC:
+        # delta poses only store the changed controls, they are small enough to decode at once
+        for item in readPoseFile(filepath).items():
+            yield item
+    else:
+        for item in iterJsonPoseFile(filepath, chunkSize):
+            yield item
+
+
+def iterBinaryPoseFile(filepath):
+    controls, matrices = readPoseArrays(filepath, mmap=True)
+    try:
+        for start in range(0, len(controls), STREAM_BLOCK_ROWS):
+            block = matrices[start:start + STREAM_BLOCK_ROWS].tolist()
+            for control, matrix in zip(controls[start:start + STREAM_BLOCK_ROWS], block):
+                yield control, matrix
+    finally:
+        # release the mapping as soon as the stream is done
+        del matrices
+
+
+def iterJsonPoseFile(filepath, chunkSize=STREAM_CHUNK_SIZE):
+    """Incrementally decode the top level object of a json pose, one key / value pair at a time"""
+    decoder = json.JSONDecoder()
+    with io.open(filepath, "r", encoding="utf-8") as fp:
+        buffer = ""
+        position = 0
+        eof = False
+
+        def fill(buffer, position):
+            chunk = fp.read(chunkSize)
+            return buffer[position:] + chunk, 0, not chunk
+
+        def skip(buffer, position, eof, characters):
+            # skip the given characters, reading more data when the buffer runs out
+            while True:
+                while position < len(buffer) and buffer[position] in characters:
+                    position += 1
+                if position < len(buffer) or eof:
+                    return buffer, position, eof
+                buffer, position, eof = fill(buffer, position)
+
+        def decode(buffer, position, eof):
+            # decode one json value, a value running until the end of the buffer may be cut, read more first
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buffer, position)
+                    if end < len(buffer) or eof:
+                        return value, buffer, end, eof
+                except ValueError:
+                    if eof:
+                        raise ValueError("Truncated json pose file: {}".format(filepath))
+                buffer, position, eof = fill(buffer, position)
+
+        buffer, position, eof = skip(buffer, position, eof, " \t\r\n")
+        if position >= len(buffer) or buffer[position] != "{":
+            raise ValueError("Not a json pose file: {}".format(filepath))
+        position += 1
+        while True:
+            buffer, position, eof = skip(buffer, position, eof, " \t\r\n,")
+            if position >= len(buffer):
+                raise ValueError("Truncated json pose file: {}".format(filepath))
+            if buffer[position] == "}":
+                return
+            control, buffer, position, eof = decode(buffer, position, eof)
+            buffer, position, eof = skip(buffer, position, eof, " \t\r\n:")
+            matrix, buffer, position, eof = decode(buffer, position, eof)
+            if control != JSON_META_KEY:
+                yield control, matrix
+
+
+def loadPoseBytes(data, charDirectory=None):
+    """Decode the content of a pose file, in any format, that is already loaded in memory
+
+    Args:
+        data (bytes): Raw content of a pose file
+        charDirectory (str): Character directory holding the rest pose, only needed for delta poses
+    Returns:
+        dict: Pose data
+    """
+    if deltapose.isDeltaPoseData(data):
+        if not charDirectory:
+            raise ValueError("Delta poses need the character directory of their rest pose")
+        return deltapose.loadDeltaPose(data, charDirectory)
+    if posestore.isPoseRefData(data):
+        return readPoseFile(posestore.resolvePoseRef(posestore.decodePoseRef(data)))
+    if data.startswith(BINARY_MAGIC):
+        controls, matrices = decodePoseArrays(data)
+        return dict(zip(controls, matrices.tolist()))
+    poseData = json.loads(data.decode("utf-8"))
+    poseData.pop(JSON_META_KEY, None)
+    return poseData
+
+
+def encodePoseFile(filepath, poseData, meta=None):
+    """Encode a pose into the bytes writePoseFile would write at this path
+
+    Args:
+        filepath (str): Path of the pose file, its extension selects the format
+        poseData (dict): Pose data to save
+        meta (dict): Metadata header, see buildPoseMetadata. Built from the pose data if not given
+    Returns:
+        bytes: The encoded pose file
+    """
+    if meta is None:
+        poseName = os.path.splitext(os.path.basename(filepath))[0]
+        meta = buildPoseMetadata(poseData, poseName=poseName)
+    if isBinaryPosePath(filepath):
+        return encodeBinaryPose(poseData, meta)
+    extension = os.path.splitext(filepath)[-1].lower()
+    if extension == config.DELTA_POSE_EXTENSION:
+        return deltapose.encodeDeltaPoseFile(os.path.dirname(os.path.abspath(filepath)), poseData, meta)
+    if extension == config.POSE_REF_EXTENSION:
+        return posestore.encodeStoredPose(poseData, meta)
+    return encodeJsonPose(poseData, meta)
+
+
+def writePoseFile(filepath, poseData, meta=None):
+    """Write a pose file, using the binary layout for binary pose extensions, a delta against the rest pose
+    for delta pose extensions and json otherwise.
+    The file is replaced atomically, a crash never leaves a truncated pose behind
+
+    Args:
+        filepath (str): Path to save the pose file
+        poseData (dict): Pose data to save
+        meta (dict): Metadata header, see buildPoseMetadata. Built from the pose data if not given
+    """
+    utils.atomicWriteFile(filepath, encodePoseFile(filepath, poseData, meta))
+
+
+def validatePoseData(poseData):
+    """Raise a ValueError if the pose data can not be saved"""
+    if not isinstance(poseData, dict):
+        raise ValueError("Pose data must be a dictionary")
+    for ctrl, data in poseData.items():
+        if not isinstance(data, (dict, list, tuple)):
+            raise ValueError("Control data must be a dictionary or a matrix for control: {}".format(ctrl))
+
+
+def poseHash(poseData):
+    """
+    Content hash of a pose, independent of the file format and of the key order
+    Args:
+        poseData (dict): Pose data
+    Returns:
+        str: sha1 hex digest
+    """
+    digest = hashlib.sha1()
+    for control in sorted(poseData.keys()):
+        value = poseData[control]
+        digest.update(control.encode("utf-8") + b"\0")
+        if isinstance(value, dict):
+            digest.update(json.dumps(value, sort_keys=True).encode("utf-8"))
+        else:
+            digest.update(np.asarray(value, dtype="<f8").tobytes())
+    return digest.hexdigest()
+
+
+def buildPoseMetadata(poseData, poseName=None, namespace=None, created=None):
+    """
+    Build the small metadata header stored in every pose, it holds everything the pose browser
+    shows so it never has to decode the matrices
+    Args:
+        poseData (dict): Pose data
+        poseName (str): Name of the pose, used to find the pose type
+        namespace (str): Namespace of the character the pose was saved from
+        created (float): Creation time stamp, defaults to now
+    Returns:
+        dict: Metadata
+    """
+    if namespace is None:
+        # legacy poses kept the namespace in the control names
+        namespaces = {control.split(":")[0] for control in poseData.keys() if ":" in control}
+        namespace = namespaces.pop() if len(namespaces) == 1 else ""
+    return {
+        "schema": schema.getPoseSchema(poseData),
+        "controlCount": len(poseData),
+        "namespace": namespace,
+        "poseType": utils.getPoseType(poseName) if poseName else "",
+        "created": time.time() if created is None else created,
+        "hash": poseHash(poseData)
+    }
+
+
+def readPoseMetadata(filepath):
+    """
+    Read the metadata header of a pose file without decoding the pose data
+    Args:
+        filepath (str): Path of the pose file
+    Returns:
+        dict: Metadata, or None for legacy files saved without a header
+    """
+    with open(filepath, "rb") as fp:
+        head = fp.read(JSON_META_PEEK_SIZE)
+        if posestore.isPoseRefData(head):
+            fp.seek(0)
+            ref = posestore.decodePoseRef(fp.read())
+            # poses sharing a payload keep their own metadata in the reference
+            return ref.get("meta") or readPoseMetadata(posestore.resolvePoseRef(ref))
+        if deltapose.isDeltaPoseData(head):
+            fp.seek(0)
+            header = deltapose.readDeltaHeader(fp.read(deltapose.DELTA_HEADER.size))
+            return json.loads(fp.read(header["metaSize"]).decode("utf-8")) if header["metaSize"] else None
+        if head.startswith(BINARY_MAGIC):
+            fp.seek(0)
+            header = readBinaryHeader(fp)
+            if not header["metaSize"]:
+                return None
+            return json.loads(fp.read(header["metaSize"]).decode("utf-8"))
+    return decodeJsonMetadata(head)
+
+
+def decodeJsonMetadata(head):
+    """Decode the metadata from the first bytes of a json pose, returns None if it has no header"""
+    text = head.decode("utf-8", "ignore").lstrip()
+    if not text.startswith("{"):
+        return None
+    text = text[1:].lstrip()
+    keyPrefix = '"{}"'.format(JSON_META_KEY)
+    if not text.startswith(keyPrefix):
+        return None
+    text = text[len(keyPrefix):].lstrip()
+    if not text.startswith(":"):
+        return None
+    try:
+        meta, _ = json.JSONDecoder().raw_decode(text[1:].lstrip())
+    except ValueError:
+        return None
+    return meta
+
+
+def loadPoseMetadata(data, poseName=None, created=None):
+    """Metadata of a pose file already loaded in memory, generated from the pose data for legacy files"""
+    if deltapose.isDeltaPoseData(data):
+        return deltapose.decodeDeltaMetadata(data)
+    if posestore.isPoseRefData(data):
+        ref = posestore.decodePoseRef(data)
+        if ref.get("meta"):
+            return ref["meta"]
+        objectPath = posestore.resolvePoseRef(ref)
+        meta = readPoseMetadata(objectPath)
+        if meta:
+            return meta
+        return buildPoseMetadata(readPoseFile(objectPath), poseName=poseName, created=created)
+    if data.startswith(BINARY_MAGIC):
+        header = readBinaryHeader(io.BytesIO(data))
+        if header["metaSize"]:
+            start = BINARY_HEADER.size
+            return json.loads(data[start:start + header["metaSize"]].decode("utf-8"))
+    else:
+        meta = decodeJsonMetadata(data[:JSON_META_PEEK_SIZE])
+        if meta:
+            return meta
+    return buildPoseMetadata(loadPoseBytes(data), poseName=poseName, created=created)
+
+
+def getDirectoryMetadata(charDirectory, poseFiles, stats=None, existingFiles=None, mapper=None):
+    """
+    Metadata of every pose of a character directory. Headers of legacy poses are generated the first
+    time they are read and kept in a sidecar file, invalidated by the pose file mtime and size
+    Args:
+        charDirectory (str): Character directory
+        poseFiles (list): Pose file names to read
+        stats (dict): Optional {pose file name: (ctime, mtime, size)} from a previous scan, saves the stat calls
+        existingFiles (list): Every pose file of the directory, sidecar entries of other files are
+            forgotten. Defaults to poseFiles
+        mapper (callable): map like function used for the header reads, e.g. scanner.ParallelScanner.map
+    Returns:
+        dict: {pose file name: metadata}
+    """
+    sidecarPath = os.path.join(charDirectory, config.POSE_METADATA_FILE)
+    try:
+        with open(sidecarPath) as fp:
+            sidecar = json.load(fp)
+    except (IOError, ValueError):
+        sidecar = {}
+
+    metadata = {}
+    sidecarChanged = False
+    poseFiles = sorted(set(poseFiles))
+    headers = (mapper or map)(readPoseMetadata, [os.path.join(charDirectory, poseFile) for poseFile in poseFiles])
+    for poseFile, meta in zip(poseFiles, headers):
+        filepath = os.path.join(charDirectory, poseFile)
+        if meta is None:
+            if stats and poseFile in stats:
+                ctime, mtime, size = stats[poseFile]
+            else:
+                stat = os.stat(filepath)
+                ctime, mtime, size = stat.st_ctime, stat.st_mtime, stat.st_size
+            cached = sidecar.get(poseFile)
+            if cached and cached["mtime"] == mtime and cached["size"] == size:
+                meta = cached["meta"]
+            else:
+                poseName = os.path.splitext(poseFile)[0]
+                meta = buildPoseMetadata(readPoseFile(filepath), poseName=poseName, created=ctime)
+                sidecar[poseFile] = {"mtime": mtime, "size": size, "meta": meta}
+                sidecarChanged = True
+        metadata[poseFile] = meta
+
+    # forget the poses that were deleted or renamed
+    existingFiles = poseFiles if existingFiles is None else set(existingFiles)
+    for poseFile in list(sidecar.keys()):
+        if poseFile not in existingFiles:
+            del sidecar[poseFile]
+            sidecarChanged = True
+
+    if sidecarChanged:
+        try:
+            utils.atomicWriteFile(sidecarPath, json.dumps(sidecar, indent=4, sort_keys=True).encode("utf-8"))
+        except (IOError, OSError) as e:
+            # the sidecar is only a cache, read only libraries still work without it
+            print("Could not write pose metadata {}: {}".format(sidecarPath, e))
+    return metadata
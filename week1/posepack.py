@@ -0,0 +1,239 @@
+import json
+import math
+import os
+import struct
+from collections import Counter
+from datetime import datetime
+
+from . import config
+from . import posecache
+from . import poseio
+from . import scanner
+from . import utils
+
+# Pose pack layout (little endian):
+#   header : magic, version, entry count, index size
+#   index  : compact json list, one entry per pose with the offsets of its pose and thumbnail blobs
+#   blobs  : raw pose file contents and thumbnail images, addressed by absolute offsets
+PACK_MAGIC = b"PLPK"
+PACK_VERSION = 1
+PACK_HEADER = struct.Struct("<4sHxxIQ")
+
+
+def getPosePackPath(charDirectory):
+    return os.path.join(charDirectory, config.POSE_PACK_FILE)
+
+
+def findPosePack(charDirectory):
+    """Return the pose pack of a character directory, or None if the character is not packed"""
+    packPath = getPosePackPath(charDirectory)
+    if os.path.isfile(packPath):
+        return packPath
+    return None
+
+
+class PosePack(object):
+    """
+    Read only access to a pose pack file. The file is opened once and every pose or thumbnail
+    is loaded with a single seek, use it as a context manager to keep the handle open:
+
+        with PosePack(packPath) as pack:
+            for poseName in pack.poseNames():
+                poseData = pack.readPoseData(poseName)
+    """
+    def __init__(self, packPath):
+        self.packPath = packPath
+        self.fp = open(packPath, "rb")
+        try:
+            self.entries = self.readIndex()
+        except Exception:
+            self.fp.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.fp.close()
+
+    def readIndex(self):
+        raw = self.fp.read(PACK_HEADER.size)
+        if len(raw) != PACK_HEADER.size:
+            raise ValueError("Truncated pose pack header: {}".format(self.packPath))
+        magic, version, count, indexSize = PACK_HEADER.unpack(raw)
+        if magic != PACK_MAGIC:
+            raise ValueError("Not a pose pack: {}".format(self.packPath))
+        if version > PACK_VERSION:
+            raise ValueError("Unsupported pose pack version: {}".format(version))
+        indexBytes = self.fp.read(indexSize)
+        if len(indexBytes) != indexSize:
+            raise ValueError("Truncated pose pack index: {}".format(self.packPath))
+        index = json.loads(indexBytes.decode("utf-8"))
+        if len(index) != count:
+            raise ValueError("Corrupted pose pack index: {}".format(self.packPath))
+        return {entry["name"]: entry for entry in index}
+
+    def poseNames(self):
+        return list(self.entries.keys())
+
+    def readBlob(self, offset, size):
+        self.fp.seek(offset)
+        data = self.fp.read(size)
+        if len(data) != size:
+            raise ValueError("Truncated pose pack: {}".format(self.packPath))
+        return data
+
+    def readPoseBytes(self, poseName):
+        entry = self.entries[poseName]
+        return self.readBlob(entry["poseOffset"], entry["poseSize"])
+
+    def readPoseData(self, poseName):
+        return poseio.loadPoseBytes(self.readPoseBytes(poseName), os.path.dirname(os.path.abspath(self.packPath)))
+
+    def readThumbnail(self, poseName):
+        """Return the thumbnail image bytes of a pose, or an empty bytes object if it has none"""
+        entry = self.entries[poseName]
+        if not entry["imgSize"]:
+            return b""
+        return self.readBlob(entry["imgOffset"], entry["imgSize"])
+
+    def getPoseInformation(self, poseName):
+        """
+        same dictionary as utils.getPoseFileInformation, built from the index only
+        :param poseName: name of the packed pose
+        :return: Dictionary with pose information
+        """
+        entry = self.entries[poseName]
+        return {
+            'poseName': poseName,
+            'poseType': utils.getPoseType(poseName),
+            'fullPath': self.packPath,
+            'packFile': self.packPath,
+            'imgFile': "",
+            'cDate': datetime.fromtimestamp(entry["cTime"]).strftime('%m-%d-%Y %I:%M %p'),
+            'mDate': datetime.fromtimestamp(entry["mTime"]).strftime('%m-%d-%Y %I:%M %p'),
+            'cTime': entry["cTime"],
+            'mTime': entry["mTime"],
+            'size': str("{} KB".format(math.ceil(entry["poseSize"] / 1024))),
+            'objectCount': entry["meta"]["controlCount"],
+            'namespace': entry["meta"]["namespace"],
+            'hash': entry["meta"]["hash"]
+        }
+
+
+def readPackedPose(packPath, poseName):
+    def load():
+        with PosePack(packPath) as pack:
+            return pack.readPoseData(poseName)
+    # repacking changes the pack mtime, which invalidates every cached pose of the pack
+    return posecache.getPoseCache().get(packPath, load, member=poseName)
+
+
+def packDirectory(charDirectory, removeSources=False):
+    """
+    Pack every pose of a character directory and its thumbnail into a single pose pack
+    Args:
+        charDirectory (str): Character directory, e.g. PROJECT_ROOT/B/g
+        removeSources (bool): If True, delete the loose pose and thumbnail files once packed
+    Returns:
+        str: Path of the pose pack
+    """
+    records = scanner.scanPoseDirectory(charDirectory)
+    # the pack is keyed by pose name, poses sharing a name with another extension stay loose files
+    stemCounts = Counter(os.path.splitext(record["poseFile"])[0] for record in records)
+    duplicates = sorted(stem for stem, count in stemCounts.items() if count > 1)
+    for poseName in duplicates:
+        print("{} is saved with several extensions, skipped, its files are kept".format(poseName))
+    blobs = []
+    index = []
+    packedFiles = []
+    for record in records:
+        if stemCounts[os.path.splitext(record["poseFile"])[0]] > 1:
+            continue
+        posePath = record["fullPath"]
+        poseName, poseExtension = os.path.splitext(record["poseFile"])
+        with open(posePath, "rb") as fp:
+            poseBytes = fp.read()
+        imgPath = record["imgFile"]
+        imgBytes = b""
+        if imgPath:
+            with open(imgPath, "rb") as fp:
+                imgBytes = fp.read()
+            packedFiles.append(imgPath)
+        packedFiles.append(posePath)
+        index.append({
+            "name": poseName,
+            "ext": poseExtension,
+            "imgExt": os.path.splitext(imgPath)[-1] if imgPath else "",
+            "cTime": record["cTime"],
+            "mTime": record["mTime"],
+            "poseSize": len(poseBytes),
+            "imgSize": len(imgBytes),
+            "meta": poseio.loadPoseMetadata(poseBytes, poseName=poseName, created=record["cTime"]),
+        })
+        blobs.append((poseBytes, imgBytes))
+
+    # offsets depend on the index size and the index holds the offsets, so grow the offsets until
+    # the encoded index stops changing size
+    indexBytes = b""
+    while True:
+        offset = PACK_HEADER.size + len(indexBytes)
+        for entry, (poseBytes, imgBytes) in zip(index, blobs):
+            entry["poseOffset"] = offset
+            offset += len(poseBytes)
+            entry["imgOffset"] = offset
+            offset += len(imgBytes)
+        encoded = json.dumps(index, separators=(",", ":"), sort_keys=True).encode("utf-8")
+        if len(encoded) == len(indexBytes):
+            indexBytes = encoded
+            break
+        indexBytes = encoded
+
+    packPath = getPosePackPath(charDirectory)
+    chunks = [PACK_HEADER.pack(PACK_MAGIC, PACK_VERSION, len(index), len(indexBytes)), indexBytes]
+    for poseBytes, imgBytes in blobs:
+        chunks.append(poseBytes)
+        chunks.append(imgBytes)
+    utils.atomicWriteFile(packPath, b"".join(chunks))
+    print("Packed {} poses into {}, {} skipped".format(len(index), packPath, len(duplicates)))
+
+    if removeSources:
+        for filepath in packedFiles:
+            utils.deleteFile(filepath)
+    return packPath
+
+
+def unpackDirectory(packPath, outputDirectory=None, overwrite=False, removePack=False):
+    """
+    Extract every pose and thumbnail of a pose pack back into loose files
+    Args:
+        packPath (str): Path of the pose pack
+        outputDirectory (str): Where to write the files, defaults to the directory of the pack
+        overwrite (bool): If True, replace existing loose files with the packed version
+        removePack (bool): If True, delete the pose pack once extracted
+    Returns:
+        list: Paths of the files written
+    """
+    outputDirectory = outputDirectory or os.path.dirname(packPath)
+    writtenFiles = []
+    with PosePack(packPath) as pack:
+        for poseName, entry in pack.entries.items():
+            targets = [(entry["ext"], pack.readPoseBytes)]
+            if entry["imgSize"]:
+                targets.append((entry["imgExt"], pack.readThumbnail))
+            for extension, reader in targets:
+                filepath = os.path.join(outputDirectory, poseName + extension)
+                if os.path.exists(filepath) and not overwrite:
+                    print("{} already exists, skipped".format(filepath))
+                    continue
+                with open(filepath, "wb") as fp:
+                    fp.write(reader(poseName))
+                os.utime(filepath, (entry["mTime"], entry["mTime"]))
+                writtenFiles.append(filepath)
+    print("Unpacked {} files from {}".format(len(writtenFiles), packPath))
+    if removePack:
+        utils.deleteFile(packPath)
+    return writtenFiles
@@ -0,0 +1,287 @@
+import hashlib
+import json
+import os
+from collections import Counter
+
+import numpy as np
+
+from . import config
+from . import poseio
+from . import utils
+
+# Content addressed pose store. Pose payloads and thumbnails live once under
+# config.POSE_STORE_DIR/objects/<key[:2]>/<key><ext>, a named pose is a small reference file:
+#   magic followed by json {"pose": key, "poseExt": ext, "thumbnail": key, "thumbnailExt": ext, "meta": {...}}
+# The metadata of the named pose lives in the reference, poses sharing a payload keep their own name and
+# creation time. References to a store other than config.POSE_STORE_DIR also hold its root as "store".
+# Pose keys are content hashes of the matrices rounded to config.DEDUPE_TOLERANCE, so near identical
+# poses share one payload. Thumbnail keys are sha1 of the image bytes.
+# Delta poses depend on the rest pose of their character and are never moved into the store.
+REF_MAGIC = b"PLRF"
+
+
+def isPoseRefData(data):
+    return data.startswith(REF_MAGIC)
+
+
+def getObjectPath(key, extension, storeDirectory=None):
+    storeDirectory = storeDirectory or config.POSE_STORE_DIR
+    return os.path.join(storeDirectory, "objects", key[:2], key + extension)
+
+
+def isStoreObject(filepath, storeDirectory=None):
+    """True if the file belongs to the store and is shared, it must not be renamed or deleted by hand"""
+    storeDirectory = os.path.abspath(storeDirectory or config.POSE_STORE_DIR)
+    return os.path.abspath(filepath).startswith(storeDirectory + os.sep)
+
+
+def poseContentKey(poseData, tolerance=None):
+    """
+    Hash of a pose where matrices equal within the tolerance give the same key
+    Args:
+        poseData (dict): Pose data
+        tolerance (float): Rounding step of the matrix values, defaults to config.DEDUPE_TOLERANCE
+    Returns:
+        str: sha1 hex digest
+    """
+    tolerance = config.DEDUPE_TOLERANCE if tolerance is None else tolerance
+    digest = hashlib.sha1()
+    for control in sorted(poseData.keys()):
+        value = poseData[control]
+        digest.update(control.encode("utf-8") + b"\0")
+        if isinstance(value, dict):
+            digest.update(json.dumps(value, sort_keys=True).encode("utf-8"))
+        else:
+            # + 0.0 folds -0.0 into 0.0 once rounded
+            rounded = np.round(np.asarray(value, dtype=np.float64) / tolerance) + 0.0
+            digest.update(rounded.astype("<i8").tobytes())
+    return digest.hexdigest()
+
+
+def readPoseRef(filepath):
+    with open(filepath, "rb") as fp:
+        return decodePoseRef(fp.read())
+
+
+def decodePoseRef(data):
+    if not isPoseRefData(data):
+        raise ValueError("Not a pose reference")
+    return json.loads(data[len(REF_MAGIC):].decode("utf-8"))
+
+
+def encodePoseRef(poseKey, poseExtension, thumbnailKey="", thumbnailExtension="", meta=None, storeDirectory=None):
+    """
+    Encode a pose reference
+    Args:
+        meta (dict): Metadata of the named pose, see poseio.buildPoseMetadata
+        storeDirectory (str): Store root of the objects, only written when it is not config.POSE_STORE_DIR
+    Returns:
+        bytes: The encoded reference
+    """
+    ref = {"pose": poseKey, "poseExt": poseExtension, "thumbnail": thumbnailKey, "thumbnailExt": thumbnailExtension}
+    if meta:
+        ref["meta"] = meta
+    if storeDirectory and os.path.abspath(storeDirectory) != os.path.abspath(config.POSE_STORE_DIR):
+        ref["store"] = os.path.abspath(storeDirectory)
+    return REF_MAGIC + json.dumps(ref, sort_keys=True).encode("utf-8")
+
+
+def getRefStore(ref, storeDirectory=None):
+    """Store root of a reference: the given store, the store it was written to, or config.POSE_STORE_DIR"""
+    return storeDirectory or ref.get("store") or config.POSE_STORE_DIR
+
+
+def resolvePoseRef(ref, storeDirectory=None):
+    """Path of the pose payload a reference points to"""
+    return getObjectPath(ref["pose"], ref["poseExt"], getRefStore(ref, storeDirectory))
+
+
+def resolveThumbnailRef(ref, storeDirectory=None):
+    """Path of the thumbnail a reference points to, or an empty string if it has none"""
+    if not ref.get("thumbnail"):
+        return ""
+    return getObjectPath(ref["thumbnail"], ref["thumbnailExt"], getRefStore(ref, storeDirectory))
+
+
+def storeObject(data, key, extension, storeDirectory=None):
+    """
+    Add a blob to the store unless it is already there
+    Returns:
+        bool: True if the blob was written, False if the store already had it
+    """
+    objectPath = getObjectPath(key, extension, storeDirectory)
+    if os.path.exists(objectPath):
+        return False
+    if not os.path.isdir(os.path.dirname(objectPath)):
+        os.makedirs(os.path.dirname(objectPath), exist_ok=True)
+    utils.atomicWriteFile(objectPath, data)
+    return True
+
+
+def encodeStoredPose(poseData, meta=None, storeDirectory=None):
+    """
+    Store a pose payload in binary format if the store does not have it yet and return the reference
+    to save as the named pose. Saving a pose that is already stored only costs the reference
+    Args:
+        poseData (dict): {control: matrix} pose data
+        meta (dict): Metadata header of the payload
+        storeDirectory (str): Store root, defaults to config.POSE_STORE_DIR
+    Returns:
+        bytes: The encoded pose reference
+    """
+    key = poseContentKey(poseData)
+    if not os.path.exists(getObjectPath(key, config.BINARY_POSE_EXTENSION, storeDirectory)):
+        storeObject(poseio.encodeBinaryPose(poseData, meta), key, config.BINARY_POSE_EXTENSION, storeDirectory)
+    return encodePoseRef(key, config.BINARY_POSE_EXTENSION, meta=meta, storeDirectory=storeDirectory)
+
+
+def iterCharacterDirectories(rootDirectory):
+    for category in sorted(os.listdir(rootDirectory)):
+        categoryDirectory = os.path.join(rootDirectory, category)
+        if category.startswith(".") or not os.path.isdir(categoryDirectory):
+            continue
+        for character in sorted(os.listdir(categoryDirectory)):
+            charDirectory = os.path.join(categoryDirectory, character)
+            if os.path.isdir(charDirectory):
+                yield charDirectory
+
+
+def dedupeLibrary(rootDirectory=None, storeDirectory=None, tolerance=None, dryRun=False):
+    """
+    Move every pose payload and thumbnail of the library into the store and replace the poses with
+    references. Identical and near identical poses, and identical thumbnails, end up sharing one object.
+    A pose whose name is also used by another pose file of its character, in another format or as a
+    reference, is skipped and its files are kept
+    Args:
+        rootDirectory (str): Library root, defaults to config.PROJECT_ROOT
+        storeDirectory (str): Store root, defaults to config.POSE_STORE_DIR. The references remember it
+        tolerance (float): Matrix tolerance for near identical poses, defaults to config.DEDUPE_TOLERANCE
+        dryRun (bool): If True, only compute the report
+    Returns:
+        dict: Report with pose / thumbnail counts, the bytes of the new references, the bytes reclaimed
+            and the skipped pose files
+    """
+    rootDirectory = rootDirectory or config.PROJECT_ROOT
+    storeDirectory = storeDirectory or config.POSE_STORE_DIR
+    report = {"poses": 0, "uniquePoses": 0, "thumbnails": 0, "uniqueThumbnails": 0,
+              "bytesBefore": 0, "bytesAfter": 0, "refBytes": 0, "bytesReclaimed": 0, "skipped": []}
+    seenKeys = set()
+
+    def addObject(data, key, extension):
+        # returns the number of bytes the store grows by
+        objectPath = getObjectPath(key, extension, storeDirectory)
+        if (key, extension) in seenKeys or os.path.exists(objectPath):
+            seenKeys.add((key, extension))
+            return 0
+        seenKeys.add((key, extension))
+        if not dryRun:
+            storeObject(data, key, extension, storeDirectory)
+        return len(data)
+
+    for charDirectory in iterCharacterDirectories(rootDirectory):
+        poseFiles = sorted(set(utils.getValidPoseFiles(os.listdir(charDirectory))))
+        # a name used by several pose files would make them share one reference and thumbnail
+        nameCounts = Counter(os.path.splitext(poseFile)[0] for poseFile in poseFiles)
+        for poseFile in poseFiles:
+            poseName, poseExtension = os.path.splitext(poseFile)
+            if poseExtension in (config.POSE_REF_EXTENSION, config.DELTA_POSE_EXTENSION):
+                continue
+            posePath = os.path.join(charDirectory, poseFile)
+            refPath = os.path.join(charDirectory, poseName + config.POSE_REF_EXTENSION)
+            if nameCounts[poseName] > 1 or os.path.exists(refPath):
+                report["skipped"].append(posePath)
+                continue
+            with open(posePath, "rb") as fp:
+                poseBytes = fp.read()
+            poseKey = poseContentKey(poseio.loadPoseBytes(poseBytes), tolerance)
+            meta = poseio.loadPoseMetadata(poseBytes, poseName=poseName, created=os.path.getctime(posePath))
+            report["poses"] += 1
+            report["bytesBefore"] += len(poseBytes)
+            added = addObject(poseBytes, poseKey, poseExtension)
+            report["uniquePoses"] += 1 if added else 0
+            report["bytesAfter"] += added
+
+            imgPath = utils.getIconImage(posePath)
+            thumbnailKey = thumbnailExtension = ""
+            if imgPath:
+                with open(imgPath, "rb") as fp:
+                    imgBytes = fp.read()
+                thumbnailKey = hashlib.sha1(imgBytes).hexdigest()
+                thumbnailExtension = os.path.splitext(imgPath)[-1]
+                report["thumbnails"] += 1
+                report["bytesBefore"] += len(imgBytes)
+                added = addObject(imgBytes, thumbnailKey, thumbnailExtension)
+                report["uniqueThumbnails"] += 1 if added else 0
+                report["bytesAfter"] += added
+
+            refBytes = encodePoseRef(poseKey, poseExtension, thumbnailKey, thumbnailExtension, meta, storeDirectory)
+            report["refBytes"] += len(refBytes)
+            if dryRun:
+                continue
+            utils.atomicWriteFile(refPath, refBytes)
+            # the sources go only once the reference on disk is the one just written
+            with open(refPath, "rb") as fp:
+                if fp.read() != refBytes:
+                    report["skipped"].append(posePath)
+                    continue
+            os.remove(posePath)
+            if imgPath:
+                os.remove(imgPath)
+
+    report["bytesAfter"] += report["refBytes"]
+    # the references can outweigh what a library without duplicates saves
+    report["bytesReclaimed"] = max(0, report["bytesBefore"] - report["bytesAfter"])
+    print("{}Deduplicated {poses} poses into {uniquePoses} payloads and {thumbnails} thumbnails into "
+          "{uniqueThumbnails} images, {refBytes} bytes of references, {bytesReclaimed} bytes reclaimed".format(
+              "[dry run] " if dryRun else "", **report))
+    for posePath in report["skipped"]:
+        print("Skipped {}, its name is used by another pose file".format(posePath))
+    return report
+
+
+def iterCharacterRefs(charDirectory):
+    """References of a character directory, loose reference files and references inside its pose pack"""
+    # posepack imports poseio, which imports this module
+    from . import posepack
+    for poseFile in sorted(os.listdir(charDirectory)):
+        if poseFile.endswith(config.POSE_REF_EXTENSION):
+            yield readPoseRef(os.path.join(charDirectory, poseFile))
+    packPath = posepack.findPosePack(charDirectory)
+    if packPath:
+        with posepack.PosePack(packPath) as pack:
+            for poseName in pack.poseNames():
+                data = pack.readPoseBytes(poseName)
+                if isPoseRefData(data):
+                    yield decodePoseRef(data)
+
+
+def collectGarbage(rootDirectory=None, storeDirectory=None, dryRun=False):
+    """
+    Delete the store objects no pose reference points to anymore, references packed in pose packs included
+    Returns:
+        int: Number of bytes freed
+    """
+    rootDirectory = rootDirectory or config.PROJECT_ROOT
+    storeDirectory = storeDirectory or config.POSE_STORE_DIR
+    referenced = set()
+    for charDirectory in iterCharacterDirectories(rootDirectory):
+        for ref in iterCharacterRefs(charDirectory):
+            # a reference resolves in the store it was written to, which may not be this one
+            referenced.add(os.path.normcase(os.path.abspath(resolvePoseRef(ref))))
+            if ref.get("thumbnail"):
+                referenced.add(os.path.normcase(os.path.abspath(resolveThumbnailRef(ref))))
+
+    freed = 0
+    objectsDirectory = os.path.join(storeDirectory, "objects")
+    if not os.path.isdir(objectsDirectory):
+        return freed
+    for dirpath, _, filenames in os.walk(objectsDirectory):
+        for filename in filenames:
+            objectPath = os.path.join(dirpath, filename)
+            if os.path.normcase(os.path.abspath(objectPath)) in referenced:
+                continue
+            freed += os.path.getsize(objectPath)
+            if not dryRun:
+                os.remove(objectPath)
+    print("{}Freed {} bytes of unreferenced pose store objects".format("[dry run] " if dryRun else "", freed))
+    return freed
@@ -0,0 +1,245 @@
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+
+from . import config
+from . import poseio
+from . import utils
+
+# Single pass directory scanner. One os.scandir listing gives the pose files, their thumbnails and,
+# through the cached DirEntry.stat(), the times and sizes, where the previous scan did a listdir,
+# then getctime / getmtime / getsize and one exists probe per image extension for every pose.
+
+
+def pairPoseFiles(names):
+    """
+    Pick the pose files of a directory listing and pair them with their thumbnail
+    Args:
+        names (list): File names of the directory
+    Returns:
+        list: (poseName, pose file name, thumbnail file name or "") sorted by pose file name
+    """
+    poseExtensions = config.VALID_EXTENSIONS['File']
+    imageExtensions = [os.path.normcase(extension) for extension in config.VALID_EXTENSIONS['Img']]
+    poseFiles = []
+    images = {}
+    for name in names:
+        stem, extension = os.path.splitext(name)
+        if extension in poseExtensions:
+            poseFiles.append((stem, name))
+            continue
+        extension = os.path.normcase(extension)
+        if extension in imageExtensions:
+            # same priority as utils.getIconImage, the last valid image extension wins
+            key = os.path.normcase(stem)
+            current = images.get(key)
+            if current is None or imageExtensions.index(extension) > current[0]:
+                images[key] = (imageExtensions.index(extension), name)
+
+    pairs = []
+    for stem, poseFile in sorted(poseFiles, key=lambda item: item[1]):
+        image = images.get(os.path.normcase(stem))
+        pairs.append((stem, poseFile, image[1] if image else ""))
+    return pairs
+
+
+def makePoseRecord(charDirectory, poseName, poseFile, imgFile, stat):
+    return {
+        "poseName": poseName,
+        "poseFile": poseFile,
+        "fullPath": os.path.join(charDirectory, poseFile),
+        "imgFile": os.path.join(charDirectory, imgFile) if imgFile else "",
+        "cTime": stat.st_ctime,
+        "mTime": stat.st_mtime,
+        "size": stat.st_size
+    }
+
+
+def scanPoseDirectory(charDirectory):
+    """
+    Collect the pose files of a character directory in one listing
+    Args:
+        charDirectory (str): Character directory
+    Returns:
+        list: Pose records sorted by file name, dictionaries with poseName, poseFile, fullPath, imgFile,
+            cTime, mTime and size
+    """
+    with os.scandir(charDirectory) as entries:
+        entriesByName = {entry.name: entry for entry in entries}
+    records = []
+    for poseName, poseFile, imgFile in pairPoseFiles(entriesByName.keys()):
+        records.append(makePoseRecord(charDirectory, poseName, poseFile, imgFile, entriesByName[poseFile].stat()))
+    return records
+
+
+def getPoseFileInformation(record):
+    """Same dictionary as utils.getPoseFileInformation, built from a scan record without touching the disk"""
+    return {
+        'poseName': record["poseName"],
+        'poseType': utils.getPoseType(record["poseName"]),
+        'fullPath': record["fullPath"],
+        'imgFile': record["imgFile"],
+        'cDate': datetime.fromtimestamp(record["cTime"]).strftime('%m-%d-%Y %I:%M %p'),
+        'mDate': datetime.fromtimestamp(record["mTime"]).strftime('%m-%d-%Y %I:%M %p'),
+        'cTime': record["cTime"],
+        'mTime': record["mTime"],
+        'size': str("{} KB".format(math.ceil(record["size"] / 1024)))
+    }
+
+
+def scanPoseFileInformation(charDirectory):
+    """
+    Pose information of every pose of a character directory
+    Args:
+        charDirectory (str): Character directory
+    Returns:
+        dict: {poseName: pose information}
+    """
+    return {record["poseName"]: getPoseFileInformation(record) for record in scanPoseDirectory(charDirectory)}
+
+
+class ScanCancelled(Exception):
+    pass
+
+
+class LocalFileSystem(object):
+    """The file system calls of the parallel scanner, benchmarks swap it for a stand in with latency"""
+    def listdir(self, path):
+        with os.scandir(path) as entries:
+            return [(entry.name, entry.is_dir()) for entry in entries]
+
+    def stat(self, path):
+        return os.stat(path)
+
+    def readPoseMetadata(self, path):
+        return poseio.readPoseMetadata(path)
+
+
+class ParallelScanner(object):
+    """
+    Scan the library with a pool of threads for file systems where every call has a high latency, e.g. an
+    SMB or NFS share: listings, stat calls and header reads of different files are in flight at the same
+    time. The results are the same data structures as the sequential functions.
+
+    progress is called with (done, total) from the calling thread, cancel can be called from any thread and
+    makes the running scan raise ScanCancelled
+    """
+    def __init__(self, workers=None, progress=None, fileSystem=None):
+        self.workers = workers or config.SCAN_WORKERS
+        self.progress = progress
+        self.fileSystem = fileSystem or LocalFileSystem()
+        self.cancelEvent = threading.Event()
+        self.done = 0
+        self.total = 0
+
+    def cancel(self):
+        self.cancelEvent.set()
+
+    def isCancelled(self):
+        return self.cancelEvent.is_set()
+
+    def map(self, func, items):
+        """
+        Ordered results of func over items, computed in the pool. Each finished item counts towards the progress
+        """
+        items = list(items)
+        if not items:
+            return []
+        self.total += len(items)
+        results = [None] * len(items)
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(items))) as executor:
+            futures = {executor.submit(func, item): index for index, item in enumerate(items)}
+            pending = set(futures)
+            try:
+                while pending:
+                    if self.isCancelled():
+                        raise ScanCancelled()
+                    finished, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        results[futures[future]] = future.result()
+                        self.done += 1
+                    if finished and self.progress:
+                        self.progress(self.done, self.total)
+            finally:
+                for future in pending:
+                    future.cancel()
+        return results
+
+    def listDirectory(self, path):
+        """Non hidden (names, subdirectory names) of a directory"""
+        names = []
+        subdirectories = []
+        for name, isDir in self.fileSystem.listdir(path):
+            if name.startswith("."):
+                continue
+            names.append(name)
+            if isDir:
+                subdirectories.append(name)
+        return names, subdirectories
+
+    def folderStructureToDictionary(self, baseDirectory=None):
+        """Parallel utils.folder_structure_to_dictionary, {category: [characters]}"""
+        baseDirectory = baseDirectory or config.PROJECT_ROOT
+        _, categories = self.listDirectory(baseDirectory)
+        listings = self.map(self.listDirectory, [os.path.join(baseDirectory, category) for category in categories])
+        return {category: names for category, (names, _) in zip(categories, listings)}
+
+    def getCharacterDirectories(self, baseDirectory=None):
+        baseDirectory = baseDirectory or config.PROJECT_ROOT
+        _, categories = self.listDirectory(baseDirectory)
+        categoryDirectories = [os.path.join(baseDirectory, category) for category in categories]
+        listings = self.map(self.listDirectory, categoryDirectories)
+        return [os.path.join(categoryDirectory, character)
+                for categoryDirectory, (_, characters) in zip(categoryDirectories, listings)
+                for character in characters]
+
+    def statDirectories(self, directories):
+        """{directory: mtime} of directories, None for the directories that are gone"""
+        def getMtime(directory):
+            try:
+                return self.fileSystem.stat(directory).st_mtime
+            except OSError:
+                return None
+        return dict(zip(directories, self.map(getMtime, directories)))
+
+    def scanPoseDirectories(self, charDirectories):
+        """
+        Parallel scanPoseDirectory of several character directories, the listings and then every stat of
+        every directory are spread over the pool
+        Returns:
+            dict: {charDirectory: pose records}
+        """
+        def listNames(directory):
+            try:
+                return self.listDirectory(directory)[0]
+            except OSError:
+                return []
+
+        def statPose(pair):
+            try:
+                return self.fileSystem.stat(os.path.join(pair[0], pair[2]))
+            except OSError:
+                # deleted since the listing
+                return None
+
+        charDirectories = list(charDirectories)
+        listings = self.map(listNames, charDirectories)
+        pairs = []
+        for charDirectory, names in zip(charDirectories, listings):
+            for poseName, poseFile, imgFile in pairPoseFiles(names):
+                pairs.append((charDirectory, poseName, poseFile, imgFile))
+        stats = self.map(statPose, pairs)
+        records = {charDirectory: [] for charDirectory in charDirectories}
+        for (charDirectory, poseName, poseFile, imgFile), stat in zip(pairs, stats):
+            if stat is not None:
+                records[charDirectory].append(makePoseRecord(charDirectory, poseName, poseFile, imgFile, stat))
+        return records
+
+    def scanPoseDirectory(self, charDirectory):
+        return self.scanPoseDirectories([charDirectory])[charDirectory]
+
+    def readPoseMetadata(self, filepaths):
+        """Metadata headers of pose files read in parallel, None for legacy files, see poseio.readPoseMetadata"""
+        return self.map(self.fileSystem.readPoseMetadata, filepaths)
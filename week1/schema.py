@@ -0,0 +1,125 @@
+import numpy as np
+
+from . import transforms
+
+# Pose schema versions:
+#   1: {namespace:control: {"translateX": ..., "rotateY": ..., "visibility": ...}}, one dict of attributes per control
+#   2: {control: [16 floats]}, object space matrix per control, namespace stripped (lib.getPoseData)
+ATTRIBUTE_SCHEMA = 1
+MATRIX_SCHEMA = 2
+SCHEMA_VERSION = MATRIX_SCHEMA
+
+# Maya rotateOrder enum: xyz, yzx, zxy, xzy, yxz, zyx
+ROTATE_ORDERS = ["xyz", "yzx", "zxy", "xzy", "yxz", "zyx"]
+TRANSFORM_ATTRIBUTES = {
+    "translate": 0.0,
+    "rotate": 0.0,
+    "scale": 1.0
+}
+
+
+def getPoseSchema(poseData):
+    """Find the schema of pose data from its values, empty poses are considered up to date"""
+    for value in poseData.values():
+        return ATTRIBUTE_SCHEMA if isinstance(value, dict) else MATRIX_SCHEMA
+    return SCHEMA_VERSION
+
+
+def axisRotations(axis, angles):
+    """(N, 3, 3) rotations around one axis in Maya row vector convention, angles in radians"""
+    cos, sin = np.cos(angles), np.sin(angles)
+    m = np.zeros((len(angles), 3, 3))
+    i, j = {"x": (1, 2), "y": (2, 0), "z": (0, 1)}[axis]
+    k = 3 - i - j
+    m[:, k, k] = 1.0
+    m[:, i, i] = cos
+    m[:, j, j] = cos
+    m[:, i, j] = sin
+    m[:, j, i] = -sin
+    return m
+
+
+def attributesToMatrices(attributeDicts):
+    """
+    Compose attribute dictionaries into object space matrices in one vectorised batch.
+    Missing attributes take their default value, rotations are in degrees and follow the optional
+    rotateOrder attribute. Pivots, joint orients and rotate axes are not part of the legacy schema
+    Args:
+        attributeDicts (list): Attribute dictionaries, e.g. {"translateX": 1.0, "rotateY": 45.0}
+    Returns:
+        np.ndarray: (N, 16) matrices
+    """
+    count = len(attributeDicts)
+    values = {}
+    for attribute, default in TRANSFORM_ATTRIBUTES.items():
+        values[attribute] = np.array([[attributes.get(attribute + axis, default) for axis in "XYZ"]
+                                      for attributes in attributeDicts], dtype=np.float64).reshape(count, 3)
+    rotateOrders = np.array([int(attributes.get("rotateOrder", 0)) for attributes in attributeDicts], dtype=int)
+
+    angles = np.radians(values["rotate"])
+    axisMatrices = {axis: axisRotations(axis, angles[:, index]) for index, axis in enumerate("xyz")}
+    rotations = np.empty((count, 3, 3))
+    for orderIndex, order in enumerate(ROTATE_ORDERS):
+        selected = rotateOrders == orderIndex
+        if not selected.any():
+            continue
+        # row vectors: the first axis of the order is applied first
+        first, second, third = (axisMatrices[axis][selected] for axis in order)
+        rotations[selected] = first @ second @ third
+
+    matrices = np.zeros((count, 4, 4))
+    matrices[:, :3, :3] = rotations * values["scale"][:, :, np.newaxis]
+    matrices[:, 3, :3] = values["translate"]
+    matrices[:, 3, 3] = 1.0
+    return matrices.reshape(count, 16)
+
+
+def upgradePoseData(poseData):
+    """
+    Convert pose data of any schema to the current matrix schema
+    Args:
+        poseData (dict): Pose data
+    Returns:
+        dict: {control: matrix} pose data, controls without namespace
+    """
+    if getPoseSchema(poseData) == MATRIX_SCHEMA:
+        return poseData
+    controls = list(poseData.keys())
+    upgradedPoseData = {}
+    matrices = attributesToMatrices([poseData[control] for control in controls])
+    for control, matrix in zip(controls, matrices.tolist()):
+        upgradedPoseData[control.split(":")[-1]] = matrix
+    return upgradedPoseData
+
+
+def upgradePoseItem(control, value):
+    """Single control version of upgradePoseData, used by the pose streams"""
+    if isinstance(value, dict):
+        return control.split(":")[-1], attributesToMatrices([value])[0].tolist()
+    return control, value
+
+
+def matricesToAttributes(matrices):
+    """
+    Decompose matrices into translate / rotate (xyz order, degrees) / scale attributes, the inverse
+    of attributesToMatrices for rotateOrder xyz
+    Args:
+        matrices (np.ndarray): (N, 16) matrices
+    Returns:
+        list: Attribute dictionaries
+    """
+    translations, quaternions, scales = transforms.decomposeMatrices(matrices)
+    rotations = transforms.rotationsFromQuaternions(quaternions)
+    # R = Rx Ry Rz in row vector convention gives R[0, 2] = -sin(y)
+    rotateY = np.arcsin(np.clip(-rotations[:, 0, 2], -1.0, 1.0))
+    rotateX = np.arctan2(rotations[:, 1, 2], rotations[:, 2, 2])
+    rotateZ = np.arctan2(rotations[:, 0, 1], rotations[:, 0, 0])
+    angles = np.degrees(np.stack([rotateX, rotateY, rotateZ], axis=1))
+    attributeDicts = []
+    for translation, angle, scale in zip(translations.tolist(), angles.tolist(), scales.tolist()):
+        attributes = {}
+        for attribute, vector in (("translate", translation), ("rotate", angle), ("scale", scale)):
+            for axis, value in zip("XYZ", vector):
+                attributes[attribute + axis] = value
+        attributeDicts.append(attributes)
+    return attributeDicts
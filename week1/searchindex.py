@@ -0,0 +1,239 @@
+import heapq
+import re
+import sqlite3
+import threading
+from collections import defaultdict, namedtuple
+
+from . import config
+
+# Search index over the characters and poses of the whole library.
+# Terms of three characters or more are matched as substrings through a trigram index, shorter terms
+# as prefixes of the words of the names (camelCase, digits and separators split words). Results are
+# ranked: names starting with the query, then names with a word starting with it, then any other match,
+# alphabetical within each rank. Document ids follow the alphabetical order so ranking inside a rank is a
+# heap of ids and only the returned results are verified.
+SearchDocument = namedtuple("SearchDocument", ["kind", "name", "character", "category", "tags"])
+CHARACTER_KIND = "character"
+POSE_KIND = "pose"
+PREFIX_SIZE = 3
+WORD_PATTERN = re.compile(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])|[0-9]+|[^\W\d_]+")
+
+
+def splitWords(text):
+    return [word.lower() for word in WORD_PATTERN.findall(text)]
+
+
+def iterTrigrams(text):
+    for index in range(len(text) - 2):
+        yield text[index:index + 3]
+
+
+class SearchIndex(object):
+    """
+    Immutable index of SearchDocuments, build it again when the library changes.
+    search refines the candidates of the previous query when the query grows, so typing costs a few set
+    intersections per keystroke
+    """
+    def __init__(self, documents):
+        self.documents = sorted(documents, key=lambda document: (document.name.lower(), document.kind,
+                                                                 document.category, document.character))
+        self.texts = []
+        self.names = []
+        self.nameWords = []
+        self.trigrams = defaultdict(set)
+        self.namePrefixes = defaultdict(set)
+        self.wordPrefixes = defaultdict(set)
+        self.fieldPrefixes = defaultdict(set)
+        self.kinds = defaultdict(set)
+        for docId, document in enumerate(self.documents):
+            self.addDocument(docId, document)
+        # term -> candidate ids of the previous query
+        self.previousCandidates = {}
+
+    def addDocument(self, docId, document):
+        fields = [document.name, document.character, document.category] + list(document.tags)
+        text = "\0".join(field.lower() for field in fields)
+        name = document.name.lower()
+        nameWords = splitWords(document.name)
+        self.texts.append(text)
+        self.names.append(name)
+        self.nameWords.append(nameWords)
+        self.kinds[document.kind].add(docId)
+        for trigram in set(iterTrigrams(text)):
+            self.trigrams[trigram].add(docId)
+        fieldWords = set(nameWords)
+        for field in fields[1:]:
+            fieldWords.update(splitWords(field))
+        for size in range(1, PREFIX_SIZE + 1):
+            self.namePrefixes[name[:size]].add(docId)
+            for prefix in set(word[:size] for word in nameWords):
+                self.wordPrefixes[prefix].add(docId)
+            for prefix in set(word[:size] for word in fieldWords):
+                self.fieldPrefixes[prefix].add(docId)
+
+    def __len__(self):
+        return len(self.documents)
+
+    def getTermCandidates(self, term):
+        """Ids that may match a term, exact for short terms and trigrams, a superset for longer terms"""
+        if len(term) < 3:
+            return self.fieldPrefixes.get(term, set())
+        # refine the candidates of a previous term contained in this one, e.g. while typing
+        # short terms are prefix matches, only trigram candidates are a superset of a longer term
+        previous = max((cached for cached in self.previousCandidates if len(cached) >= 3 and cached in term),
+                       key=len, default=None)
+        candidates = self.previousCandidates[previous] if previous else None
+        trigrams = sorted(set(iterTrigrams(term)) - set(iterTrigrams(previous or "")),
+                          key=lambda trigram: len(self.trigrams.get(trigram, ())))
+        for trigram in trigrams:
+            postings = self.trigrams.get(trigram, set())
+            candidates = postings if candidates is None else candidates & postings
+            if not candidates:
+                break
+        return candidates
+
+    def matches(self, docId, longTerms):
+        text = self.texts[docId]
+        return all(term in text for term in longTerms)
+
+    def search(self, query, limit=50, kinds=None):
+        """
+        Ranked documents matching every word of the query
+        Args:
+            query (str): Search text, case insensitive
+            limit (int): Maximum number of results, None for all of them
+            kinds (list): Only return these document kinds, e.g. [CHARACTER_KIND]
+        Returns:
+            list: SearchDocuments, best match first
+        """
+        terms = query.lower().split()
+        if not terms:
+            return []
+        termCandidates = {}
+        for term in terms:
+            termCandidates[term] = self.getTermCandidates(term)
+        self.previousCandidates = termCandidates
+        candidates = None
+        for term in sorted(terms, key=lambda term: len(termCandidates[term])):
+            candidates = termCandidates[term] if candidates is None else candidates & termCandidates[term]
+            if not candidates:
+                return []
+        if kinds:
+            kindIds = set()
+            for kind in kinds:
+                kindIds |= self.kinds.get(kind, set())
+            candidates = candidates & kindIds
+        # 3 letter terms and short prefixes are exact, longer terms are verified on the returned results
+        longTerms = [term for term in terms if len(term) > 3]
+        limit = len(candidates) if limit is None else limit
+
+        first = terms[0]
+        key = first[:PREFIX_SIZE]
+        nameRank = candidates & self.namePrefixes.get(key, set())
+        wordRank = (candidates & self.wordPrefixes.get(key, set())) - nameRank
+        ranks = [
+            (nameRank, lambda docId: self.names[docId].startswith(first)),
+            (wordRank, lambda docId: any(word.startswith(first) for word in self.nameWords[docId])),
+            (None, None)
+        ]
+        results = []
+        spilled = []
+        for rankIds, check in ranks:
+            if rankIds is None:
+                rankIds = candidates - nameRank - wordRank
+            heap = list(rankIds) + spilled
+            heapq.heapify(heap)
+            spilled = []
+            while heap and len(results) < limit:
+                docId = heapq.heappop(heap)
+                if longTerms and not self.matches(docId, longTerms):
+                    continue
+                if check and not check(docId):
+                    # belongs to a lower rank
+                    spilled.append(docId)
+                    continue
+                results.append(self.documents[docId])
+            if len(results) >= limit:
+                break
+        return results
+
+
+def readLibraryDocuments(catalogPath=None):
+    """
+    Search documents of every character and pose in the catalog, read with a connection of the calling
+    thread. Tags are the pose type and the namespace the pose was saved from
+    """
+    connection = sqlite3.connect(catalogPath or config.CATALOG_FILE, timeout=30.0)
+    try:
+        documents = []
+        characters = connection.execute(
+            "SELECT path, name, parent FROM directories WHERE kind = 'character'").fetchall()
+        categoryNames = dict(connection.execute(
+            "SELECT path, name FROM directories WHERE kind = 'category'").fetchall())
+        characterNames = {}
+        for path, name, parent in characters:
+            category = categoryNames.get(parent, "")
+            characterNames[path] = (name, category)
+            documents.append(SearchDocument(CHARACTER_KIND, name, name, category, ()))
+        for directory, poseName, poseType, namespace in connection.execute(
+                "SELECT directory, poseName, poseType, namespace FROM poses"):
+            character, category = characterNames.get(directory, ("", ""))
+            tags = tuple(tag for tag in (poseType, namespace) if tag)
+            documents.append(SearchDocument(POSE_KIND, poseName, character, category, tags))
+        return documents
+    finally:
+        connection.close()
+
+
+class LibrarySearchIndex(object):
+    """
+    Search index of the library built lazily on a background thread. get returns None until the first
+    build finished, invalidate schedules a rebuild and keeps answering from the previous index meanwhile.
+    Listeners are called from the build thread once a new index is ready
+    """
+    def __init__(self, catalogPath=None):
+        self.catalogPath = catalogPath or config.CATALOG_FILE
+        self.index = None
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stale = True
+        self.listeners = []
+
+    def addListener(self, listener):
+        if listener not in self.listeners:
+            self.listeners.append(listener)
+
+    def removeListener(self, listener):
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    def get(self):
+        with self.lock:
+            if self.stale and self.thread is None:
+                self.stale = False
+                self.thread = threading.Thread(target=self.build, name="LibrarySearchIndex")
+                self.thread.daemon = True
+                self.thread.start()
+            return self.index
+
+    def invalidate(self):
+        with self.lock:
+            self.stale = True
+        if self.index is not None:
+            self.get()
+
+    def build(self):
+        try:
+            index = SearchIndex(readLibraryDocuments(self.catalogPath))
+        except Exception as e:
+            print("Could not build the library search index: {}".format(e))
+            index = None
+        with self.lock:
+            if index is not None:
+                self.index = index
+            self.thread = None
+            rebuild = self.stale
+        for listener in list(self.listeners):
+            listener()
+        if rebuild:
+            self.get()
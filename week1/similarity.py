@@ -0,0 +1,309 @@
+import io
+import json
+import os
+
+import numpy as np
+
+from . import config
+from . import posecache
+from . import poseio
+from . import posepack
+from . import scanner
+from . import schema
+from . import transforms
+from . import utils
+
+# Nearest neighbour index of the poses of a character.
+# Every pose is a feature vector of FEATURE_SIZE values per control: the weighted translation and the
+# quaternion (x, y, z, w) with w >= 0. Columns are aligned by control short name, controls a pose does not
+# store keep the identity transform. Queries compute the squared distances to every pose in one matrix
+# product, which stays in the tens of milliseconds for tens of thousands of poses, so no tree is needed.
+FEATURE_SIZE = 7
+INDEX_VERSION = 1
+IDENTITY_FEATURE = np.array([0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 1.0], dtype=np.float32)
+
+
+def getShortName(control):
+    return control.split("|")[-1].split(":")[-1]
+
+
+class PoseSimilarityIndex(object):
+    """
+    Feature matrix of a set of poses. Rows live in a buffer that grows by doubling, removing a pose moves
+    the last row into its slot, so saving or deleting a pose costs one row update
+    """
+    def __init__(self, translationWeight=None):
+        self.translationWeight = config.SIMILARITY_TRANSLATION_WEIGHT if translationWeight is None \
+            else translationWeight
+        self.controls = []
+        self.controlColumns = {}
+        self.poseNames = []
+        self.poseRows = {}
+        # poseName -> stamp of the file the features were computed from, see refreshSimilarityIndex
+        self.stamps = {}
+        self.buffer = np.zeros((0, 0), dtype=np.float32)
+        self.squaredNorms = np.zeros(0, dtype=np.float32)
+
+    def __len__(self):
+        return len(self.poseNames)
+
+    def __contains__(self, poseName):
+        return poseName in self.poseRows
+
+    @property
+    def features(self):
+        return self.buffer[:len(self.poseNames)]
+
+    def addControls(self, controls):
+        newControls = [control for control in controls if control not in self.controlColumns]
+        if not newControls:
+            return
+        for control in newControls:
+            self.controlColumns[control] = len(self.controls)
+            self.controls.append(control)
+        extra = np.tile(IDENTITY_FEATURE, (len(self.buffer), len(newControls)))
+        self.buffer = np.hstack([self.buffer, extra])
+        self.squaredNorms[:len(self.poseNames)] += len(newControls)
+
+    def reserve(self, count):
+        if count <= len(self.buffer):
+            return
+        capacity = max(count, 2 * len(self.buffer), 64)
+        buffer = np.tile(IDENTITY_FEATURE, (capacity, len(self.controls)))
+        buffer[:len(self.poseNames)] = self.features
+        squaredNorms = np.zeros(capacity, dtype=np.float32)
+        squaredNorms[:len(self.poseNames)] = self.squaredNorms[:len(self.poseNames)]
+        self.buffer = buffer
+        self.squaredNorms = squaredNorms
+
+    def computeFeatures(self, poses, addControls=True):
+        """
+        Feature rows of several poses, decomposed in one vectorised pass
+        Args:
+            poses (list): Pose data dictionaries {control: matrix}
+            addControls (bool): Add the controls the index does not know yet, otherwise they are ignored
+        Returns:
+            np.ndarray: (len(poses), len(self.controls) * FEATURE_SIZE) float32 features
+        """
+        rows = []
+        columns = []
+        matrices = []
+        for row, poseData in enumerate(poses):
+            poseData = schema.upgradePoseData(poseData)
+            shortNames = [getShortName(control) for control in poseData]
+            if addControls:
+                self.addControls(shortNames)
+            for shortName, matrix in zip(shortNames, poseData.values()):
+                column = self.controlColumns.get(shortName)
+                if column is None or not matrix:
+                    continue
+                rows.append(row)
+                columns.append(column)
+                matrices.append(matrix)
+        features = np.tile(IDENTITY_FEATURE, (len(poses), len(self.controls)))
+        if matrices:
+            translations, quaternions, _ = transforms.decomposeMatrices(matrices)
+            values = np.hstack([translations * self.translationWeight, quaternions])
+            features = features.reshape(len(poses), len(self.controls), FEATURE_SIZE)
+            features[rows, columns] = values
+            features = features.reshape(len(poses), -1)
+        return features
+
+    def addPoses(self, poses, stamps=None):
+        """
+        Add poses, or update them when they are already indexed
+        Args:
+            poses (dict): {poseName: pose data}
+            stamps (dict): {poseName: stamp} of the files the poses were read from
+        """
+        if not poses:
+            return
+        poseNames = list(poses.keys())
+        features = self.computeFeatures([poses[poseName] for poseName in poseNames])
+        self.reserve(len(self.poseNames) + len(poseNames))
+        for poseName, feature in zip(poseNames, features):
+            row = self.poseRows.get(poseName)
+            if row is None:
+                row = len(self.poseNames)
+                self.poseRows[poseName] = row
+                self.poseNames.append(poseName)
+            self.buffer[row] = feature
+            self.squaredNorms[row] = np.dot(feature, feature)
+            if stamps and poseName in stamps:
+                self.stamps[poseName] = stamps[poseName]
+
+    def removePoses(self, poseNames):
+        for poseName in poseNames:
+            row = self.poseRows.pop(poseName, None)
+            self.stamps.pop(poseName, None)
+            if row is None:
+                continue
+            lastName = self.poseNames.pop()
+            if lastName != poseName:
+                lastRow = len(self.poseNames)
+                self.buffer[row] = self.buffer[lastRow]
+                self.squaredNorms[row] = self.squaredNorms[lastRow]
+                self.poseNames[row] = lastName
+                self.poseRows[lastName] = row
+
+    def getDistances(self, feature):
+        """
+        Approximate distances of a feature row to every indexed pose through |a|^2 - 2ab + |b|^2,
+        float32 rounding makes them inexact for very close poses, see nearest
+        """
+        count = len(self.poseNames)
+        squared = self.squaredNorms[:count] - 2.0 * self.features.dot(feature) + np.dot(feature, feature)
+        return np.sqrt(np.maximum(squared, 0.0))
+
+    def nearest(self, feature, k, exclude=()):
+        distances = self.getDistances(feature)
+        excludedRows = [self.poseRows[poseName] for poseName in exclude if poseName in self.poseRows]
+        if excludedRows:
+            distances[excludedRows] = np.inf
+        k = min(k, len(distances) - len(excludedRows))
+        if k <= 0:
+            return []
+        # take a few more candidates and rank them on their exact distances
+        candidateCount = min(2 * k + 8, len(distances) - len(excludedRows))
+        rows = np.argpartition(distances, candidateCount - 1)[:candidateCount]
+        exact = np.linalg.norm(self.features[rows].astype(np.float64) - feature, axis=1)
+        order = np.argsort(exact, kind="stable")[:k]
+        return [(self.poseNames[rows[position]], float(exact[position])) for position in order]
+
+    def query(self, poseData, k=None, exclude=()):
+        """
+        Poses closest to a pose, e.g. the current scene pose
+        Args:
+            poseData (dict): {control: matrix}, controls the index does not know are ignored
+            k (int): Number of poses to return, defaults to config.SIMILAR_POSE_COUNT
+            exclude (list): Pose names to leave out
+        Returns:
+            list: (poseName, distance) pairs, closest first
+        """
+        if not self.poseNames:
+            return []
+        feature = self.computeFeatures([poseData], addControls=False)[0]
+        return self.nearest(feature, k or config.SIMILAR_POSE_COUNT, exclude)
+
+    def queryPose(self, poseName, k=None):
+        """Poses closest to an indexed pose, the pose itself is left out"""
+        feature = self.buffer[self.poseRows[poseName]].copy()
+        return self.nearest(feature, k or config.SIMILAR_POSE_COUNT, exclude=[poseName])
+
+    def findDuplicates(self, threshold=1e-3, chunkSize=1024):
+        """
+        Pairs of poses closer than threshold, compared a block of rows at a time
+        Returns:
+            list: (poseName, poseName, distance) sorted by distance
+        """
+        features = self.features
+        squaredNorms = self.squaredNorms[:len(self.poseNames)]
+        # margin for the float32 rounding of the approximate distances, candidates are checked exactly
+        margin = 1e-5 * float(squaredNorms.max()) if len(squaredNorms) else 0.0
+        duplicates = []
+        for start in range(0, len(features), chunkSize):
+            block = features[start:start + chunkSize]
+            squared = squaredNorms[start:start + chunkSize, np.newaxis] - 2.0 * block.dot(features.T) + squaredNorms
+            rows, columns = np.nonzero(squared <= threshold * threshold + margin)
+            for row, column in zip(rows + start, columns):
+                if row >= column:
+                    continue
+                distance = float(np.linalg.norm(features[row].astype(np.float64) - features[column]))
+                if distance <= threshold:
+                    duplicates.append((self.poseNames[row], self.poseNames[column], distance))
+        return sorted(duplicates, key=lambda duplicate: duplicate[2])
+
+    def encode(self):
+        info = {
+            "version": INDEX_VERSION,
+            "translationWeight": self.translationWeight,
+            "controls": self.controls,
+            "poseNames": self.poseNames,
+            "stamps": [self.stamps.get(poseName) for poseName in self.poseNames]
+        }
+        buffer = io.BytesIO()
+        np.savez(buffer, info=np.array(json.dumps(info)), features=self.features)
+        return buffer.getvalue()
+
+    @classmethod
+    def decode(cls, data):
+        with np.load(io.BytesIO(data)) as arrays:
+            info = json.loads(str(arrays["info"]))
+            features = arrays["features"]
+        if info["version"] != INDEX_VERSION or info["translationWeight"] != config.SIMILARITY_TRANSLATION_WEIGHT:
+            raise ValueError("Outdated pose similarity index")
+        index = cls(info["translationWeight"])
+        index.controls = info["controls"]
+        index.controlColumns = {control: column for column, control in enumerate(index.controls)}
+        index.poseNames = info["poseNames"]
+        index.poseRows = {poseName: row for row, poseName in enumerate(index.poseNames)}
+        index.stamps = {poseName: tuple(stamp) for poseName, stamp in zip(index.poseNames, info["stamps"]) if stamp}
+        index.buffer = features.astype(np.float32).reshape(len(index.poseNames), len(index.controls) * FEATURE_SIZE)
+        index.squaredNorms = np.einsum("ij,ij->i", index.buffer, index.buffer)
+        return index
+
+
+def getSimilarityIndexPath(charDirectory):
+    return os.path.join(charDirectory, config.SIMILARITY_INDEX_FILE)
+
+
+def loadSimilarityIndex(charDirectory):
+    """Similarity index of a character brought up to date with its pose files"""
+    index = None
+    indexPath = getSimilarityIndexPath(charDirectory)
+    if os.path.isfile(indexPath):
+        try:
+            with open(indexPath, "rb") as fp:
+                index = PoseSimilarityIndex.decode(fp.read())
+        except (OSError, ValueError, KeyError) as e:
+            print("Rebuilding the pose similarity index of {}: {}".format(charDirectory, e))
+    index = index or PoseSimilarityIndex()
+    refreshSimilarityIndex(index, charDirectory)
+    return index
+
+
+def getPoseSources(charDirectory):
+    """{poseName: (stamp, loader)} of every pose of a character, loose files take precedence over the pack"""
+    sources = {}
+    packPath = posepack.findPosePack(charDirectory)
+    if packPath:
+        with posepack.PosePack(packPath) as pack:
+            for poseName, entry in pack.entries.items():
+                stamp = (packPath, entry["mTime"], entry["poseSize"])
+                sources[poseName] = (stamp, lambda poseName=poseName: posepack.readPackedPose(packPath, poseName))
+    for record in scanner.scanPoseDirectory(charDirectory):
+        filepath = record["fullPath"]
+        stamp = (filepath, record["mTime"], record["size"])
+        loader = lambda filepath=filepath: posecache.getPoseCache().get(filepath, lambda: poseio.readPoseFile(filepath))
+        sources[record["poseName"]] = (stamp, loader)
+    return sources
+
+
+def refreshSimilarityIndex(index, charDirectory, save=True):
+    """
+    Update the index with the poses saved, deleted or edited since it was built, only those poses are read
+    Args:
+        index (PoseSimilarityIndex): Index of the character
+        charDirectory (str): Character directory
+        save (bool): Write the index next to the poses when it changed
+    Returns:
+        bool: True if the index changed
+    """
+    sources = getPoseSources(charDirectory)
+    removedPoses = [poseName for poseName in index.poseNames if poseName not in sources]
+    index.removePoses(removedPoses)
+    poses = {}
+    stamps = {}
+    for poseName, (stamp, loader) in sources.items():
+        if index.stamps.get(poseName) == stamp:
+            continue
+        try:
+            poses[poseName] = loader()
+            stamps[poseName] = stamp
+        except Exception as e:
+            print("Could not index pose {}: {}".format(poseName, e))
+    index.addPoses(poses, stamps)
+    changed = bool(removedPoses or poses)
+    if changed and save:
+        utils.atomicWriteFile(getSimilarityIndexPath(charDirectory), index.encode())
+    return changed
@@ -0,0 +1,73 @@
+import bisect
+
+from . import config
+
+# Pose names of a character kept in order for every config.SORTING_OPTIONS entry. Each sort key has one
+# ascending list of (value, poseName) keys, the descending options read it backwards, so adding, removing
+# or renaming a pose is a bisect per key and switching the sort option never sorts again.
+
+
+def getSortKey(field, poseName, poseInfo):
+    if field == "poseName":
+        return (poseName,)
+    # the pose name breaks ties, e.g. poses copied in the same second
+    return (poseInfo.get(field) or 0.0, poseName)
+
+
+class PoseSortIndex(object):
+    def __init__(self, posesDataDict=None):
+        self.fields = sorted(set(field for field, _ in config.SORTING_KEYS))
+        # field -> ascending keys
+        self.keys = {}
+        # poseName -> {field: key}
+        self.poseKeys = {}
+        posesDataDict = posesDataDict or {}
+        for poseName, poseInfo in posesDataDict.items():
+            self.poseKeys[poseName] = {field: getSortKey(field, poseName, poseInfo) for field in self.fields}
+        for field in self.fields:
+            self.keys[field] = sorted(keys[field] for keys in self.poseKeys.values())
+
+    def __len__(self):
+        return len(self.poseKeys)
+
+    def __contains__(self, poseName):
+        return poseName in self.poseKeys
+
+    def add(self, poseName, poseInfo):
+        """Add a pose, or move it after its times changed"""
+        self.remove(poseName)
+        poseKeys = {field: getSortKey(field, poseName, poseInfo) for field in self.fields}
+        self.poseKeys[poseName] = poseKeys
+        for field, key in poseKeys.items():
+            bisect.insort(self.keys[field], key)
+
+    def remove(self, poseName):
+        poseKeys = self.poseKeys.pop(poseName, None)
+        if poseKeys is None:
+            return
+        for field, key in poseKeys.items():
+            keys = self.keys[field]
+            del keys[bisect.bisect_left(keys, key)]
+
+    def rename(self, poseName, newName, poseInfo):
+        self.remove(poseName)
+        self.add(newName, poseInfo)
+
+    def getOrder(self, option):
+        """
+        Pose names in the order of a sorting option
+        Args:
+            option (int): Index in config.SORTING_OPTIONS
+        Returns:
+            list: Pose names
+        """
+        field, descending = config.SORTING_KEYS[option]
+        keys = reversed(self.keys[field]) if descending else self.keys[field]
+        return [key[-1] for key in keys]
+
+    def getPosition(self, option, poseName):
+        """Row of a pose in the order of a sorting option"""
+        field, descending = config.SORTING_KEYS[option]
+        keys = self.keys[field]
+        position = bisect.bisect_left(keys, self.poseKeys[poseName][field])
+        return len(keys) - 1 - position if descending else position
@@ -0,0 +1,77 @@
+import numpy as np
+
+from .. import blend
+from .. import transforms
+
+
+def randomQuaternions(count, seed=0):
+    quaternions = np.random.default_rng(seed).normal(size=(count, 4))
+    return transforms.normalizeQuaternions(quaternions)
+
+
+def randomMatrices(count, seed=0, negativeScale=False):
+    rng = np.random.default_rng(seed)
+    scales = rng.uniform(0.5, 2.0, size=(count, 3))
+    if negativeScale:
+        scales[:, 0] *= -1.0
+    return transforms.composeMatrices(rng.normal(size=(count, 3)), randomQuaternions(count, seed), scales)
+
+
+def assertSameRotations(a, b):
+    # q and -q are the same rotation
+    np.testing.assert_allclose(np.abs(np.sum(a * b, axis=1)), 1.0, atol=1e-9)
+
+
+def testComposeDecomposeRoundTrip():
+    matrices = randomMatrices(64)
+    translations, quaternions, scales = transforms.decomposeMatrices(matrices)
+    np.testing.assert_allclose(transforms.composeMatrices(translations, quaternions, scales), matrices, atol=1e-9)
+
+
+def testComposeDecomposeRoundTripNegativeScale():
+    matrices = randomMatrices(64, seed=1, negativeScale=True)
+    translations, quaternions, scales = transforms.decomposeMatrices(matrices)
+    assert np.all(scales[:, 0] < 0.0)
+    np.testing.assert_allclose(transforms.composeMatrices(translations, quaternions, scales), matrices, atol=1e-9)
+
+
+def testDecomposeFlatMatrices():
+    matrices = randomMatrices(8, seed=2)
+    flat = matrices.reshape(8, 16).tolist()
+    for expected, result in zip(transforms.decomposeMatrices(matrices), transforms.decomposeMatrices(flat)):
+        np.testing.assert_allclose(result, expected)
+
+
+def testSlerpEndpoints():
+    a = randomQuaternions(32, seed=3)
+    b = randomQuaternions(32, seed=4)
+    assertSameRotations(blend.slerpQuaternions(a, b, 0.0), a)
+    assertSameRotations(blend.slerpQuaternions(a, b, 1.0), b)
+
+
+def testSlerpShortestArc():
+    a = randomQuaternions(32, seed=5)
+    b = randomQuaternions(32, seed=6)
+    # -b is the same rotation as b, the blend must not take the long way round
+    np.testing.assert_allclose(blend.slerpQuaternions(a, -b, 0.5), blend.slerpQuaternions(a, b, 0.5), atol=1e-12)
+    middle = blend.slerpQuaternions(a, b, 0.5)
+    angleToA = np.arccos(np.clip(np.abs(np.sum(middle * a, axis=1)), -1.0, 1.0))
+    angleToB = np.arccos(np.clip(np.abs(np.sum(middle * b, axis=1)), -1.0, 1.0))
+    arc = np.arccos(np.clip(np.abs(np.sum(a * b, axis=1)), -1.0, 1.0))
+    np.testing.assert_allclose(angleToA, arc / 2.0, atol=1e-9)
+    np.testing.assert_allclose(angleToB, arc / 2.0, atol=1e-9)
+
+
+def testSlerpNearlyEqualQuaternions():
+    a = randomQuaternions(8, seed=7)
+    b = transforms.normalizeQuaternions(a + 1e-6)
+    result = blend.slerpQuaternions(a, b, 0.25)
+    np.testing.assert_allclose(np.linalg.norm(result, axis=1), 1.0)
+    assertSameRotations(result, transforms.normalizeQuaternions(a * 0.75 + b * 0.25))
+
+
+def testBlendMatricesEndpoints():
+    src = randomMatrices(16, seed=8)
+    dst = randomMatrices(16, seed=9)
+    np.testing.assert_allclose(blend.blendMatrices(src, dst, 0.0), src, atol=1e-9)
+    np.testing.assert_allclose(blend.blendMatrices(src, dst, 1.0), dst, atol=1e-9)
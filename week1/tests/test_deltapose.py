@@ -0,0 +1,98 @@
+import os
+import struct
+
+import numpy as np
+import pytest
+
+from .. import deltapose
+from .. import poseio
+from .. import transforms
+
+
+def makePose(seed=0, count=4, prefix="ctrl"):
+    """TRS pose, delta poses store translation, rotation and scale"""
+    rng = np.random.default_rng(seed)
+    quaternions = transforms.normalizeQuaternions(rng.normal(size=(count, 4)))
+    matrices = transforms.composeMatrices(rng.normal(size=(count, 3)), quaternions, rng.uniform(0.5, 2.0, size=(count, 3)))
+    return {"{}{}".format(prefix, index): list(matrix) for index, matrix in enumerate(matrices.reshape(count, 16))}
+
+
+def assertSamePose(a, b, tolerance=1e-4):
+    assert sorted(a) == sorted(b)
+    for control in a:
+        np.testing.assert_allclose(a[control], b[control], atol=tolerance)
+
+
+@pytest.fixture
+def charDirectory(tmp_path):
+    deltapose.setRestPose(str(tmp_path), makePose(0))
+    return str(tmp_path)
+
+
+def test_delta_pose_round_trip(charDirectory):
+    restPose = makePose(0)
+    poseData = dict(restPose, ctrl1=makePose(1)["ctrl1"], extra0=makePose(2, prefix="extra")["extra0"])
+    del poseData["ctrl3"]
+    posePath = os.path.join(charDirectory, "a.dpose")
+    meta = poseio.buildPoseMetadata(poseData, "HandA", created=1.0)
+    poseio.writePoseFile(posePath, poseData, meta)
+    with open(posePath, "rb") as fp:
+        data = fp.read()
+    assert deltapose.isDeltaPoseData(data)
+    assert deltapose.readDeltaHeader(data)["changedCount"] == 1
+    decoded = poseio.readPoseFile(posePath)
+    assertSamePose(decoded, poseData)
+    # controls left at rest come back exactly
+    assert decoded["ctrl0"] == restPose["ctrl0"]
+    assert poseio.readPoseMetadata(posePath) == meta
+
+
+def test_rest_pose_change_reencodes_delta_poses(charDirectory):
+    poseData = makePose(1)
+    posePath = os.path.join(charDirectory, "a.dpose")
+    poseio.writePoseFile(posePath, poseData)
+    meta = poseio.readPoseMetadata(posePath)
+    assert deltapose.setRestPose(charDirectory, makePose(3)) == [posePath]
+    assertSamePose(poseio.readPoseFile(posePath), poseData)
+    assert poseio.readPoseMetadata(posePath) == meta
+
+    with open(posePath, "rb") as fp:
+        data = fp.read()
+    with pytest.raises(ValueError, match="different rest pose"):
+        deltapose.decodeDeltaPose(data, *deltapose.readRestPose(charDirectory)[:2], restHash="0" * 40)
+
+
+@pytest.mark.parametrize("size", [deltapose.DELTA_HEADER.size - 1, -1])
+def test_delta_pose_truncated(charDirectory, size):
+    data = deltapose.encodeDeltaPoseFile(charDirectory, makePose(1))[:size]
+    with pytest.raises(ValueError, match="Truncated delta pose"):
+        deltapose.loadDeltaPose(data, charDirectory)
+
+
+def test_delta_pose_newer_version(charDirectory):
+    data = deltapose.encodeDeltaPoseFile(charDirectory, makePose(1))
+    data = data[:4] + struct.pack("<H", deltapose.DELTA_VERSION + 1) + data[6:]
+    with pytest.raises(ValueError, match="Unsupported delta pose version"):
+        deltapose.loadDeltaPose(data, charDirectory)
+
+
+def test_delta_pose_needs_a_rest_pose(tmp_path):
+    with pytest.raises(IOError):
+        poseio.writePoseFile(str(tmp_path / "a.dpose"), makePose(1))
+
+
+def test_delta_pose_rejects_shear(charDirectory):
+    poseData = makePose(1)
+    matrix = np.asarray(poseData["ctrl2"]).reshape(4, 4)
+    matrix[1, :3] += 0.5 * matrix[0, :3]
+    poseData["ctrl2"] = list(matrix.ravel())
+    with pytest.raises(ValueError, match="ctrl2"):
+        poseio.writePoseFile(os.path.join(charDirectory, "a.dpose"), poseData)
+    assert not os.path.exists(os.path.join(charDirectory, "a.dpose"))
+
+
+def test_delta_pose_keeps_negative_scale(charDirectory):
+    poseData = makePose(1)
+    poseData["ctrl0"] = list(np.asarray(poseData["ctrl0"]) * np.repeat([-1.0, 1.0, 1.0, 1.0], 4))
+    data = deltapose.encodeDeltaPoseFile(charDirectory, poseData)
+    assertSamePose(deltapose.loadDeltaPose(data, charDirectory), poseData)
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+from .. import mirror
+
+
+@pytest.mark.parametrize("name, mirrored", [
+    ("L_foot_ctrl", "R_foot_ctrl"),
+    ("R_foot_ctrl", "L_foot_ctrl"),
+    ("foot_ctrl_L", "foot_ctrl_R"),
+    ("arm_L_ctrl", "arm_R_ctrl"),
+    ("Left_arm_ctrl", "Right_arm_ctrl"),
+    ("armLeft_ctrl", "armRight_ctrl"),
+    ("left01", "right01"),
+    ("char:face:L_brow_ctrl", "char:face:R_brow_ctrl"),
+    ("|rig|char:L_hand_ctrl", "|rig|char:R_hand_ctrl"),
+    ("leftovers_ctrl", "leftovers_ctrl"),
+    ("cleft_ctrl", "cleft_ctrl"),
+    ("Leftover_ctrl", "Leftover_ctrl"),
+    ("spine_ctrl", "spine_ctrl"),
+])
+def test_mirrored_name(name, mirrored):
+    assert mirror.getMirroredName(name) == mirrored
+    assert mirror.getMirroredName(mirrored) == name
+
+
+def test_mirrored_pose_path():
+    assert mirror.getMirroredPosePath("/poses/left01.pose") == "/poses/right01.pose"
+    assert mirror.getMirroredPosePath("/poses/cleft.pose") == "/poses/cleft_mirror.pose"
+
+
+@pytest.mark.parametrize("convention", [mirror.ORIENTATION_CONVENTION, mirror.BEHAVIOR_CONVENTION])
+def test_mirror_twice_gives_back_the_pose(convention):
+    controls = ["L_arm_ctrl", "R_arm_ctrl", "spine_ctrl", "leftovers_ctrl", "foot_ctrl_L"]
+    matrices = np.random.default_rng(0).normal(size=(len(controls), 16))
+    poseData = {control: list(matrix) for control, matrix in zip(controls, matrices)}
+    mirrored = mirror.mirrorPoseData(poseData, convention=convention)
+    assert sorted(mirrored) == ["L_arm_ctrl", "R_arm_ctrl", "foot_ctrl_R", "leftovers_ctrl", "spine_ctrl"]
+    assert mirrored["R_arm_ctrl"] != poseData["L_arm_ctrl"]
+    assert mirror.mirrorPoseData(mirrored, convention=convention) == poseData
@@ -0,0 +1,56 @@
+import struct
+
+import numpy as np
+import pytest
+
+from .. import poseio
+
+
+def makePose(seed=0, count=4):
+    matrices = np.random.default_rng(seed).normal(size=(count, 16))
+    return {"char:ctrl{}".format(index): list(matrix) for index, matrix in enumerate(matrices)}
+
+
+def test_binary_pose_round_trip(tmp_path):
+    poseData = makePose()
+    meta = poseio.buildPoseMetadata(poseData, "HandA", created=1.0)
+    data = poseio.encodeBinaryPose(poseData, meta)
+    assert data.startswith(poseio.BINARY_MAGIC)
+    assert poseio.loadPoseBytes(data) == poseData
+    assert poseio.loadPoseMetadata(data) == meta
+
+    posePath = str(tmp_path / "HandA.bpose")
+    poseio.writePoseFile(posePath, poseData, meta)
+    assert poseio.readPoseFile(posePath) == poseData
+    assert dict(poseio.iterPoseFile(posePath)) == poseData
+    assert poseio.readPoseMetadata(posePath) == meta
+    controls, matrices = poseio.readPoseArrays(posePath, mmap=True)
+    assert dict(zip(controls, matrices.tolist())) == poseData
+
+
+def test_binary_pose_empty_round_trip():
+    assert poseio.loadPoseBytes(poseio.encodeBinaryPose({})) == {}
+
+
+@pytest.mark.parametrize("size", [poseio.BINARY_HEADER.size - 1, -1])
+def test_binary_pose_truncated(tmp_path, size):
+    data = poseio.encodeBinaryPose(makePose())[:size]
+    posePath = str(tmp_path / "a.bpose")
+    with open(posePath, "wb") as fp:
+        fp.write(data)
+    with pytest.raises(ValueError, match="Truncated"):
+        poseio.loadPoseBytes(data)
+    with pytest.raises(ValueError, match="Truncated"):
+        poseio.readPoseFile(posePath)
+
+
+def test_binary_pose_newer_version():
+    data = poseio.encodeBinaryPose(makePose())
+    data = data[:4] + struct.pack("<H", poseio.BINARY_VERSION + 1) + data[6:]
+    with pytest.raises(ValueError, match="Unsupported binary pose version"):
+        poseio.loadPoseBytes(data)
+
+
+def test_binary_pose_rejects_non_matrix_data():
+    with pytest.raises(ValueError):
+        poseio.encodeBinaryPose({"ctrl": [0.0] * 9})
@@ -0,0 +1,70 @@
+import os
+import struct
+
+import numpy as np
+import pytest
+
+from .. import posepack
+from .. import poseio
+
+
+def makePose(seed=0, count=3):
+    matrices = np.random.default_rng(seed).normal(size=(count, 16))
+    return {"ctrl{}".format(index): list(matrix) for index, matrix in enumerate(matrices)}
+
+
+@pytest.fixture
+def packPath(tmp_path):
+    """Pack of a json pose with a thumbnail and a binary pose without one"""
+    poseio.writePoseFile(str(tmp_path / "a.pose"), makePose(0))
+    (tmp_path / "a.png").write_bytes(b"png")
+    poseio.writePoseFile(str(tmp_path / "b.bpose"), makePose(1))
+    return posepack.packDirectory(str(tmp_path), removeSources=True)
+
+
+def test_pack_round_trip(tmp_path, packPath):
+    assert sorted(os.listdir(str(tmp_path))) == [os.path.basename(packPath)]
+    with posepack.PosePack(packPath) as pack:
+        assert sorted(pack.poseNames()) == ["a", "b"]
+        assert pack.readPoseData("a") == pytest.approx(makePose(0))
+        assert pack.readPoseData("b") == makePose(1)
+        assert pack.readThumbnail("a") == b"png"
+        assert pack.readThumbnail("b") == b""
+        assert pack.getPoseInformation("b")["objectCount"] == 3
+
+    outputDirectory = tmp_path / "unpacked"
+    outputDirectory.mkdir()
+    posepack.unpackDirectory(packPath, str(outputDirectory))
+    assert sorted(os.listdir(str(outputDirectory))) == ["a.png", "a.pose", "b.bpose"]
+    assert poseio.readPoseFile(str(outputDirectory / "b.bpose")) == makePose(1)
+
+
+def truncatePack(packPath, size):
+    with open(packPath, "rb") as fp:
+        data = fp.read()
+    with open(packPath, "wb") as fp:
+        fp.write(data[:size])
+
+
+@pytest.mark.parametrize("size", [posepack.PACK_HEADER.size - 1, posepack.PACK_HEADER.size + 1])
+def test_pack_truncated_index(packPath, size):
+    truncatePack(packPath, size)
+    with pytest.raises(ValueError, match="Truncated pose pack"):
+        posepack.PosePack(packPath)
+
+
+def test_pack_truncated_blob(packPath):
+    with posepack.PosePack(packPath) as pack:
+        entry = max(pack.entries.values(), key=lambda entry: entry["poseOffset"])
+    truncatePack(packPath, entry["poseOffset"] + entry["poseSize"] - 1)
+    with posepack.PosePack(packPath) as pack:
+        with pytest.raises(ValueError, match="Truncated pose pack"):
+            pack.readPoseBytes(entry["name"])
+
+
+def test_pack_newer_version(packPath):
+    with open(packPath, "r+b") as fp:
+        fp.seek(4)
+        fp.write(struct.pack("<H", posepack.PACK_VERSION + 1))
+    with pytest.raises(ValueError, match="Unsupported pose pack version"):
+        posepack.PosePack(packPath)
@@ -0,0 +1,113 @@
+import os
+
+import numpy as np
+import pytest
+
+from .. import config
+from .. import posepack
+from .. import poseio
+from .. import posestore
+
+
+def makePose(seed=0, count=3):
+    matrices = np.random.default_rng(seed).normal(size=(count, 16))
+    return {"ctrl{}".format(index): list(matrix) for index, matrix in enumerate(matrices)}
+
+
+@pytest.fixture
+def library(tmp_path, monkeypatch):
+    """Library root with one character folder, the default store inside it"""
+    monkeypatch.setattr(config, "POSE_STORE_DIR", str(tmp_path / "root" / ".posestore"))
+    charDirectory = tmp_path / "root" / "A" / "a"
+    charDirectory.mkdir(parents=True)
+    return str(tmp_path / "root"), str(charDirectory)
+
+
+def writePose(charDirectory, poseFile, poseData, thumbnail=None, created=None):
+    posePath = os.path.join(charDirectory, poseFile)
+    poseName = os.path.splitext(poseFile)[0]
+    poseio.writePoseFile(posePath, poseData, poseio.buildPoseMetadata(poseData, poseName, created=created))
+    if thumbnail is not None:
+        with open(os.path.splitext(posePath)[0] + ".png", "wb") as fp:
+            fp.write(thumbnail)
+    return posePath
+
+
+def test_dedupe_shares_payloads_and_keeps_pose_metadata(library):
+    rootDirectory, charDirectory = library
+    writePose(charDirectory, "HandA.pose", makePose(), b"png", created=1.0)
+    writePose(charDirectory, "FaceB.pose", makePose(), b"png", created=2.0)
+    report = posestore.dedupeLibrary(rootDirectory)
+    assert (report["poses"], report["uniquePoses"], report["uniqueThumbnails"]) == (2, 1, 1)
+    assert report["bytesReclaimed"] >= 0
+    assert sorted(os.listdir(charDirectory)) == ["FaceB.poseref", "HandA.poseref"]
+    for poseName, poseType, created in (("HandA", "Hand", 1.0), ("FaceB", "Face", 2.0)):
+        refPath = os.path.join(charDirectory, poseName + ".poseref")
+        assert poseio.readPoseFile(refPath) == pytest.approx(makePose())
+        meta = poseio.readPoseMetadata(refPath)
+        assert (meta["poseType"], meta["created"]) == (poseType, created)
+        assert os.path.isfile(posestore.resolveThumbnailRef(posestore.readPoseRef(refPath)))
+
+
+def test_dedupe_skips_a_name_saved_in_two_formats(library):
+    rootDirectory, charDirectory = library
+    writePose(charDirectory, "left.pose", makePose(0), b"png")
+    writePose(charDirectory, "left.bpose", makePose(1))
+    report = posestore.dedupeLibrary(rootDirectory)
+    assert report["poses"] == 0
+    assert len(report["skipped"]) == 2
+    assert sorted(os.listdir(charDirectory)) == ["left.bpose", "left.png", "left.pose"]
+
+
+def test_dedupe_keeps_an_existing_ref(library):
+    rootDirectory, charDirectory = library
+    writePose(charDirectory, "a.pose", makePose(0))
+    posestore.dedupeLibrary(rootDirectory)
+    refPath = os.path.join(charDirectory, "a.poseref")
+    with open(refPath, "rb") as fp:
+        refBytes = fp.read()
+    # a pose saved again under the name of a stored pose
+    posePath = writePose(charDirectory, "a.bpose", makePose(1))
+    report = posestore.dedupeLibrary(rootDirectory)
+    assert report["skipped"] == [posePath]
+    assert os.path.isfile(posePath)
+    with open(refPath, "rb") as fp:
+        assert fp.read() == refBytes
+
+
+def test_dedupe_dry_run_changes_nothing(library):
+    rootDirectory, charDirectory = library
+    writePose(charDirectory, "a.pose", makePose(), b"png")
+    writePose(charDirectory, "b.pose", makePose(), b"png")
+    report = posestore.dedupeLibrary(rootDirectory, dryRun=True)
+    assert (report["poses"], report["uniquePoses"]) == (2, 1)
+    assert sorted(os.listdir(charDirectory)) == ["a.png", "a.pose", "b.png", "b.pose"]
+    assert not os.path.exists(config.POSE_STORE_DIR)
+
+
+def test_garbage_collection_keeps_objects_of_packed_refs(library):
+    rootDirectory, charDirectory = library
+    writePose(charDirectory, "a.pose", makePose(0), b"png")
+    writePose(charDirectory, "b.pose", makePose(1))
+    posestore.dedupeLibrary(rootDirectory)
+    packPath = posepack.packDirectory(charDirectory, removeSources=True)
+    assert posestore.collectGarbage(rootDirectory) == 0
+    with posepack.PosePack(packPath) as pack:
+        assert pack.readPoseData("a") == pytest.approx(makePose(0))
+        assert pack.readPoseData("b") == pytest.approx(makePose(1))
+
+    # without a ref left the objects are freed
+    os.remove(packPath)
+    assert posestore.collectGarbage(rootDirectory) > 0
+    assert not any(filenames for _, _, filenames in os.walk(config.POSE_STORE_DIR))
+
+
+def test_custom_store_is_resolved_by_readers(library, tmp_path):
+    rootDirectory, charDirectory = library
+    storeDirectory = str(tmp_path / "store")
+    writePose(charDirectory, "a.pose", makePose(), b"png")
+    posestore.dedupeLibrary(rootDirectory, storeDirectory=storeDirectory)
+    refPath = os.path.join(charDirectory, "a.poseref")
+    assert poseio.readPoseFile(refPath) == pytest.approx(makePose())
+    assert posestore.resolvePoseRef(posestore.readPoseRef(refPath)).startswith(storeDirectory)
+    assert posestore.collectGarbage(rootDirectory, storeDirectory) == 0
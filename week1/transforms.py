@@ -0,0 +1,138 @@
+import numpy as np
+
+# Vectorised transform helpers working on stacks of Maya matrices.
+# Maya matrices are row major with row vectors: rows 0-2 hold the scaled axes and row 3 the translation,
+# so a flat 16 value matrix from mc.xform reshapes directly to (4, 4).
+# Quaternions are stored as (x, y, z, w) like om.MQuaternion.
+
+
+def asMatrixStack(matrices):
+    """Convert flat 16 value matrices, or (4, 4) matrices, to a float64 array of shape (N, 4, 4)"""
+    return np.asarray(matrices, dtype=np.float64).reshape(-1, 4, 4)
+
+
+def quaternionsFromRotations(rotations):
+    """
+    Convert rotation matrices to unit quaternions
+    Args:
+        rotations (np.ndarray): (N, 3, 3) orthonormal rotations in Maya row vector convention
+    Returns:
+        np.ndarray: (N, 4) quaternions (x, y, z, w) with w >= 0
+    """
+    # transpose to the column vector convention of the textbook formulas
+    m = np.swapaxes(rotations, 1, 2)
+    m00, m11, m22 = m[:, 0, 0], m[:, 1, 1], m[:, 2, 2]
+    trace = m00 + m11 + m22
+    # pick the largest of w, x, y, z as the pivot to stay numerically stable
+    candidates = np.stack([1.0 + trace, 1.0 + m00 - m11 - m22, 1.0 - m00 + m11 - m22, 1.0 - m00 - m11 + m22], axis=1)
+    pivot = np.argmax(candidates, axis=1)
+    root = np.sqrt(np.maximum(candidates[np.arange(len(m)), pivot], 1e-300))
+    half = 0.5 / root
+
+    quaternions = np.empty((len(m), 4))
+    w = pivot == 0
+    quaternions[w, 3] = 0.5 * root[w]
+    quaternions[w, 0] = (m[w, 2, 1] - m[w, 1, 2]) * half[w]
+    quaternions[w, 1] = (m[w, 0, 2] - m[w, 2, 0]) * half[w]
+    quaternions[w, 2] = (m[w, 1, 0] - m[w, 0, 1]) * half[w]
+    x = pivot == 1
+    quaternions[x, 0] = 0.5 * root[x]
+    quaternions[x, 3] = (m[x, 2, 1] - m[x, 1, 2]) * half[x]
+    quaternions[x, 1] = (m[x, 0, 1] + m[x, 1, 0]) * half[x]
+    quaternions[x, 2] = (m[x, 0, 2] + m[x, 2, 0]) * half[x]
+    y = pivot == 2
+    quaternions[y, 1] = 0.5 * root[y]
+    quaternions[y, 3] = (m[y, 0, 2] - m[y, 2, 0]) * half[y]
+    quaternions[y, 0] = (m[y, 0, 1] + m[y, 1, 0]) * half[y]
+    quaternions[y, 2] = (m[y, 1, 2] + m[y, 2, 1]) * half[y]
+    z = pivot == 3
+    quaternions[z, 2] = 0.5 * root[z]
+    quaternions[z, 3] = (m[z, 1, 0] - m[z, 0, 1]) * half[z]
+    quaternions[z, 0] = (m[z, 0, 2] + m[z, 2, 0]) * half[z]
+    quaternions[z, 1] = (m[z, 1, 2] + m[z, 2, 1]) * half[z]
+
+    quaternions *= np.where(quaternions[:, 3:] < 0.0, -1.0, 1.0)
+    return normalizeQuaternions(quaternions)
+
+
+def rotationsFromQuaternions(quaternions):
+    """
+    Convert quaternions to rotation matrices
+    Args:
+        quaternions (np.ndarray): (N, 4) quaternions (x, y, z, w), normalised on the fly
+    Returns:
+        np.ndarray: (N, 3, 3) rotations in Maya row vector convention
+    """
+    q = normalizeQuaternions(quaternions)
+    x, y, z, w = q[:, 0], q[:, 1], q[:, 2], q[:, 3]
+    m = np.empty((len(q), 3, 3))
+    m[:, 0, 0] = 1.0 - 2.0 * (y * y + z * z)
+    m[:, 0, 1] = 2.0 * (x * y - z * w)
+    m[:, 0, 2] = 2.0 * (x * z + y * w)
+    m[:, 1, 0] = 2.0 * (x * y + z * w)
+    m[:, 1, 1] = 1.0 - 2.0 * (x * x + z * z)
+    m[:, 1, 2] = 2.0 * (y * z - x * w)
+    m[:, 2, 0] = 2.0 * (x * z - y * w)
+    m[:, 2, 1] = 2.0 * (y * z + x * w)
+    m[:, 2, 2] = 1.0 - 2.0 * (x * x + y * y)
+    return np.swapaxes(m, 1, 2)
+
+
+def normalizeQuaternions(quaternions):
+    norms = np.linalg.norm(quaternions, axis=1, keepdims=True)
+    return quaternions / np.where(norms > 0.0, norms, 1.0)
+
+
+def multiplyQuaternions(a, b):
+    """Hamilton product a * b of two (N, 4) quaternion arrays"""
+    ax, ay, az, aw = a[:, 0], a[:, 1], a[:, 2], a[:, 3]
+    bx, by, bz, bw = b[:, 0], b[:, 1], b[:, 2], b[:, 3]
+    return np.stack([
+        aw * bx + ax * bw + ay * bz - az * by,
+        aw * by - ax * bz + ay * bw + az * bx,
+        aw * bz + ax * by - ay * bx + az * bw,
+        aw * bw - ax * bx - ay * by - az * bz
+    ], axis=1)
+
+
+def conjugateQuaternions(quaternions):
+    return quaternions * np.array([-1.0, -1.0, -1.0, 1.0])
+
+
+def decomposeMatrices(matrices):
+    """
+    Decompose matrices into translation, rotation and scale, shear is ignored
+    Args:
+        matrices (np.ndarray): (N, 16) or (N, 4, 4) Maya matrices
+    Returns:
+        tuple: translations (N, 3), quaternions (N, 4), scales (N, 3)
+    """
+    m = asMatrixStack(matrices)
+    translations = m[:, 3, :3].copy()
+    axes = m[:, :3, :3]
+    scales = np.linalg.norm(axes, axis=2)
+    # a negative determinant means a mirrored matrix, carry the flip in the x scale
+    flip = np.linalg.det(axes) < 0.0
+    scales[flip, 0] *= -1.0
+    safeScales = np.where(np.abs(scales) > 1e-12, scales, 1.0)
+    rotations = axes / safeScales[:, :, np.newaxis]
+    quaternions = quaternionsFromRotations(rotations)
+    return translations, quaternions, scales
+
+
+def composeMatrices(translations, quaternions, scales):
+    """
+    Build matrices from translation, rotation and scale, the inverse of decomposeMatrices
+    Args:
+        translations (np.ndarray): (N, 3)
+        quaternions (np.ndarray): (N, 4) quaternions (x, y, z, w)
+        scales (np.ndarray): (N, 3)
+    Returns:
+        np.ndarray: (N, 4, 4) Maya matrices
+    """
+    count = len(translations)
+    m = np.zeros((count, 4, 4))
+    m[:, :3, :3] = rotationsFromQuaternions(quaternions) * np.asarray(scales)[:, :, np.newaxis]
+    m[:, 3, :3] = translations
+    m[:, 3, 3] = 1.0
+    return m
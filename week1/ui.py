@@ -15,18 +15,51 @@ from PySide2.QtGui import QIcon
 
 #maya package
 import maya.cmds as mc
+import maya.utils
 from maya import OpenMayaUI as omui
 from shiboken2 import wrapInstance
 
 from . import widgets
 from . import utils
 from . import config
+from . import blend
+from . import layers
+from . import mirror
+from . import handlecache
+from . import controlindex
+from . import poseapply
 from . import lib
+from . import posepack
+from . import poseio
+from . import writer
+from . import posestore
+from . import catalog
+from . import scanner
+from . import watcher
+from . import searchindex
+from . import sortindex
+from . import similarity
 
 reload(widgets)
 reload(utils)
 reload(config)
+reload(blend)
+reload(layers)
+reload(mirror)
+reload(handlecache)
+reload(controlindex)
+reload(poseapply)
 reload(lib)
+reload(posepack)
+reload(poseio)
+reload(writer)
+reload(posestore)
+reload(catalog)
+reload(scanner)
+reload(watcher)
+reload(searchindex)
+reload(sortindex)
+reload(similarity)
 
 def getMayaMainWindow():
     mayaMainWindowPtr = omui.MQtUtil.mainWindow()
@@ -48,15 +81,35 @@ class PoseLibraryUI(QMainWindow):
         self.generalSettings = QSettings(self.nameCompany, self.nameProduct)
         self.userSettings = QSettings(settingsPath, QSettings.IniFormat)
         
-        self.charDict = utils.folder_structure_to_dictionary()
+        #persistent catalog of the library, only the directories changed since the last session are read,
+        #with a pool of threads so libraries on network shares are not scanned one file at a time
+        self.poseCatalog = catalog.PoseCatalog()
+        self.poseCatalog.refresh(parallelScanner=scanner.ParallelScanner())
+        self.charDict = self.poseCatalog.getCharacters()
+        #library wide search, built in the background the first time the user searches
+        self.searchIndex = searchindex.LibrarySearchIndex(self.poseCatalog.catalogPath)
         #favourite pose per character
         self.favouritePosesDict=defaultdict(list)
         #pose data per character
         self.masterPosesDataDict = {}
+        #pose names of the selected character in the order of every sorting option
+        self.poseSortIndex = sortindex.PoseSortIndex()
+        #pose similarity index per character directory, loaded the first time similar poses are asked for
+        self.similarityIndexes = {}
+        #(character, pose names) shown by the last similar poses query, None shows every pose
+        self.similarPoses = None
         #source pose data
         self.srcPoseData = {}
         #destination pose data
         self.dstPoseData = {}
+        #blend between the source and destination poses driven by the blend slider
+        self.blendSession = None
+        #poses are saved on a background thread, refresh the view once they are on disk
+        self.poseWriteQueue = writer.getWriteQueue()
+        self.poseWriteQueue.addListener(self.onPoseWritten)
+        #poses saved, deleted or renamed by anyone patch the view in place
+        self.libraryWatcher = watcher.LibraryWatcher(self.onLibraryChanged)
+        self.libraryWatcher.start()
         
     def initSize(self):
         self.charSelectionWidgetWidth = 150
@@ -316,6 +369,8 @@ class PoseLibraryUI(QMainWindow):
     def initUIFunctions(self):
         #character tree connection
         self.charSelectionTreeWidget.itemClicked.connect(self.updatePoseView)
+        self.charSelectionTreeWidget.setSearchIndex(self.searchIndex)
+        self.charSelectionTreeWidget.poseActivated.connect(self.showSearchedPose)
         #self.charSelectionTreeWidget.itemChanged.connect(self.updatePoseView)
         
         #button connections
@@ -330,9 +385,10 @@ class PoseLibraryUI(QMainWindow):
         self.poseIconsListWidget.itemDoubleClicked.connect(self.applyPose)
         self.poseIconsListWidget.customContextMenuRequested.connect(self.showPoseView)
         #sorting connection
-        self.sortOptionsComboBox.currentIndexChanged.connect(self.updatePoseView)
+        self.sortOptionsComboBox.currentIndexChanged.connect(self.reorderPoseView)
         #blend connection
         self.interactiveBlendSlider.valueChanged.connect(self.poseBlend)
+        self.interactiveBlendSlider.sliderReleased.connect(self.reportBlendLatency)
         #filter connection
         self.favouritesToolButton.clicked.connect(self.filterPoseView)
         self.bodyPoseToolButton.clicked.connect(self.filterPoseView)
@@ -361,28 +417,12 @@ class PoseLibraryUI(QMainWindow):
     def updatePoseView(self, *args):
         selectedChar = self.charSelectionTreeWidget.getSelectedText()
         charDirectory = self.getSelectedCharDirectory()
-        validPoseFiles = utils.getValidPoseFiles(os.listdir(charDirectory))
         selectedPoseName = self.getSelectedPoseName()
-        posesDataDict = {}
-
-        #get pose information
-        for file in validPoseFiles:
-            fullPosePath = os.path.join(charDirectory, file)
-            poseFileInfo = utils.getPoseFileInformation(fullPosePath)
-            poseName = poseFileInfo.get("poseName")
-            
-            if poseName in self.favouritePosesDict.get(selectedChar, []):
-                poseFileInfo["favourite"] = True
-            else:
-                poseFileInfo["favourite"] = False
-            
-            #这里没看懂
-            poseFileInfo["objectCount"] = len(lib.readPoseData(fullPosePath).keys())
-            
-            posesDataDict[poseName] = poseFileInfo
+        posesDataDict = self.readPosesDataDict(selectedChar, charDirectory)
         
         #collect masterPoseDataDict
         self.masterPosesDataDict[selectedChar] = posesDataDict
+        self.poseSortIndex = sortindex.PoseSortIndex(posesDataDict)
         
         if self.listViewToolButton.isChecked():
             self.iconViewFrame.hide()
@@ -396,6 +436,127 @@ class PoseLibraryUI(QMainWindow):
         self.filterPoseView()
         # self.populateListView(poseDataDict)
         
+    def readPosesDataDict(self, selectedChar, charDirectory):
+        #pose information comes from the catalog, only files changed on disk are read again
+        self.poseCatalog.refreshCharacter(charDirectory)
+        posesDataDict = self.poseCatalog.getPoses(charDirectory)
+        
+        packPoseNames = []
+        for poseName, poseFileInfo in posesDataDict.items():
+            poseFileInfo["favourite"] = poseName in self.favouritePosesDict.get(selectedChar, [])
+            if poseFileInfo.get("packFile"):
+                packPoseNames.append(poseName)
+        
+        #packed poses keep their thumbnail inside the pack
+        if packPoseNames:
+            with posepack.PosePack(posesDataDict[packPoseNames[0]]["packFile"]) as pack:
+                for poseName in packPoseNames:
+                    posesDataDict[poseName]["imgData"] = pack.readThumbnail(poseName)
+        return posesDataDict
+    
+    def patchPoseView(self, changedFiles=()):
+        """
+        update the pose view in place after poses were saved, deleted or renamed: only the rows and icons
+        of the poses that changed are added, removed or refreshed
+        :param changedFiles: file names that changed, poses whose thumbnail changed are refreshed too
+        """
+        selectedChar = self.charSelectionTreeWidget.getSelectedText()
+        charDirectory = self.getSelectedCharDirectory()
+        posesDataDict = self.masterPosesDataDict.get(selectedChar)
+        if not charDirectory or posesDataDict is None:
+            return
+        newPosesDataDict = self.readPosesDataDict(selectedChar, charDirectory)
+        touchedPoses = set(os.path.splitext(name)[0] for name in changedFiles)
+        removedPoses = [poseName for poseName in posesDataDict if poseName not in newPosesDataDict]
+        addedPoses = [poseName for poseName in newPosesDataDict if poseName not in posesDataDict]
+        updatedPoses = [poseName for poseName in newPosesDataDict if poseName in posesDataDict and
+                        (poseName in touchedPoses or newPosesDataDict[poseName] != posesDataDict[poseName])]
+        if not (removedPoses or addedPoses or updatedPoses):
+            return
+        self.searchIndex.invalidate()
+        
+        if charDirectory in self.similarityIndexes:
+            similarity.refreshSimilarityIndex(self.similarityIndexes[charDirectory], charDirectory)
+        for poseName in removedPoses:
+            del posesDataDict[poseName]
+            self.poseSortIndex.remove(poseName)
+        for poseName in addedPoses + updatedPoses:
+            posesDataDict[poseName] = newPosesDataDict[poseName]
+            self.poseSortIndex.add(poseName, posesDataDict[poseName])
+        
+        if self.listViewToolButton.isChecked():
+            self.poseListTableWidget.setSortingEnabled(False)
+            for row in reversed(range(self.poseListTableWidget.rowCount())):
+                poseName = self.poseListTableWidget.item(row, 0).text()
+                if poseName in removedPoses:
+                    self.poseListTableWidget.removeRow(row)
+                elif poseName in updatedPoses:
+                    self.setListViewRow(row, poseName, posesDataDict[poseName])
+            for poseName in addedPoses:
+                row = self.poseListTableWidget.rowCount()
+                self.poseListTableWidget.insertRow(row)
+                self.setListViewRow(row, poseName, posesDataDict[poseName])
+            self.poseListTableWidget.setSortingEnabled(True)
+        elif self.iconViewToolButton.isChecked():
+            for row in reversed(range(self.poseIconsListWidget.count())):
+                item = self.poseIconsListWidget.item(row)
+                widget = self.poseIconsListWidget.itemWidget(item)
+                if widget.poseName in removedPoses:
+                    self.poseIconsListWidget.takeItem(row)
+                elif widget.poseName in updatedPoses:
+                    widget.setPoseData(widget.poseName, posesDataDict[widget.poseName])
+            #insert in sorted order so every pose before the new one is already in the view
+            option = self.sortOptionsComboBox.currentIndex()
+            getPosition = lambda poseName: self.poseSortIndex.getPosition(option, poseName)
+            for poseName in sorted(addedPoses, key=getPosition):
+                self.addIconViewItem(poseName, posesDataDict[poseName], row=getPosition(poseName))
+            #a pose saved again moves when sorting by date
+            if updatedPoses:
+                self.reorderPoseView()
+        
+        self.filterPoseView()
+    
+    def showSearchedPose(self, category, character, poseName):
+        """select the character of a library search result and the pose in the pose view"""
+        self.charSelectionTreeWidget.setSelectedItem(character, parentText=category)
+        self.updatePoseView()
+        self.selectPose(poseName)
+    
+    def selectPose(self, poseName):
+        if self.listViewToolButton.isChecked():
+            for row in range(self.poseListTableWidget.rowCount()):
+                if self.poseListTableWidget.item(row, 0).text() == poseName:
+                    self.poseListTableWidget.selectRow(row)
+                    self.poseListTableWidget.scrollToItem(self.poseListTableWidget.item(row, 0))
+                    return
+        elif self.iconViewToolButton.isChecked():
+            for row in range(self.poseIconsListWidget.count()):
+                item = self.poseIconsListWidget.item(row)
+                if self.poseIconsListWidget.itemWidget(item).poseName == poseName:
+                    item.setSelected(True)
+                    self.poseIconsListWidget.scrollToItem(item)
+                    return
+    
+    def onLibraryChanged(self, changes, structureChanged):
+        #called from the watcher thread, defer the UI work to the main thread
+        maya.utils.executeDeferred(self.applyLibraryChanges, changes, structureChanged)
+    
+    def applyLibraryChanges(self, changes, structureChanged):
+        if structureChanged:
+            self.poseCatalog.refresh(parallelScanner=scanner.ParallelScanner())
+            charDict = self.poseCatalog.getCharacters()
+            if charDict != self.charDict:
+                self.charDict = charDict
+                self.charSelectionTreeWidget.setData(charDict)
+        selectedDirectory = self.getSelectedCharDirectory()
+        for charDirectory, changedFiles in changes.items():
+            if selectedDirectory and os.path.normpath(charDirectory) == os.path.normpath(selectedDirectory):
+                self.patchPoseView(changedFiles)
+            elif os.path.isdir(charDirectory):
+                #keep the catalog warm for the next time the character is selected
+                self.poseCatalog.refreshCharacter(charDirectory)
+        self.searchIndex.invalidate()
+    
     def filterPoseView(self):
         selectedChar = self.charSelectionTreeWidget.getSelectedText()
         
@@ -406,6 +567,7 @@ class PoseLibraryUI(QMainWindow):
         
         favouritePoses = self.favouritePosesDict.get(selectedChar, [])
         posesDataDict = self.masterPosesDataDict.get(selectedChar, {})
+        similarPoseNames = self.similarPoses[1] if self.similarPoses and self.similarPoses[0] == selectedChar else None
         
         #update icon view
         if self.iconViewToolButton.isChecked():
@@ -426,6 +588,8 @@ class PoseLibraryUI(QMainWindow):
                     showItem = False
                 if faceChecked and poseType != "Face":
                     showItem = False
+                if similarPoseNames is not None and widget.poseName not in similarPoseNames:
+                    showItem = False
                 
                 item.setHidden(not showItem)
         
@@ -447,6 +611,8 @@ class PoseLibraryUI(QMainWindow):
                     showRow = False
                 if faceChecked and poseType != "Face":
                     showRow = False
+                if similarPoseNames is not None and item.text() not in similarPoseNames:
+                    showRow = False
                 
                 if showRow:
                     self.poseListTableWidget.showRow(index)
@@ -462,18 +628,76 @@ class PoseLibraryUI(QMainWindow):
             renameAction = menu.addAction("Rename Pose")
             menu.addSeparator()
             deleteAction = menu.addAction("Delete Pose")
+            menu.addSeparator()
+            mirrorAction = menu.addAction("Apply Mirrored Pose")
+            menu.addSeparator()
+            similarAction = menu.addAction("Find Similar Poses")
+            sceneSimilarAction = menu.addAction("Find Poses Like Scene")
+            showAllAction = menu.addAction("Show All Poses") if self.similarPoses else None
             action = menu.exec_(self.poseIconsListWidget.viewport().mapToGlobal(position))
-            if action == deleteAction:
+            if action is None:
+                return
+            if action == mirrorAction:
+                self.applyMirroredPose(self.poseIconsListWidget.itemWidget(item).poseName)
+            elif action == similarAction:
+                self.showSimilarPoses(self.poseIconsListWidget.itemWidget(item).poseName)
+            elif action == sceneSimilarAction:
+                self.showSimilarPoses()
+            elif action == showAllAction:
+                self.similarPoses = None
+                self.filterPoseView()
+            elif action == deleteAction:
                 self.deletePose(item)
             elif action == renameAction:
                 self.renamePose(item)
             elif action == revealAction:
                 self.revealPose(item)
                 
+    def getSimilarityIndex(self, charDirectory):
+        index = self.similarityIndexes.get(charDirectory)
+        if index is None:
+            index = similarity.loadSimilarityIndex(charDirectory)
+            self.similarityIndexes[charDirectory] = index
+        else:
+            #poses changed by other artists while the character was not selected
+            similarity.refreshSimilarityIndex(index, charDirectory)
+        return index
+    
+    def showSimilarPoses(self, poseName=None):
+        """
+        only show the poses closest to a pose of the library, or to the current pose of the selected rig
+        :param poseName: pose to compare with, None for the scene pose
+        """
+        selectedChar = self.charSelectionTreeWidget.getSelectedText()
+        charDirectory = self.getSelectedCharDirectory()
+        if not charDirectory:
+            return
+        index = self.getSimilarityIndex(charDirectory)
+        if poseName:
+            if poseName not in index:
+                mc.warning("'{}' could not be indexed".format(poseName))
+                return
+            similarPoses = index.queryPose(poseName)
+            poseNames = set([poseName])
+        else:
+            controls = lib.getControls()
+            if not controls:
+                return
+            similarPoses = index.query(lib.getPoseData(controls))
+            poseNames = set()
+        for similarPoseName, distance in similarPoses:
+            poseNames.add(similarPoseName)
+            print("{}: {:.4f}".format(similarPoseName, distance))
+        self.similarPoses = (selectedChar, poseNames)
+        self.filterPoseView()
+    
     def deletePose(self, item):
         widget = self.poseIconsListWidget.itemWidget(item)
         poseData = widget.poseData
         poseName = widget.poseName
+        if poseData.get("packFile"):
+            mc.warning("'{}' is stored in a pose pack, unpack the character to delete it".format(poseName))
+            return
         # confirmation dialing
         reply = QMessageBox.question(
             self,
@@ -487,15 +711,19 @@ class PoseLibraryUI(QMainWindow):
             imgPath = poseData.get("imgFile")
             if filePath:
                 utils.deleteFile(filePath)
-            if imgPath:
+            #shared thumbnails are removed by posestore.collectGarbage
+            if imgPath and not posestore.isStoreObject(imgPath):
                 utils.deleteFile(imgPath)
         
-        self.updatePoseView()
+        self.patchPoseView()
         
     def renamePose(self, item):
         widget = self.poseIconsListWidget.itemWidget(item)
         poseData = widget.poseData
         poseName = widget.poseName
+        if poseData.get("packFile"):
+            mc.warning("'{}' is stored in a pose pack, unpack the character to rename it".format(poseName))
+            return
         #get all the poses
         allPosesName = list(self.masterPosesDataDict.get(self.charSelectionTreeWidget.getSelectedText()).keys())
         newName, ok = QInputDialog.getText(self, "Rename Item", "Enter new name", text="")
@@ -509,7 +737,7 @@ class PoseLibraryUI(QMainWindow):
             imgPath = poseData.get("imgFile")
             if filePath:
                 utils.renameFile(filePath, newName)
-            if imgPath:
+            if imgPath and not posestore.isStoreObject(imgPath):
                 utils.renameFile(imgPath, newName)
             widget.poseLabel.setText(newName)
             #update favourite poses
@@ -518,7 +746,7 @@ class PoseLibraryUI(QMainWindow):
                 # Find the index of the pose to replace
                 index = favouritePoses.index(poseName)
                 favouritePoses[index] = newName
-        self.updatePoseView()
+        self.patchPoseView()
     
     def revealPose(self, item):
         widget = self.poseIconsListWidget.itemWidget(item)
@@ -534,29 +762,7 @@ class PoseLibraryUI(QMainWindow):
         self.poseListTableWidget.setSortingEnabled(False)
         for poseName, poseInfo in posesDataDict.items():
             rowPosition = allPoses.index(poseName)
-            #fill pose name
-            poseNameItem = QTableWidgetItem(poseName)
-            self.poseListTableWidget.setItem(rowPosition, 0, poseNameItem)
-            
-            #fill pose type
-            poseTypeItem = QTableWidgetItem(poseInfo["poseType"])
-            poseTypeItem.setTextAlignment(Qt.AlignCenter)
-            self.poseListTableWidget.setItem(rowPosition, 1, poseTypeItem)
-            
-            #fill pose object count
-            objectCountItem = QTableWidgetItem(str(poseInfo["objectCount"]))
-            objectCountItem.setTextAlignment(Qt.AlignCenter)
-            self.poseListTableWidget.setItem(rowPosition, 2, objectCountItem)
-            
-            #fill file size
-            sizeItem = QTableWidgetItem(poseInfo["size"])
-            sizeItem.setTextAlignment(Qt.AlignCenter)
-            self.poseListTableWidget.setItem(rowPosition, 3, sizeItem)
-            
-            #fill modified time
-            dateModifiedItem = QTableWidgetItem(poseInfo["mDate"])
-            dateModifiedItem.setTextAlignment(Qt.AlignCenter)
-            self.poseListTableWidget.setItem(rowPosition, 4, dateModifiedItem)
+            self.setListViewRow(rowPosition, poseName, poseInfo)
             # set current selection
             if selectedPoseName and selectedPoseName == poseName:
                 self.poseListTableWidget.selectRow(rowPosition)
@@ -568,19 +774,39 @@ class PoseLibraryUI(QMainWindow):
         #resize contents to fit horizontal header
         self.poseListTableWidget.horizontalHeader().resizeSections(QHeaderView.ResizeToContents)
     
+    def setListViewRow(self, rowPosition, poseName, poseInfo):
+        #fill pose name
+        poseNameItem = QTableWidgetItem(poseName)
+        self.poseListTableWidget.setItem(rowPosition, 0, poseNameItem)
+        
+        #fill pose type
+        poseTypeItem = QTableWidgetItem(poseInfo["poseType"])
+        poseTypeItem.setTextAlignment(Qt.AlignCenter)
+        self.poseListTableWidget.setItem(rowPosition, 1, poseTypeItem)
+        
+        #fill pose object count
+        objectCountItem = QTableWidgetItem(str(poseInfo["objectCount"]))
+        objectCountItem.setTextAlignment(Qt.AlignCenter)
+        self.poseListTableWidget.setItem(rowPosition, 2, objectCountItem)
+        
+        #fill file size
+        sizeItem = QTableWidgetItem(poseInfo["size"])
+        sizeItem.setTextAlignment(Qt.AlignCenter)
+        self.poseListTableWidget.setItem(rowPosition, 3, sizeItem)
+        
+        #fill modified time
+        dateModifiedItem = widgets.TimestampTableWidgetItem(poseInfo["mDate"], poseInfo.get("mTime"))
+        dateModifiedItem.setTextAlignment(Qt.AlignCenter)
+        self.poseListTableWidget.setItem(rowPosition, 4, dateModifiedItem)
+    
     def populateIconView(self, posesDataDict, selectedPoseName=None):
         #hide the widget so it avoids flicker
         self.poseIconsListWidget.hide()
         self.poseIconsListWidget.clear()
         
-        sortedPosesDataDict = self.sortPoses(posesDataDict)
-        for poseName, poseInfo in sortedPosesDataDict.items():
-            item = QListWidgetItem(self.poseIconsListWidget)
-            customWidget= widgets.IconViewListWidgetItem(poseName, poseInfo)
-            customWidget.favouriteChecked.connect(self.updateFavouritePosesDict)
-            item.setSizeHint(self.poseIconSize)
-            self.poseIconsListWidget.addItem(item)
-            self.poseIconsListWidget.setItemWidget(item, customWidget)
+        for poseName in self.poseSortIndex.getOrder(self.sortOptionsComboBox.currentIndex()):
+            poseInfo = posesDataDict[poseName]
+            item = self.addIconViewItem(poseName, poseInfo)
             #set current selection
             if selectedPoseName and selectedPoseName ==poseName:
                 item.setSelected(True)
@@ -588,53 +814,58 @@ class PoseLibraryUI(QMainWindow):
             
         self.poseIconsListWidget.show()
     
-    def sortPoses(self, posesDataDict):
-        idx = self.sortOptionsComboBox.currentIndex()
-        #Reorder dictionary based on keys in descending alphabetical order
-        if idx == 0:
-            # A -> Z
-            sortedPosesDataDict = {k: posesDataDict[k] for k in sorted(posesDataDict.keys(), reverse = False)}
-        elif idx == 1:
-            # Z -> A
-            sortedPosesDataDict = {k: posesDataDict[k] for k in sorted(posesDataDict.keys(), reverse = True)}
-        elif idx == 2:
-            #cDate ascending
-            sortedPosesDataDict = {
-                k: v for k, v in sorted(posesDataDict.items(), key=lambda item: item[1].get("cDate", ""), reverse = False)
-            }
-        elif idx == 3:
-            #cDate descending
-            sortedPosesDataDict = {
-                k: v for k, v in sorted(posesDataDict.items(), key = lambda item: item[1].get("cDate", ""), reverse = True)
-            }
-        elif idx ==4:
-            #mDate ascending
-            sortedPosesDataDict = {
-                k: v for k, v in sorted(posesDataDict.items(), key=lambda item: item[1].get("mDate", ""), reverse=False)
-            }
-        elif idx == 5:
-            sortedPosesDataDict = {
-                k: v for k, v in sorted(posesDataDict.items(), key=lambda item: item[1].get("mDate", ""), reverse=True)
-            }
+    def addIconViewItem(self, poseName, poseInfo, row=None):
+        item = widgets.PoseListWidgetItem()
+        customWidget= widgets.IconViewListWidgetItem(poseName, poseInfo)
+        customWidget.favouriteChecked.connect(self.updateFavouritePosesDict)
+        item.setSizeHint(self.poseIconSize)
+        if row is None:
+            self.poseIconsListWidget.addItem(item)
         else:
-            sortedPosesDataDict = posesDataDict
-        return sortedPosesDataDict
+            self.poseIconsListWidget.insertItem(row, item)
+        self.poseIconsListWidget.setItemWidget(item, customWidget)
+        return item
+    
+    def reorderPoseView(self, *args):
+        """
+        apply the sort option to the icon view: the items are moved to the rows the pose sort index
+        already keeps, nothing is read or rebuilt
+        """
+        if not self.iconViewToolButton.isChecked():
+            return
+        option = self.sortOptionsComboBox.currentIndex()
+        for row in range(self.poseIconsListWidget.count()):
+            item = self.poseIconsListWidget.item(row)
+            poseName = self.poseIconsListWidget.itemWidget(item).poseName
+            if poseName in self.poseSortIndex:
+                item.sortRank = self.poseSortIndex.getPosition(option, poseName)
+        self.poseIconsListWidget.sortItems(Qt.AscendingOrder)
     
     def onPoseSelectionChanged(self):
         poseName = self.getSelectedPoseName()
         if not poseName:
             return
         self.poseNameLineEdit.setText(poseName)
-        filepath = os.path.join(self.getSelectedCharDirectory(), "{}.pose".format(poseName))
-        self.dstPoseData = lib.readPoseData(filepath)
-        for control in lib.getControls():
-            self.srcPoseData[control] = mc.xform(control, query=True, matrix=True, objectSpace=True)
+        self.dstPoseData = self.readPoseData(poseName)
+        self.srcPoseData.update(lib.getControlMatrices(lib.getControls()))
         
+        #decompose both poses and resolve the controls once, the slider ticks only interpolate
+        self.blendSession = None
+        if self.srcPoseData and self.dstPoseData:
+            self.blendSession = lib.BlendSession(self.srcPoseData, self.dstPoseData)
         self.interactiveBlendSlider.setValue(0.0)
     
     def poseBlend(self, value):
-        if self.srcPoseData and self.dstPoseData:
-            lib.poseBlend(self.srcPoseData, self.dstPoseData, value)
+        if self.blendSession:
+            self.blendSession.apply(value / 100.0)
+    
+    def reportBlendLatency(self):
+        if self.blendSession:
+            print("Blend of {} controls, {ticks} ticks: median {median:.2f} ms, worst {worst:.2f} ms "
+                  "(interpolate {interpolate:.2f} ms, write {write:.2f} ms)".format(
+                      len(self.blendSession), **self.blendSession.getLatencyStats()))
+            print("Control handles: {handles} cached, {hits} hits, {misses} misses ({hitRate:.1%}), "
+                  "{invalidations} invalidated".format(**handlecache.getHandleCache().getStats()))
     
     def getSelectedPoseName(self):
         if self.listViewFrame.isVisible():
@@ -646,6 +877,26 @@ class PoseLibraryUI(QMainWindow):
             if selectedPoseItem:
                 return self.poseIconsListWidget.itemWidget(selectedPoseItem[0]).poseLabel.text()
         return ""
+    
+    def getPoseFilePath(self, poseName):
+        """resolve the pose file of a pose name, poses can be saved with any of the valid file extensions"""
+        selectedChar = self.charSelectionTreeWidget.getSelectedText()
+        poseInfo = self.masterPosesDataDict.get(selectedChar, {}).get(poseName)
+        if poseInfo:
+            return poseInfo["fullPath"]
+        return os.path.join(self.getSelectedCharDirectory(), "{}.pose".format(poseName))
+    
+    def readPoseData(self, poseName, stream=False):
+        """read a pose of the selected character, from its own file or from the character pose pack
+        :param stream: return a (control, matrix) stream instead of a dictionary for loose pose files
+        """
+        selectedChar = self.charSelectionTreeWidget.getSelectedText()
+        poseInfo = self.masterPosesDataDict.get(selectedChar, {}).get(poseName, {})
+        if poseInfo.get("packFile"):
+            return posepack.readPackedPose(poseInfo["packFile"], poseName)
+        if stream:
+            return lib.iterPoseData(self.getPoseFilePath(poseName))
+        return lib.readPoseData(self.getPoseFilePath(poseName))
         
     def createOverwritePose(self):
         if not self.getSelectedCharDirectory():
@@ -667,9 +918,15 @@ class PoseLibraryUI(QMainWindow):
         if not poseName:
             mc.warning("Please provide a name for the pose!")
             return
-        filepath = os.path.join(self.getSelectedCharDirectory(), "{}.pose".format(poseName))
-        lib.writePoseData(filepath, poseData)
-        print("Save '{}' pose data to {} with {} controls".format(poseName, filepath, len(poseData)))
+        #overwrite an existing pose in its own format, new poses use the configured storage
+        poseInfo = self.masterPosesDataDict.get(self.charSelectionTreeWidget.getSelectedText(), {}).get(poseName, {})
+        if poseInfo and not poseInfo.get("packFile"):
+            filepath = poseInfo["fullPath"]
+        else:
+            filepath = os.path.join(self.getSelectedCharDirectory(), poseName + config.POSE_SAVE_EXTENSION)
+        namespace = lib.getNamespace(controls[0].split("|")[-1]) or ""
+        lib.writePoseDataAsync(filepath, poseData, namespace=namespace)
+        print("Saving '{}' pose data to {} with {} controls".format(poseName, filepath, len(poseData)))
         
         if self.createThumbnailCheckBox.isChecked():
             lib.createThumbnailFromCurrentView(poseName, self.getSelectedCharDirectory(), fileType="png")
@@ -679,16 +936,27 @@ class PoseLibraryUI(QMainWindow):
         # if os.path.exists(filepath):
         #     # Add confirmation dialog here
         #     pass
-
-        self.updatePoseView()
+        #the view is refreshed by onPoseWritten once the pose is committed
+        
+    def onPoseWritten(self, filepath, error):
+        #called from the writer thread, defer the UI work to the main thread
+        if error:
+            maya.utils.executeDeferred(mc.warning, "Error writing pose file {}: {}".format(filepath, error))
+        else:
+            maya.utils.executeDeferred(self.patchPoseView, [os.path.basename(filepath)])
         
     def applyPose(self):
         poseName = self.poseNameLineEdit.text()
         if not poseName:
             return
-        filepath = os.path.join(self.getSelectedCharDirectory(), "{}.pose".format(poseName))
-        poseData = lib.readPoseData(filepath)
-        
+        #stream the pose so controls are posed while the file is read
+        self.applyPoseData(self.readPoseData(poseName, stream=True))
+    
+    def applyMirroredPose(self, poseName):
+        """apply the mirrored pose, left controls drive the right side and the other way around"""
+        self.applyPoseData(mirror.mirrorPoseData(self.readPoseData(poseName)))
+    
+    def applyPoseData(self, poseData):
         if self.chooseSelectedControlsRadioBtn.isChecked():
             controls = lib.getControls(selection=True)
         else:
@@ -801,6 +1069,12 @@ class PoseLibraryUI(QMainWindow):
     def closeEvent(self, event):
         super(self.__class__, self).closeEvent(event)
         self.writeSettings()
+        self.poseWriteQueue.removeListener(self.onPoseWritten)
+        self.poseWriteQueue.flush(timeout=10.0)
+        self.libraryWatcher.stop()
+        self.poseCatalog.close()
+        handlecache.releaseHandleCache()
+        controlindex.releaseControlIndex()
         
 def openUI():
     global win
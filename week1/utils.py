@@ -1,6 +1,7 @@
 import os
 import math
 import subprocess
+import tempfile
 import time
 from datetime import datetime
 import functools
@@ -18,6 +19,9 @@ def folder_structure_to_dictionary(base_dir = config.PROJECT_ROOT):
     folder_dict = {}
     sub_dirnames = os.listdir(base_dir)
     for sub_dirname in sub_dirnames:
+        #hidden folders hold library data like the pose store, they are not categories
+        if sub_dirname.startswith("."):
+            continue
         directory = os.path.join(base_dir, sub_dirname)
         folder_dict[sub_dirname] = os.listdir(directory)
     return folder_dict
@@ -74,11 +78,49 @@ def getPoseFileInformation(poseFilePath):
         'imgFile': getIconImage(poseFilePath),
         'cDate': formattedCreatedTime,
         'mDate': formattedModifiedTime,
+        'cTime': createdTime,
+        'mTime': modifiedTime,
         'size': fileSizeKb
     }
     
     return selectedCharPoseInfo
 
+@functools.lru_cache(maxsize=None)
+def getUmask():
+    """umask of the process, read once: reading it means setting it, which is not thread safe"""
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+def getNewFileMode(filepath):
+    """mode for the new version of a file, the mode of the existing file or the default mode of a new file"""
+    try:
+        return os.stat(filepath).st_mode & 0o7777
+    except OSError:
+        return 0o666 & ~getUmask()
+
+def atomicWriteFile(filepath, data):
+    """
+    write bytes to a file through a temporary file in the same directory and a rename,
+    readers either see the previous file or the complete new one, never a truncated file
+    :param filepath: Path of the file to write
+    :param data: bytes to write
+    """
+    directory = os.path.dirname(os.path.abspath(filepath))
+    fd, tempPath = tempfile.mkstemp(prefix=".{}.".format(os.path.basename(filepath)), suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as fp:
+            fp.write(data)
+            fp.flush()
+            os.fsync(fp.fileno())
+        # mkstemp creates the file readable by its owner only, keep the library readable by everyone
+        os.chmod(tempPath, getNewFileMode(filepath))
+        os.replace(tempPath, filepath)
+    except BaseException:
+        if os.path.exists(tempPath):
+            os.remove(tempPath)
+        raise
+
 def deleteFile(filepath):
     if os.path.exists(filepath):
         os.remove(filepath)
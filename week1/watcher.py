@@ -0,0 +1,285 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import threading
+import time
+
+from . import config
+
+# Watches the library for poses saved, deleted or renamed by this session or by other artists.
+# The library is three levels deep: root / category / character / pose files, so only the root,
+# the categories and the characters are watched. Linux uses inotify through ctypes, other platforms
+# poll the directory mtimes. Names starting with a dot (temporary files of atomicWriteFile, sidecars,
+# the catalog) are ignored.
+
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF \
+             | IN_MOVE_SELF | IN_ONLYDIR
+INOTIFY_EVENT = struct.Struct("iIII")
+
+ROOT_DEPTH = 0
+CATEGORY_DEPTH = 1
+CHARACTER_DEPTH = 2
+
+
+def isHidden(name):
+    return name.startswith(".")
+
+
+def listSubdirectories(path):
+    try:
+        with os.scandir(path) as entries:
+            return [entry.path for entry in entries if not isHidden(entry.name) and entry.is_dir()]
+    except OSError:
+        return []
+
+
+class InotifyBackend(object):
+    """
+    inotify watches on the library directories. read returns (directory, name, depth, isDir) events,
+    a None directory means the kernel queue overflowed and the whole library must be rescanned
+    """
+    def __init__(self, rootDirectory):
+        libcName = ctypes.util.find_library("c")
+        if not libcName:
+            raise OSError("libc not found")
+        self.libc = ctypes.CDLL(libcName, use_errno=True)
+        if not hasattr(self.libc, "inotify_init1"):
+            raise OSError("inotify is not available")
+        self.libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        # watch descriptor -> (path, depth)
+        self.watches = {}
+        self.addTree(rootDirectory, ROOT_DEPTH)
+
+    def addWatch(self, path, depth):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            # the directory may already be gone again, the parent event covers it
+            return False
+        self.watches[wd] = (path, depth)
+        return True
+
+    def addTree(self, path, depth):
+        if not self.addWatch(path, depth) or depth == CHARACTER_DEPTH:
+            return
+        for subdirectory in listSubdirectories(path):
+            self.addTree(subdirectory, depth + 1)
+
+    def read(self, timeout):
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset + INOTIFY_EVENT.size <= len(data):
+            wd, mask, _, nameSize = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            name = os.fsdecode(data[offset:offset + nameSize].rstrip(b"\0"))
+            offset += nameSize
+            if mask & IN_Q_OVERFLOW:
+                events.append((None, None, None, True))
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            if wd not in self.watches:
+                continue
+            path, depth = self.watches[wd]
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                events.append((os.path.dirname(path), os.path.basename(path), depth - 1, True))
+                continue
+            isDir = bool(mask & IN_ISDIR)
+            if isHidden(name) or (isDir and depth == CHARACTER_DEPTH):
+                continue
+            if isDir and mask & (IN_CREATE | IN_MOVED_TO):
+                # files created before the watch exists are picked up by the rescan of the new directory
+                self.addTree(os.path.join(path, name), depth + 1)
+            events.append((path, name, depth, isDir))
+        return events
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class PollingBackend(object):
+    """
+    Fallback watching by polling the directory mtimes. Saves through atomicWriteFile and deletes or renames
+    change the mtime of the character directory, files edited in place are not seen
+    """
+    def __init__(self, rootDirectory, interval=None, stopEvent=None):
+        self.rootDirectory = rootDirectory
+        self.interval = config.WATCH_POLL_INTERVAL if interval is None else interval
+        self.stopEvent = stopEvent or threading.Event()
+        # path -> (depth, mtime, {name: (mtime, size)}), only character directories keep their listing
+        self.snapshots = {}
+        self.snapshotTree(rootDirectory, ROOT_DEPTH)
+        self.lastPollTime = time.time()
+
+    def listFiles(self, path):
+        files = {}
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if not isHidden(entry.name) and entry.is_file():
+                        stat = entry.stat()
+                        files[entry.name] = (stat.st_mtime, stat.st_size)
+        except OSError:
+            pass
+        return files
+
+    def snapshotTree(self, path, depth):
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return
+        files = self.listFiles(path) if depth == CHARACTER_DEPTH else None
+        self.snapshots[path] = (depth, mtime, files)
+        if depth < CHARACTER_DEPTH:
+            for subdirectory in listSubdirectories(path):
+                self.snapshotTree(subdirectory, depth + 1)
+
+    def read(self, timeout):
+        remaining = self.lastPollTime + self.interval - time.time()
+        if self.stopEvent.wait(max(0.0, min(timeout, remaining))) or remaining > timeout:
+            return []
+        self.lastPollTime = time.time()
+        events = []
+        for path, (depth, mtime, files) in list(self.snapshots.items()):
+            if path not in self.snapshots:
+                # removed together with its parent during this pass
+                continue
+            try:
+                currentMtime = os.stat(path).st_mtime
+            except OSError:
+                self.removeTree(path)
+                events.append((os.path.dirname(path), os.path.basename(path), depth - 1, True))
+                continue
+            if currentMtime == mtime:
+                continue
+            if depth == CHARACTER_DEPTH:
+                currentFiles = self.listFiles(path)
+                for name in set(files) | set(currentFiles):
+                    if files.get(name) != currentFiles.get(name):
+                        events.append((path, name, depth, False))
+                self.snapshots[path] = (depth, currentMtime, currentFiles)
+            else:
+                self.snapshots[path] = (depth, currentMtime, None)
+                for subdirectory in listSubdirectories(path):
+                    if subdirectory not in self.snapshots:
+                        self.snapshotTree(subdirectory, depth + 1)
+                        events.append((path, os.path.basename(subdirectory), depth, True))
+        return events
+
+    def removeTree(self, path):
+        prefix = path + os.sep
+        for snapshotPath in list(self.snapshots.keys()):
+            if snapshotPath == path or snapshotPath.startswith(prefix):
+                del self.snapshots[snapshotPath]
+
+    def close(self):
+        self.stopEvent.set()
+
+
+class LibraryWatcher(object):
+    """
+    Report changes of the pose library in debounced batches.
+
+    The callback is called from the watcher thread with (changes, structureChanged): changes maps every
+    character directory with changed files to the set of file names that changed, structureChanged is True
+    when categories or characters were added or removed, or when the events overflowed and everything
+    must be rescanned. A burst of events, e.g. a pose and its thumbnail, is reported once the library
+    was quiet for the debounce delay.
+    """
+    def __init__(self, callback, rootDirectory=None, debounce=None, pollInterval=None, usePolling=False):
+        self.callback = callback
+        self.rootDirectory = os.path.normpath(rootDirectory or config.PROJECT_ROOT)
+        self.debounce = config.WATCH_DEBOUNCE if debounce is None else debounce
+        self.pollInterval = pollInterval
+        self.usePolling = usePolling
+        self.stopEvent = threading.Event()
+        self.backend = None
+        self.thread = None
+
+    def createBackend(self):
+        if not self.usePolling:
+            try:
+                return InotifyBackend(self.rootDirectory)
+            except (OSError, AttributeError):
+                pass
+        return PollingBackend(self.rootDirectory, self.pollInterval, self.stopEvent)
+
+    def start(self):
+        self.backend = self.createBackend()
+        self.thread = threading.Thread(target=self.run, name="LibraryWatcher")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self, timeout=5.0):
+        self.stopEvent.set()
+        if self.thread:
+            self.thread.join(timeout)
+            self.thread = None
+
+    def isPolling(self):
+        return isinstance(self.backend, PollingBackend)
+
+    def run(self):
+        changes = {}
+        structureChanged = False
+        firstEventTime = lastEventTime = None
+        try:
+            while not self.stopEvent.is_set():
+                timeout = self.debounce if lastEventTime is not None else 0.5
+                events = self.backend.read(timeout)
+                for directory, name, depth, isDir in events:
+                    lastEventTime = time.time()
+                    firstEventTime = firstEventTime or lastEventTime
+                    if directory is None or isDir:
+                        structureChanged = True
+                        # a new or removed character, its poses are read by the rescan
+                        if depth == CATEGORY_DEPTH:
+                            changes.setdefault(os.path.join(directory, name), set())
+                    elif depth == CHARACTER_DEPTH:
+                        changes.setdefault(directory, set()).add(name)
+                now = time.time()
+                # a library that never goes quiet, e.g. a large copy, is still reported regularly
+                if lastEventTime is not None and (now - lastEventTime >= self.debounce
+                                                  or now - firstEventTime >= self.debounce * 10):
+                    self.notify(changes, structureChanged)
+                    changes = {}
+                    structureChanged = False
+                    firstEventTime = lastEventTime = None
+        finally:
+            self.backend.close()
+
+    def notify(self, changes, structureChanged):
+        try:
+            self.callback(changes, structureChanged)
+        except Exception as e:
+            print("Library watcher callback failed: {}".format(e))
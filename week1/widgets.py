@@ -1,8 +1,10 @@
 from PySide2.QtWidgets import QTreeWidget, QApplication, QTreeWidgetItem, QAbstractItemView, QLineEdit, QWidget, \
-    QVBoxLayout, QTreeWidgetItemIterator, QListWidget, QListView, QListWidgetItem, QCheckBox, QHBoxLayout, QLabel, QHeaderView
+    QVBoxLayout, QTreeWidgetItemIterator, QListWidget, QListView, QListWidgetItem, QCheckBox, QHBoxLayout, QLabel, QHeaderView, \
+    QTableWidgetItem
 from PySide2.QtGui import QFont, QImage, QPixmap, QColor
 from PySide2.QtCore import Qt, Signal, QSize, QRect
 from . import config
+from . import searchindex
 from . import utils
 import os
 
@@ -105,6 +107,11 @@ class TreeWidget(QTreeWidget):
         print("Current selected item is {}". format(item.text(column)))
 
 class QSearchLineEdit(QLineEdit):
+    #ranked pose matches of the library search index, list of searchindex.SearchDocument
+    resultsChanged = Signal(list)
+    #emitted from the index build thread, queued to the widget thread
+    indexReady = Signal()
+    
     def __init__(self, treeWidget, parent=None):
         """
         create a QLineEdit that finds matches over items in a QTreeWidget
@@ -113,16 +120,33 @@ class QSearchLineEdit(QLineEdit):
         """
         super(QSearchLineEdit, self).__init__(parent=parent)
         self.setTreeWidget(treeWidget)
+        self.searchIndex = None
         self.setPlaceholderText("Search")
         self.textChanged.connect(self.search)
+        self.indexReady.connect(self.refreshSearch)
         
     def setTreeWidget(self, treeWidget):
         self.treeWidget = treeWidget
+    
+    def setSearchIndex(self, searchIndex):
+        """
+        search the whole library with a searchindex.LibrarySearchIndex, the tree item names are
+        filtered as before until the index is built
+        """
+        self.searchIndex = searchIndex
+        searchIndex.addListener(self.indexReady.emit)
+    
+    def refreshSearch(self):
+        self.search(self.text())
         
     def search(self, searchText):
         """string match, fuzzy search
         :param searchText: str
         """
+        index = self.searchIndex.get() if self.searchIndex else None
+        if index is not None:
+            self.searchIndexed(index, searchText)
+            return
         iterator = QTreeWidgetItemIterator(self.treeWidget, flags= QTreeWidgetItemIterator.Selectable)
         if searchText:
             while iterator.value():
@@ -142,6 +166,33 @@ class QSearchLineEdit(QLineEdit):
             
             self.treeWidget.collapseAll()
     
+    def searchIndexed(self, index, searchText):
+        """show the characters whose name matches and publish the ranked pose matches"""
+        root = self.treeWidget.invisibleRootItem()
+        if not searchText:
+            for i in range(root.childCount()):
+                categoryItem = root.child(i)
+                categoryItem.setHidden(False)
+                for j in range(categoryItem.childCount()):
+                    categoryItem.child(j).setHidden(False)
+            self.treeWidget.collapseAll()
+            self.resultsChanged.emit([])
+            return
+        
+        matchedCharacters = set((document.category, document.name) for document in
+                                index.search(searchText, limit=None, kinds=[searchindex.CHARACTER_KIND]))
+        for i in range(root.childCount()):
+            categoryItem = root.child(i)
+            categoryVisible = False
+            for j in range(categoryItem.childCount()):
+                characterItem = categoryItem.child(j)
+                visible = (categoryItem.text(0), characterItem.text(0)) in matchedCharacters
+                characterItem.setHidden(not visible)
+                categoryVisible = categoryVisible or visible
+            categoryItem.setHidden(not categoryVisible)
+            categoryItem.setExpanded(categoryVisible)
+        self.resultsChanged.emit(index.search(searchText, kinds=[searchindex.POSE_KIND]))
+    
 class SearchableTreeWidget(QWidget):
     """
     A tree widget with search functionality.
@@ -152,6 +203,8 @@ class SearchableTreeWidget(QWidget):
     """
     #itemChanged = Signal(str, str)
     itemClicked = Signal(QTreeWidgetItem, int)    #this is a clicked signal, trigger the function, itemClicked
+    #a pose picked in the search results: category, character, pose name
+    poseActivated = Signal(str, str, str)
 
     def __init__(self, data, parent=None):
         super(SearchableTreeWidget, self).__init__(parent=parent)
@@ -167,11 +220,32 @@ class SearchableTreeWidget(QWidget):
         
         self.treeWidget = TreeWidget(data=self.data, )
         self.searchLineEdit = QSearchLineEdit(self.treeWidget)
+        #library wide pose matches, only shown while searching
+        self.searchResultsListWidget = QListWidget()
+        self.searchResultsListWidget.hide()
         mainLayout.addWidget(self.searchLineEdit)
+        mainLayout.addWidget(self.searchResultsListWidget)
         mainLayout.addWidget(self.treeWidget)
         
         #self.treeWidget.currentItemChanged.connect(self.treeWidgetItemChanged)
         self.treeWidget.itemClicked.connect(self.treeWidgetItemClicked)
+        self.searchLineEdit.resultsChanged.connect(self.showSearchResults)
+        self.searchResultsListWidget.itemClicked.connect(self.searchResultClicked)
+    
+    def setSearchIndex(self, searchIndex):
+        self.searchLineEdit.setSearchIndex(searchIndex)
+    
+    def showSearchResults(self, documents):
+        self.searchResultsListWidget.clear()
+        for document in documents:
+            item = QListWidgetItem("{}  ({} / {})".format(document.name, document.category, document.character))
+            item.setData(Qt.UserRole, (document.category, document.character, document.name))
+            self.searchResultsListWidget.addItem(item)
+        self.searchResultsListWidget.setVisible(bool(documents))
+    
+    def searchResultClicked(self, item):
+        category, character, poseName = item.data(Qt.UserRole)
+        self.poseActivated.emit(category, character, poseName)
 
     # def treeWidgetItemChanged(self, current, previous):
     #     if current:
@@ -193,8 +267,10 @@ class SearchableTreeWidget(QWidget):
         else:
             return str()
 
-    def setSelectedItem(self, itemText):
+    def setSelectedItem(self, itemText, parentText=None):
         items = self.treeWidget.findItems(itemText, Qt.MatchExactly | Qt.MatchRecursive)
+        if parentText is not None:
+            items = [item for item in items if item.parent() and item.parent().text(0) == parentText]
         if items:
             item = items[0]
             # expand parent item if necessary
@@ -204,6 +280,21 @@ class SearchableTreeWidget(QWidget):
                 parent = parent.parent()
             self.treeWidget.setCurrentItem(item)
 
+    def setData(self, data):
+        """repopulate the tree with new data, keeping the selected item and the expanded categories"""
+        selectedText = self.getSelectedText()
+        root = self.treeWidget.invisibleRootItem()
+        expanded = [root.child(i).text(0) for i in range(root.childCount()) if root.child(i).isExpanded()]
+        self.data = data if data else {}
+        self.treeWidget.data = self.data
+        self.treeWidget.populateTree()
+        for i in range(root.childCount()):
+            root.child(i).setExpanded(root.child(i).text(0) in expanded)
+        if selectedText:
+            self.setSelectedItem(selectedText)
+        if self.searchLineEdit.text():
+            self.searchLineEdit.refreshSearch()
+
 
 class IconViewListWidgetItem(QWidget):
     favouriteChecked = Signal(str, bool)
@@ -220,10 +311,25 @@ class IconViewListWidgetItem(QWidget):
         self.poseData = poseData
         imageFile = self.poseData.get("imgFile")
         self.imagePath = imageFile if os.path.exists(imageFile) else os.path.join(config.ICON_DIR, "noImage.png")
+        #thumbnails of packed poses are loaded from memory
+        self.imageData = self.poseData.get("imgData")
         self.isPoseFavourite = self.poseData.get("favourite", False)
     
+    def setPoseData(self, poseName, poseData):
+        """update the item in place when its pose or thumbnail changed on disk"""
+        self.initData(poseName, poseData)
+        self.initAsset()
+        self.poseLabel.setText(poseName)
+        self.favoritesCheckBox.blockSignals(True)
+        self.favoritesCheckBox.setChecked(self.isPoseFavourite)
+        self.favoritesCheckBox.blockSignals(False)
+        self.setImage()
+    
     def initAsset(self):
-        self.image = QImage(QImage(self.imagePath))
+        if self.imageData:
+            self.image = QImage.fromData(self.imageData)
+        else:
+            self.image = QImage(QImage(self.imagePath))
     
     def initSize(self, width, height):
         self.width = width
@@ -335,6 +441,24 @@ class IconViewListWidgetItem(QWidget):
     def setFavourite(self, state):
         self.favoritesCheckBox.setChecked(state)
         
+class PoseListWidgetItem(QListWidgetItem):
+    """icon view item ordered by the rank the pose sort index gives it, see PoseLibraryUI.reorderPoseView"""
+    def __init__(self):
+        super(PoseListWidgetItem, self).__init__()
+        self.sortRank = 0
+    
+    def __lt__(self, other):
+        return self.sortRank < getattr(other, "sortRank", 0)
+    
+class TimestampTableWidgetItem(QTableWidgetItem):
+    """table item showing a formatted date and sorting on its epoch timestamp"""
+    def __init__(self, text, timestamp):
+        super(TimestampTableWidgetItem, self).__init__(text)
+        self.timestamp = timestamp or 0.0
+    
+    def __lt__(self, other):
+        return self.timestamp < getattr(other, "timestamp", 0.0)
+    
 class IconViewListWidget(QListWidget):
     def __init__(self):
         super(IconViewListWidget, self).__init__()
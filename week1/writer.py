@@ -0,0 +1,151 @@
+import os
+import threading
+import time
+
+from . import poseio
+from . import utils
+
+
+class PoseWriteQueue(object):
+    """
+    Serialise and save poses on a background thread so the UI never waits on the disk.
+
+    Saving the same path again before the previous save was committed replaces the pending pose,
+    only the latest version is written. Every file is committed with utils.atomicWriteFile.
+    Listeners are called from the writer thread with (filepath, error), error is None on success.
+    """
+    def __init__(self):
+        self.condition = threading.Condition()
+        # filepath -> (poseData, namespace, meta), in submission order
+        self.pending = {}
+        self.inFlight = None
+        self.listeners = []
+        self.thread = None
+        self.running = True
+        self.committedCount = 0
+        self.coalescedCount = 0
+
+    def addListener(self, listener):
+        with self.condition:
+            if listener not in self.listeners:
+                self.listeners.append(listener)
+
+    def removeListener(self, listener):
+        with self.condition:
+            if listener in self.listeners:
+                self.listeners.remove(listener)
+
+    def submit(self, filepath, poseData, namespace=None, meta=None):
+        """
+        Queue a pose to be saved
+        Args:
+            filepath (str): Path to save the pose file
+            poseData (dict): Pose data to save, copied so the caller can keep editing it
+            namespace (str): Namespace stored in the pose header
+            meta (dict): Metadata header, built on the writer thread if not given
+        """
+        poseio.validatePoseData(poseData)
+        with self.condition:
+            if not self.running:
+                raise RuntimeError("The pose write queue has been shut down")
+            if filepath in self.pending:
+                self.coalescedCount += 1
+            self.pending[filepath] = (dict(poseData), namespace, meta)
+            self.ensureThread()
+            self.condition.notify_all()
+
+    def ensureThread(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self.run, name="PoseWriteQueue")
+            self.thread.daemon = True
+            self.thread.start()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and not self.pending:
+                    self.condition.wait()
+                if not self.pending:
+                    return
+                filepath = next(iter(self.pending))
+                poseData, namespace, meta = self.pending.pop(filepath)
+                self.inFlight = filepath
+                listeners = list(self.listeners)
+
+            error = None
+            try:
+                if meta is None:
+                    poseName = os.path.splitext(os.path.basename(filepath))[0]
+                    meta = poseio.buildPoseMetadata(poseData, poseName=poseName, namespace=namespace)
+                utils.atomicWriteFile(filepath, poseio.encodePoseFile(filepath, poseData, meta))
+            except Exception as e:
+                error = e
+
+            with self.condition:
+                self.inFlight = None
+                if error is None:
+                    self.committedCount += 1
+                self.condition.notify_all()
+
+            for listener in listeners:
+                try:
+                    listener(filepath, error)
+                except Exception as e:
+                    print("Pose write listener failed for {}: {}".format(filepath, e))
+
+    def isPending(self, filepath):
+        with self.condition:
+            return filepath in self.pending or filepath == self.inFlight
+
+    def flush(self, timeout=None):
+        """
+        Block until every queued pose is committed
+        Args:
+            timeout (float): Maximum time to wait in seconds, None waits forever
+        Returns:
+            bool: True if the queue is empty, False if the timeout expired first
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self.condition:
+            while self.pending or self.inFlight:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+    def wait(self, filepath, timeout=None):
+        """Block until one pose path has no pending write, returns False if the timeout expired first"""
+        deadline = None if timeout is None else time.time() + timeout
+        with self.condition:
+            while filepath in self.pending or filepath == self.inFlight:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+    def shutdown(self, flush=True, timeout=None):
+        """Stop the writer thread, by default after committing the queued poses"""
+        if flush:
+            self.flush(timeout)
+        with self.condition:
+            self.running = False
+            if not flush:
+                self.pending.clear()
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+
+_writeQueue = None
+_writeQueueLock = threading.Lock()
+
+
+def getWriteQueue():
+    """Process wide pose write queue shared by the UI and batch scripts"""
+    global _writeQueue
+    with _writeQueueLock:
+        if _writeQueue is None or not _writeQueue.running:
+            _writeQueue = PoseWriteQueue()
+        return _writeQueue